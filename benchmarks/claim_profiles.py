@@ -0,0 +1,46 @@
+"""Microbenchmark of the full and compact claim profiles of issued tokens.
+
+Reports the size of access tokens and the time to sign and verify them per
+profile. Run with `python benchmarks/claim_profiles.py`."""
+
+import timeit
+import uuid
+
+from pydantic import SecretStr
+
+from pyservice.auth.token import sign_access_token, verify_token
+from pyservice.context import temporary_settings
+
+SETTINGS = {
+    "JWT_KEY": SecretStr("benchmark-key-with-at-least-32-bytes"),
+    "JWT_ISSUER_ID": "https://pyservice-bench.example.com/",
+    "JWT_AUDIENCE": ["ios", "android"],
+}
+
+PROFILES = {
+    "full": {"JWT_CLAIM_PROFILE": "full"},
+    "compact": {"JWT_CLAIM_PROFILE": "compact"},
+    "compact+issuer": {"JWT_CLAIM_PROFILE": "compact", "JWT_COMPACT_ISSUER": "pys"},
+}
+
+
+def _per_op_ns(operation, number: int = 20_000) -> float:
+    elapsed = min(timeit.repeat(operation, number=number, repeat=5))
+    return elapsed / number * 1e9
+
+
+def main():
+    sub = uuid.uuid4()
+    email = "firstname.lastname@pyservice-bench.example.com"
+
+    print(f"{'profile':<16} {'bytes':>6} {'sign ns/op':>12} {'verify ns/op':>14}")
+    for name, updates in PROFILES.items():
+        with temporary_settings(updates={**SETTINGS, **updates}):
+            token, _ = sign_access_token(sub=sub, email=email)
+            sign = _per_op_ns(lambda: sign_access_token(sub=sub, email=email))
+            verify = _per_op_ns(lambda: verify_token(token))
+        print(f"{name:<16} {len(token):>6} {sign:>12.0f} {verify:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Microbenchmark of the per-request overhead of the context models.
+
+Run with `python benchmarks/context.py`."""
+
+import timeit
+import uuid
+
+from pydantic import SecretStr
+
+from pyservice.auth.token import (
+    get_token_config,
+    sign_access_token,
+    verify_token,
+)
+from pyservice.context import SettingsContext, temporary_settings
+
+SETTINGS = {
+    "JWT_KEY": SecretStr("benchmark-key-with-at-least-32-bytes"),
+    "JWT_ISSUER_ID": "https://pyservice-bench/",
+    "JWT_AUDIENCE": ["ios", "android"],
+}
+
+
+def _read_settings():
+    settings = SettingsContext.get().settings
+    return (
+        settings.JWT_KEY,
+        settings.JWT_ISSUER_ID,
+        settings.JWT_AUDIENCE,
+        settings.JWT_TOKEN_ACCESS_DURATION,
+    )
+
+
+def _read_token_config():
+    return get_token_config()
+
+
+def _enter_validated_context():
+    settings = SettingsContext.get().settings
+    with SettingsContext(settings=settings):
+        pass
+
+
+def _enter_unchecked_context():
+    settings = SettingsContext.get().settings
+    with SettingsContext.unchecked(settings=settings):
+        pass
+
+
+def _enter_temporary_settings():
+    with temporary_settings({"LOG_LEVEL": "INFO"}):
+        pass
+
+
+def _report(name: str, func, number: int = 20_000):
+    elapsed = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name:<32} {elapsed / number * 1e9:>10.0f} ns/op")
+
+
+def main():
+    with temporary_settings(SETTINGS):
+        sub = uuid.uuid4()
+        token, _ = sign_access_token(sub=sub, email="bench@pyservice.io")
+
+        _report("read settings fields", _read_settings)
+        _report("read token config", _read_token_config)
+        _report("enter validated context", _enter_validated_context)
+        _report("enter unchecked context", _enter_unchecked_context)
+        _report("temporary_settings", _enter_temporary_settings)
+        _report(
+            "sign_access_token",
+            lambda: sign_access_token(sub=sub, email="bench@pyservice.io"),
+            number=2_000,
+        )
+        _report("verify_token", lambda: verify_token(token), number=2_000)
+
+
+if __name__ == "__main__":
+    main()
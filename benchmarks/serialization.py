@@ -0,0 +1,58 @@
+"""Microbenchmark of the per-request cost of serializing a token response.
+
+Run with `python benchmarks/serialization.py`."""
+
+import timeit
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from pyservice.api.responses import PydanticJSONResponse
+from pyservice.auth.token import TokenResult
+
+RESULT = TokenResult(
+    access_token="a" * 400,
+    expires_in=10800,
+    refresh_token="r" * 400,
+)
+
+FIELD = create_model_field(
+    name="Response_refresh", type_=TokenResult, mode="serialization"
+)
+
+
+async def _response_model():
+    # A route with a response_model: validate, jsonable_encoder, json.dumps.
+    content = await serialize_response(field=FIELD, response_content=RESULT)
+    return JSONResponse(content)
+
+
+async def _pydantic_json_response():
+    return PydanticJSONResponse(RESULT)
+
+
+def _run(coroutine_function):
+    # None of the paths suspend, step the coroutine without an event loop.
+    coroutine = coroutine_function()
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError(f"{coroutine_function.__name__} suspended")
+
+
+def _report(name: str, coroutine_function, number: int = 20_000):
+    elapsed = min(
+        timeit.repeat(lambda: _run(coroutine_function), number=number, repeat=5)
+    )
+    print(f"{name:<32} {elapsed / number * 1e9:>10.0f} ns/op")
+
+
+def main():
+    _report("response_model", _response_model)
+    _report("PydanticJSONResponse", _pydantic_json_response)
+
+
+if __name__ == "__main__":
+    main()
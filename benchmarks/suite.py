@@ -0,0 +1,475 @@
+"""Benchmarks of the hot paths, with results comparable between runs.
+
+Run with `python benchmarks/suite.py run --json results.json`. The store
+benchmarks run against the database configured by the API_DATABASE_*
+settings, e.g. the docker-compose one, and are skipped with `--no-db`.
+
+Compare two runs with `python benchmarks/suite.py compare base.json
+new.json`, it exits with 1 if the median time of any benchmark grew by more
+than `--threshold`. Compare runs of the same machine and python version
+only, the environment of both is checked and differences are reported."""
+
+import argparse
+import asyncio
+import datetime
+import fnmatch
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import jwt
+from pydantic import SecretStr
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from pyservice.auth.context import HashContext
+from pyservice.auth.token import (
+    Token,
+    sign_access_token,
+    sign_refresh_token,
+    verify_token,
+)
+from pyservice.context import temporary_settings
+from pyservice.pg.context import get_database_url
+from pyservice.pg.models import Base, PGUser
+from pyservice.pg.store import Store
+from pyservice.pg.utils import UserIdentity, UserIdentityType
+from pyservice.user import UserCreate
+from pyservice.version import __version__
+
+SETTINGS = {
+    "JWT_KEY": SecretStr("benchmark-key-with-at-least-32-bytes"),
+    "JWT_ISSUER_ID": "https://pyservice-bench/",
+    "JWT_AUDIENCE": ["ios", "android"],
+    "API_TRACE_EXPORTER": None,
+}
+"Fixed settings, so results don't depend on the environment of the run."
+
+FORMAT_VERSION = 1
+
+
+@dataclass(slots=True)
+class Benchmark:
+    name: str
+    run: Callable[[], Any]
+    asynchronous: bool = False
+
+
+@dataclass(slots=True)
+class Result:
+    name: str
+    number: int
+    "Operations per repeat."
+
+    samples_ns: list[float]
+    "Nanoseconds per operation, one sample per repeat."
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "median_ns": statistics.median(self.samples_ns),
+            "min_ns": min(self.samples_ns),
+            "stdev_ns": (
+                statistics.stdev(self.samples_ns) if len(self.samples_ns) > 1 else 0.0
+            ),
+            "number": self.number,
+            "samples_ns": self.samples_ns,
+        }
+
+
+def _token_benchmarks() -> list[Benchmark]:
+    sub = uuid.UUID(int=1)
+    email = "bench@pyservice.io"
+    access_token, _ = sign_access_token(sub=sub, email=email)
+    claims = jwt.decode(access_token, options={"verify_signature": False})
+
+    return [
+        Benchmark(
+            "token.sign_access_token", lambda: sign_access_token(sub=sub, email=email)
+        ),
+        Benchmark(
+            "token.sign_refresh_token",
+            lambda: sign_refresh_token(sub=sub, email=email),
+        ),
+        Benchmark("token.verify_token", lambda: verify_token(access_token)),
+        Benchmark("token.Token.model_validate", lambda: Token.model_validate(claims)),
+    ]
+
+
+def _hash_benchmarks() -> list[Benchmark]:
+    crypt = HashContext.get().crypt
+    refresh_token, _ = sign_refresh_token(sub=uuid.UUID(int=1), email="b@b.io")
+    token_hash = crypt.hash(refresh_token)
+
+    return [
+        Benchmark("hash.hash", lambda: crypt.hash(refresh_token)),
+        Benchmark("hash.verify", lambda: crypt.verify(refresh_token, token_hash)),
+    ]
+
+
+def _identity_benchmarks() -> list[Benchmark]:
+    identity_type = UserIdentityType()
+    dialect = postgresql.asyncpg.dialect()  # type: ignore[attr-defined]
+    identity = UserIdentity(provider="apple", id="001234.abcdef0123456789.0123")
+    value = str(identity)
+
+    return [
+        Benchmark(
+            "identity.bind",
+            lambda: identity_type.process_bind_param(identity, dialect),
+        ),
+        Benchmark(
+            "identity.result",
+            lambda: identity_type.process_result_value(value, dialect),
+        ),
+    ]
+
+
+class _StoreBenchmarks:
+    """Every operation runs in a transaction of its own, as in a request.
+
+    Users are created with an identity provider unique to the run and
+    deleted afterwards, with their tokens and revocations."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._provider = f"bench-{uuid.uuid4().hex[:8]}"
+        self._counter = 0
+        self._user_id: uuid.UUID | None = None
+        self._refresh_token: str | None = None
+
+    async def setup(self):
+        async with self._engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with self._session() as session, session.begin():
+            store = Store(session)
+            # A page of users to stream.
+            for _ in range(100):
+                await store.create_user(self._next_user())
+            self._user_id = await store.create_user(self._next_user())
+            self._refresh_token = await store.rotate_refresh_token(self._user_id)
+
+    async def teardown(self):
+        async with self._session() as session, session.begin():
+            await session.execute(
+                delete(PGUser).where(
+                    PGUser.identity.startswith(f"{self._provider}:", autoescape=True)
+                )
+            )
+        await self._engine.dispose()
+
+    def benchmarks(self) -> list[Benchmark]:
+        return [
+            Benchmark("store.create_user", self._create_user, asynchronous=True),
+            Benchmark(
+                "store.create_user.exists_ok", self._upsert_user, asynchronous=True
+            ),
+            Benchmark("store.read_user_email", self._read_email, asynchronous=True),
+            Benchmark("store.stream_users", self._stream_users, asynchronous=True),
+            Benchmark(
+                "store.rotate_refresh_token", self._rotate_token, asynchronous=True
+            ),
+            Benchmark("store.revoke_token", self._revoke_token, asynchronous=True),
+            Benchmark(
+                "store.read_revoked_tokens", self._read_revoked, asynchronous=True
+            ),
+            Benchmark(
+                "store.expire_refresh_tokens", self._expire_tokens, asynchronous=True
+            ),
+            Benchmark(
+                "store.delete_expired_revocations",
+                self._delete_revocations,
+                asynchronous=True,
+            ),
+        ]
+
+    def _session(self) -> AsyncSession:
+        return AsyncSession(self._engine, expire_on_commit=False, autobegin=False)
+
+    def _next_user(self) -> UserCreate:
+        self._counter += 1
+        return UserCreate(
+            email=f"{self._provider}-{self._counter}@pyservice.io",
+            identity_provider=self._provider,
+            identity_provider_id=str(self._counter),
+        )
+
+    async def _in_transaction(self, operation: Callable[[Any], Awaitable[Any]]):
+        async with self._session() as session, session.begin():
+            return await operation(Store(session))
+
+    async def _create_user(self):
+        user = self._next_user()
+        await self._in_transaction(lambda store: store.create_user(user))
+
+    async def _upsert_user(self):
+        user = UserCreate(
+            email=f"{self._provider}-1@pyservice.io",
+            identity_provider=self._provider,
+            identity_provider_id="1",
+        )
+        await self._in_transaction(
+            lambda store: store.create_user(user, exists_ok=True)
+        )
+
+    async def _read_email(self):
+        await self._in_transaction(lambda store: store.read_user_email(self._user_id))
+
+    async def _stream_users(self):
+        async def stream(store):
+            users = store.stream_users(limit=100, identity_provider=self._provider)
+            return [user async for user in users]
+
+        await self._in_transaction(stream)
+
+    async def _rotate_token(self):
+        assert self._user_id is not None
+        self._refresh_token = await self._in_transaction(
+            lambda store: store.rotate_refresh_token(
+                self._user_id, token=self._refresh_token
+            )
+        )
+
+    async def _revoke_token(self):
+        exp = int(time.time()) + 3600
+        await self._in_transaction(
+            lambda store: store.revoke_token(self._user_id, uuid.uuid4().hex, exp)
+        )
+
+    async def _read_revoked(self):
+        await self._in_transaction(lambda store: store.read_revoked_tokens())
+
+    async def _expire_tokens(self):
+        issued_before = datetime.datetime(2000, 1, 1)
+        await self._in_transaction(
+            lambda store: store.expire_refresh_tokens(issued_before, limit=1000)
+        )
+
+    async def _delete_revocations(self):
+        await self._in_transaction(
+            lambda store: store.delete_expired_revocations(limit=1000)
+        )
+
+
+def _calibrate(time_once: Callable[[int], float], min_time: float) -> int:
+    """Find how many operations take at least `min_time`, like timeit's
+    autorange."""
+    number = 1
+    while True:
+        if time_once(number) >= min_time:
+            return number
+        number *= 2 if number < 8 else 5
+
+
+def _time_sync(func: Callable[[], Any], number: int) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+async def _time_async(func: Callable[[], Awaitable[Any]], number: int) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(number):
+        await func()
+    return time.perf_counter() - start
+
+
+def _measure(benchmark: Benchmark, *, min_time: float, repeat: int) -> Result:
+    number = _calibrate(lambda n: _time_sync(benchmark.run, n), min_time)
+    samples = [_time_sync(benchmark.run, number) / number * 1e9 for _ in range(repeat)]
+    return Result(benchmark.name, number, samples)
+
+
+async def _measure_async(
+    benchmark: Benchmark, *, min_time: float, repeat: int
+) -> Result:
+    number = 1
+    while await _time_async(benchmark.run, number) < min_time:
+        number *= 2 if number < 8 else 5
+    samples = [
+        await _time_async(benchmark.run, number) / number * 1e9 for _ in range(repeat)
+    ]
+    return Result(benchmark.name, number, samples)
+
+
+def _environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "pyservice": __version__,
+        "commit": commit,
+        "started_at": datetime.datetime.now(datetime.UTC).isoformat(),
+    }
+
+
+def _selected(benchmarks: list[Benchmark], patterns: list[str]) -> list[Benchmark]:
+    if not patterns:
+        return benchmarks
+    return [
+        benchmark
+        for benchmark in benchmarks
+        if any(fnmatch.fnmatch(benchmark.name, pattern) for pattern in patterns)
+    ]
+
+
+def _print_result(result: Result):
+    median = statistics.median(result.samples_ns)
+    spread = (max(result.samples_ns) - min(result.samples_ns)) / median * 100
+    print(
+        f"{result.name:<36} {median:>14.0f} ns/op {1e9 / median:>12.0f} ops/s "
+        f"±{spread:>4.1f}%",
+        flush=True,
+    )
+
+
+async def _run_store(args: argparse.Namespace) -> list[Result]:
+    store = _StoreBenchmarks(create_async_engine(get_database_url()))
+    benchmarks = _selected(store.benchmarks(), args.filter)
+    if not benchmarks:
+        return []
+
+    await store.setup()
+    results = []
+    try:
+        for benchmark in benchmarks:
+            result = await _measure_async(
+                benchmark, min_time=args.min_time, repeat=args.repeat
+            )
+            _print_result(result)
+            results.append(result)
+    finally:
+        await store.teardown()
+    return results
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    random.seed(0)
+    results: list[Result] = []
+    with temporary_settings(updates=SETTINGS):
+        benchmarks = _token_benchmarks() + _hash_benchmarks() + _identity_benchmarks()
+        for benchmark in _selected(benchmarks, args.filter):
+            result = _measure(benchmark, min_time=args.min_time, repeat=args.repeat)
+            _print_result(result)
+            results.append(result)
+
+        if not args.no_db:
+            results += asyncio.run(_run_store(args))
+
+    return {
+        "version": FORMAT_VERSION,
+        "environment": _environment(),
+        "settings": {"min_time": args.min_time, "repeat": args.repeat},
+        "results": {result.name: result.as_dict() for result in results},
+    }
+
+
+def compare(base: dict[str, Any], new: dict[str, Any], threshold: float) -> bool:
+    """Print the change of every benchmark in both runs, return whether any
+    regressed by more than `threshold`, e.g. 0.1 for 10% slower."""
+    for key in ("python", "implementation", "machine", "cpu_count"):
+        if base["environment"].get(key) != new["environment"].get(key):
+            print(
+                f"warning: {key} differs, {base['environment'].get(key)} "
+                f"vs {new['environment'].get(key)}"
+            )
+
+    regressed = False
+    print(f"{'benchmark':<36} {'base ns':>12} {'new ns':>12} {'change':>8}")
+    for name in sorted(base["results"].keys() | new["results"].keys()):
+        if name not in new["results"]:
+            print(f"{name:<36} {'missing in new run':>34}")
+            continue
+        if name not in base["results"]:
+            print(f"{name:<36} {'new':>34}")
+            continue
+
+        before = base["results"][name]["median_ns"]
+        after = new["results"][name]["median_ns"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        elif change < -threshold:
+            flag = "  improved"
+        print(f"{name:<36} {before:>12.0f} {after:>12.0f} {change:>+8.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python benchmarks/suite.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "filter", nargs="*", help="Only run benchmarks matching these globs."
+    )
+    run_parser.add_argument("--json", type=Path, help="Write the results here.")
+    run_parser.add_argument(
+        "--no-db", action="store_true", help="Skip the store benchmarks."
+    )
+    run_parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="Seconds every repeat runs at least.",
+    )
+    run_parser.add_argument("--repeat", type=int, default=5)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two runs and flag regressions."
+    )
+    compare_parser.add_argument("base", type=Path)
+    compare_parser.add_argument("new", type=Path)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="The relative slowdown flagged as a regression.",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run(args)
+        if args.json is not None:
+            args.json.write_text(json.dumps(report, indent=2))
+    else:
+        base = json.loads(args.base.read_text())
+        new = json.loads(args.new.read_text())
+        if compare(base, new, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
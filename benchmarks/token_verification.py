@@ -0,0 +1,60 @@
+"""Microbenchmark of verifying the access tokens this service issued.
+
+Compares validating the decoded claims as a `Token` with the trusted claims
+`verify_token` returns. Run with `python benchmarks/token_verification.py`."""
+
+import timeit
+import uuid
+
+import jwt
+from pydantic import SecretStr
+
+from pyservice.auth.revocation import is_revoked
+from pyservice.auth.token import (
+    Token,
+    get_token_config,
+    sign_access_token,
+    verify_token,
+)
+from pyservice.context import temporary_settings
+
+SETTINGS = {
+    "JWT_KEY": SecretStr("benchmark-key-with-at-least-32-bytes"),
+    "JWT_ISSUER_ID": "https://pyservice-bench/",
+    "JWT_AUDIENCE": ["ios", "android"],
+}
+
+
+def _verify_validated(token: str) -> Token:
+    # verify_token before trusted claims: decode, then validate as a Token.
+    config = get_token_config()
+    header = jwt.get_unverified_header(token)
+    key = config.keyring.verification_key(header.get("kid"))
+    assert key is not None
+    decoded = jwt.decode(
+        token,
+        key.verifying_key,
+        algorithms=[key.algorithm],
+        issuer=config.issuer,
+        audience=config.audience,
+    )
+    assert not is_revoked(decoded.get("jti"))
+    return Token.model_validate(decoded)
+
+
+def _report(name: str, verify, token: str, number: int = 20_000):
+    elapsed = min(timeit.repeat(lambda: verify(token), number=number, repeat=5))
+    per_op = elapsed / number
+    print(f"{name:<24} {per_op * 1e9:>10.0f} ns/op {1 / per_op:>10.0f} ops/s")
+
+
+def main():
+    with temporary_settings(updates=SETTINGS):
+        token, _ = sign_access_token(sub=uuid.uuid4(), email="bench@pyservice.io")
+
+        _report("Token.model_validate", _verify_validated, token)
+        _report("TrustedClaims", verify_token, token)
+
+
+if __name__ == "__main__":
+    main()
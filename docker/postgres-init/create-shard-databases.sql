@@ -0,0 +1,3 @@
+-- Extra databases to run sharded setups and their tests against locally.
+CREATE DATABASE pyservice_shard_1;
+CREATE DATABASE pyservice_shard_2;
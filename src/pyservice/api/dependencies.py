@@ -1,19 +1,61 @@
+import hmac
+import time
 from typing import Annotated
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from pyservice.auth.token import RefreshTokenStore
-from pyservice.pg.context import DatabaseContext
+from pyservice.auth.token import RefreshTokenStore, RevokedTokenStore
+from pyservice.context import SettingsContext
+from pyservice.exc import AuthInvalidTokenError
+from pyservice.metrics import counter, histogram
+from pyservice.pg.context import DEFAULT_POOL, DatabaseContext
+from pyservice.pg.sharding import ShardedStore
 from pyservice.pg.store import Store
+from pyservice.tracing import span
 from pyservice.user import UserStore
 
 
-async def get_database_tx():
+_POOL_WAIT = histogram(
+    "pyservice_db_pool_wait_seconds",
+    "Time requests waited for a database connection, by pool.",
+    labelnames=("pool",),
+)
+_POOL_TIMEOUTS = counter(
+    "pyservice_db_pool_timeouts",
+    "Requests that got no database connection in time, by pool.",
+    labelnames=("pool",),
+)
+
+
+def route_pool(ctx: DatabaseContext, request: Request) -> str | None:
+    """Return the pool named by the first tag of the request's route that
+    names one, None for the default pool."""
+    route = request.scope.get("route")
+    for tag in getattr(route, "tags", None) or ():
+        if tag in ctx.pools:
+            return tag
+    return None
+
+
+async def get_database_tx(request: Request):
     ctx = DatabaseContext.get()
-    async with ctx.session() as session:
+    pool = route_pool(ctx, request)
+    label = pool or DEFAULT_POOL
+    async with ctx.session(pool) as session:
         async with session.begin():
+            # Check out the connection up front, to measure waiting for the pool.
+            with span("db.checkout", pool=label):
+                start = time.perf_counter()
+                try:
+                    await session.connection()
+                except PoolTimeoutError:
+                    _POOL_TIMEOUTS.inc(label)
+                    raise
+                finally:
+                    _POOL_WAIT.observe(time.perf_counter() - start, label)
             yield session
 
 
@@ -21,10 +63,38 @@ DatabaseTx = Annotated[AsyncSession, Depends(get_database_tx)]
 
 
 async def get_database_store(tx: DatabaseTx):
-    return Store(tx)
+    ctx = DatabaseContext.get()
+    if not ctx.shards:
+        yield Store(tx)
+        return
+
+    # Shard transactions commit here, before the primary transaction.
+    async with ShardedStore(ctx, tx) as store:
+        yield store
 
 
 RefreshTokenStoreImpl = Annotated[RefreshTokenStore, Depends(get_database_store)]
 UserStoreImpl = Annotated[UserStore, Depends(get_database_store)]
+RevokedTokenStoreImpl = Annotated[RevokedTokenStore, Depends(get_database_store)]
 
 BearerToken = Annotated[HTTPAuthorizationCredentials, Depends(HTTPBearer())]
+OptionalBearerToken = Annotated[
+    HTTPAuthorizationCredentials | None, Depends(HTTPBearer(auto_error=False))
+]
+
+
+async def require_internal_caller(credentials: OptionalBearerToken):
+    ctx = SettingsContext.get()
+
+    # A missing header fails like a wrong key, HTTPBearer answers it with a
+    # status that differs between FastAPI versions.
+    key = ctx.settings.API_INTERNAL_KEY
+    if credentials is None:
+        raise AuthInvalidTokenError("Missing internal api key.")
+    if key is None or not hmac.compare_digest(
+        credentials.credentials.encode(), key.get_secret_value().encode()
+    ):
+        raise AuthInvalidTokenError("Invalid internal api key.")
+
+
+RequireInternalCaller = Depends(require_internal_caller)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import random
+import time
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import pyservice.logger as logger
+from pyservice.perf.capture import CapturedRequest, TrafficCapture
+from pyservice.pg.instrumentation import (
+    observe_request_statements,
+    track_request_statements,
+)
+from pyservice.profiling import (
+    ProfileStore,
+    SamplingProfiler,
+    verify_profile_request,
+)
+from pyservice.tracing import SpanExporter, start_trace
+
+TRACEPARENT_HEADER = b"traceparent"
+
+_LOGIN_ROUTES = frozenset({"/auth/google", "/auth/apple"})
+_MAX_CAPTURED_BODY = 64 * 1024
+
+PROFILE_HEADER = b"x-pyservice-profile"
+"Requests carrying a header signed with `sign_profile_request` are profiled."
+
+
+class StatementCountMiddleware:
+    """Record how many database statements each route executes."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = track_request_statements()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router stores the matched route in the scope.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            observe_request_statements(route, stats)
+
+
+class ProfilingMiddleware:
+    """Profile a sample of requests, and those carrying a signed header.
+
+    Only installed when profiling is configured, otherwise requests don't pay
+    for it at all."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        store: ProfileStore,
+        interval: float,
+        sample_rate: float,
+        key: bytes | None,
+    ):
+        self.app = app
+        self._store = store
+        self._interval = interval
+        self._sample_rate = sample_rate
+        self._key = key
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(self._interval)
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            samples = profiler.stop()
+            elapsed = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", scope["path"])
+            try:
+                await asyncio.to_thread(
+                    self._store.save, scope["method"], route, elapsed, samples
+                )
+            except OSError:
+                logger.error("Failed to save request profile:", exc_info=True)
+
+    def _should_profile(self, scope: Scope) -> bool:
+        if self._sample_rate > 0 and random.random() < self._sample_rate:
+            return True
+        if self._key is None:
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return verify_profile_request(self._key, value.decode("latin-1"))
+        return False
+
+
+class TracingMiddleware:
+    """Trace a sample of requests, with the route handling as root span."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        exporter: SpanExporter,
+        sample_rate: float,
+        parent_based: bool,
+    ):
+        self.app = app
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+        self._parent_based = parent_based
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root = start_trace(
+            self._exporter,
+            f"{scope['method']} {scope['path']}",
+            sample_rate=self._sample_rate,
+            traceparent=self._traceparent(scope),
+        )
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 0
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with root as span:
+            try:
+                await self.app(scope, receive, send_status)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span.name = f"{scope['method']} {route}"
+                span.attributes.update(
+                    {
+                        "http.request.method": scope["method"],
+                        "http.route": route or "unmatched",
+                        "http.response.status_code": status_code,
+                    }
+                )
+
+    def _traceparent(self, scope: Scope) -> str | None:
+        if not self._parent_based:
+            return None
+        for name, value in scope["headers"]:
+            if name == TRACEPARENT_HEADER:
+                return value.decode("latin-1")
+        return None
+
+
+class TrafficCaptureMiddleware:
+    """Record an anonymized timeline of requests, see `TrafficCapture`.
+
+    Responses of auth routes are read for the tokens they issue, only their
+    pseudonyms are kept."""
+
+    def __init__(self, app: ASGIApp, *, capture: TrafficCapture):
+        self.app = app
+        self._capture = capture
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        offset = self._capture.offset()
+        start = time.perf_counter()
+        status_code = 0
+        body = bytearray()
+
+        async def capture_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif (
+                message["type"] == "http.response.body"
+                and scope["path"].startswith("/auth/")
+                and len(body) < _MAX_CAPTURED_BODY
+            ):
+                body.extend(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture_send)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request = CapturedRequest(
+                offset=offset,
+                method=scope["method"],
+                route=route,
+                status=status_code,
+                duration=time.perf_counter() - start,
+            )
+            self._pseudonymize(request, scope, bytes(body))
+            self._capture.record(request)
+
+    def _pseudonymize(self, request: CapturedRequest, scope: Scope, body: bytes):
+        bearer = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, credentials = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer":
+                    bearer = credentials
+                break
+
+        if bearer is not None:
+            if request.route in _LOGIN_ROUTES:
+                request.user = self._capture.user_pseudonym(bearer)
+            else:
+                request.token = self._capture.pseudonym(bearer)
+
+        if body and 200 <= request.status < 300:
+            try:
+                result = json.loads(body)
+            except ValueError:
+                return
+            if isinstance(result, dict):
+                request.issued = [
+                    self._capture.pseudonym(result[key])
+                    for key in ("access_token", "refresh_token")
+                    if isinstance(result.get(key), str)
+                ]
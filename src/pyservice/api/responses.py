@@ -0,0 +1,16 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class PydanticJSONResponse(JSONResponse):
+    """Serializes content with pydantic-core, without `jsonable_encoder`.
+
+    Models are serialized by their own schema serializer. Returning this
+    response from a route also skips FastAPI's validation of the return value
+    against the `response_model`, only do so for values that are typed
+    already."""
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content, fallback=str)
@@ -0,0 +1,198 @@
+import asyncio
+import datetime
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pyservice.api.dependencies import RequireInternalCaller
+from pyservice.memory import (
+    AllocationSite,
+    CacheSize,
+    GroupBy,
+    MemoryStatus,
+    SnapshotInfo,
+    cache_sizes,
+    get_memory_diagnostics,
+)
+from pyservice.metrics import REGISTRY
+from pyservice.pg.context import POOL_ADMIN, DatabaseContext
+from pyservice.pg.store import Store
+from pyservice.profiling import ProfileInfo, get_profile_store
+from pyservice.tracing import RingBufferExporter, Span, get_span_exporter
+from pyservice.user import UserExport
+
+router = APIRouter(
+    prefix="/admin", tags=["admin"], dependencies=[RequireInternalCaller]
+)
+
+_USER_EXPORT_PAGE_SIZE = 5000
+"How many users are exported per transaction."
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/profiles")
+async def list_profiles() -> list[ProfileInfo]:
+    """List the stored request profiles, newest first."""
+    return get_profile_store().list()
+
+
+@router.get("/profiles/{name}", response_class=FileResponse)
+async def download_profile(name: str):
+    """Download a profile, in the collapsed stack format of flame graph tools."""
+    path = get_profile_store().path(name)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+
+@router.get("/traces")
+async def list_traces(limit: int = 50) -> list[list[Span]]:
+    """List the most recent traces kept by the memory exporter, newest first,
+    every trace starting with its root span."""
+    exporter = get_span_exporter()
+    if not isinstance(exporter, RingBufferExporter):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Traces are not kept in memory.",
+        )
+    return exporter.traces()[:limit]
+
+
+@router.get("/memory")
+async def memory_status() -> MemoryStatus:
+    """Report the memory of the worker serving the request and whether its
+    allocations are traced."""
+    return get_memory_diagnostics().status()
+
+
+@router.post("/memory/start")
+async def start_memory_tracing(frames: int = Query(1, ge=1, le=100)) -> MemoryStatus:
+    """Trace allocations with up to `frames` frames each, slowing down the
+    worker until stopped."""
+    diagnostics = get_memory_diagnostics()
+    diagnostics.start(frames)
+    return diagnostics.status()
+
+
+@router.post("/memory/stop")
+async def stop_memory_tracing() -> MemoryStatus:
+    """Stop tracing allocations and drop the snapshots."""
+    diagnostics = get_memory_diagnostics()
+    diagnostics.stop()
+    return diagnostics.status()
+
+
+@router.post("/memory/snapshots")
+async def take_memory_snapshot(name: str | None = None) -> SnapshotInfo:
+    """Snapshot the traced allocations, replacing a snapshot of the same name."""
+    try:
+        return await asyncio.to_thread(get_memory_diagnostics().take_snapshot, name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/memory/snapshots/{name}")
+async def memory_snapshot_top(
+    name: str,
+    against: str | None = None,
+    limit: int = Query(25, ge=1, le=1000),
+    group_by: GroupBy = "lineno",
+) -> list[AllocationSite]:
+    """List the largest allocation sites of a snapshot. With `against`, list
+    the sites that changed most since that earlier snapshot instead."""
+    diagnostics = get_memory_diagnostics()
+    try:
+        if against is None:
+            return await asyncio.to_thread(
+                diagnostics.top, name, limit=limit, group_by=group_by
+            )
+        return await asyncio.to_thread(
+            diagnostics.diff, against, name, limit=limit, group_by=group_by
+        )
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found"
+        )
+
+
+@router.get("/memory/caches")
+async def memory_caches() -> dict[str, CacheSize]:
+    """Report the sizes of the caches of the worker serving the request."""
+    return cache_sizes()
+
+
+@router.get(
+    "/users",
+    responses={
+        200: {
+            "model": UserExport,
+            "description": "One json line per user, ordered by id.",
+            "content": {"application/x-ndjson": {}},
+        }
+    },
+)
+async def export_users(
+    after: uuid.UUID | None = None,
+    identity_provider: str | None = None,
+    created_after: datetime.datetime | None = None,
+    created_before: datetime.datetime | None = None,
+    sessions: bool = False,
+    shard: str | None = None,
+):
+    """Export users, an interrupted export resumes with `after` set to the id
+    of the last user received. With several shards, each is exported on its
+    own and `shard` is required."""
+    created_after = _as_naive_utc(created_after)
+    created_before = _as_naive_utc(created_before)
+
+    engines = DatabaseContext.get().data_engines(POOL_ADMIN)
+    if shard is None and len(engines) == 1:
+        shard = next(iter(engines))
+    engine = engines.get(shard) if shard is not None else None
+    if engine is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Shard not found"
+        )
+
+    async def lines():
+        last_id = after
+        while True:
+            # Every page runs in its own short transaction, a long export
+            # doesn't hold back vacuum.
+            count = 0
+            async with AsyncSession(engine) as session, session.begin():
+                users = Store(session).stream_users(
+                    limit=_USER_EXPORT_PAGE_SIZE,
+                    after=last_id,
+                    identity_provider=identity_provider,
+                    created_after=created_after,
+                    created_before=created_before,
+                    with_sessions=sessions,
+                )
+                async for user in users:
+                    count += 1
+                    last_id = user.id
+                    yield user.__pydantic_serializer__.to_json(user) + b"\n"
+            if count < _USER_EXPORT_PAGE_SIZE:
+                break
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def _as_naive_utc(value: datetime.datetime | None) -> datetime.datetime | None:
+    # Timestamps are stored as naive utc.
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.UTC).replace(tzinfo=None)
@@ -1,16 +1,40 @@
+import asyncio
 import uuid
 
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
 
+import pyservice.logger as logger
 from pyservice.api.dependencies import (
     BearerToken,
+    DatabaseTx,
     RefreshTokenStoreImpl,
+    RequireInternalCaller,
+    RevokedTokenStoreImpl,
     UserStoreImpl,
 )
+from pyservice.api.responses import PydanticJSONResponse
+from pyservice.audit import AuditEventKind, audit
 from pyservice.auth.oidc import AppleProvider, GoogleProvider, OIDCAuth
-from pyservice.auth.token import TokenResult, sign_access_token, verify_token
+from pyservice.auth.refresh import refresh_tokens
+from pyservice.auth.token import (
+    TokenConfig,
+    TokenIntrospect,
+    TokenIntrospection,
+    TokenResult,
+    get_token_config,
+    sign_access_token,
+    verify_token,
+)
+from pyservice.exc import AuthInvalidTokenError
+from pyservice.logins import record_login
+from pyservice.pg.utils import after_commit
+
+router = APIRouter(prefix="/auth", tags=["auth"])
 
-router = APIRouter(prefix="/auth")
+_INTROSPECT_CHUNK_SIZE = 100
+"How many tokens are verified between yields to the event loop."
 
 
 @router.post("/google", response_model=TokenResult)
@@ -20,8 +44,8 @@ async def google(
     refresh_token_store: RefreshTokenStoreImpl,
 ):
     authenticate = OIDCAuth(GoogleProvider(), user_store, refresh_token_store)
-    response = await authenticate(credentials.credentials)
-    return response
+    result = await authenticate(credentials.credentials)
+    return PydanticJSONResponse(result)
 
 
 @router.post("/apple", response_model=TokenResult)
@@ -32,11 +56,16 @@ async def apple(
 ):
     authenticate = OIDCAuth(AppleProvider(), user_store, refresh_token_store)
     result = await authenticate(credentials.credentials)
-    return result
+    return PydanticJSONResponse(result)
 
 
 @router.post("/refresh", response_model=TokenResult)
-async def refresh(credentials: BearerToken, refresh_token_store: RefreshTokenStoreImpl):
+async def refresh(
+    credentials: BearerToken,
+    tx: DatabaseTx,
+    user_store: UserStoreImpl,
+    refresh_token_store: RefreshTokenStoreImpl,
+):
     token = verify_token(credentials.credentials)
     if token.expired:
         raise HTTPException(
@@ -44,14 +73,92 @@ async def refresh(credentials: BearerToken, refresh_token_store: RefreshTokenSto
         )
 
     user_id = uuid.UUID(token.sub)
+    # Tokens issued before sessions rotate in a session without an id.
+    session_id = uuid.UUID(token.sid) if token.sid is not None else None
+
+    async def rotate():
+        refresh_token = await refresh_token_store.rotate_refresh_token(
+            user_id, token=credentials.credentials, session_id=session_id
+        )
+        email = token.email
+        if email is None and get_token_config().includes_email:
+            # A compact refresh token, issued before switching to full tokens.
+            email = await user_store.read_user_email(user_id)
+        access_token, expires_in = sign_access_token(
+            sub=user_id, email=email, session_id=session_id
+        )
+
+        return TokenResult(
+            access_token=access_token,
+            expires_in=expires_in,
+            refresh_token=refresh_token,
+        )
 
-    refresh_token = await refresh_token_store.rotate_refresh_token(
-        user_id, token=credentials.credentials
+    result = await refresh_tokens(
+        credentials.credentials,
+        rotate,
+        after_commit=lambda callback: after_commit(tx, callback),
     )
-    access_token, expires_in = sign_access_token(sub=user_id, email=token.email)
+    audit(AuditEventKind.REFRESH, user_id)
+    record_login(user_id, login=False)
+    return PydanticJSONResponse(result)
 
-    return TokenResult(
-        access_token=access_token,
-        expires_in=expires_in,
-        refresh_token=refresh_token,
+
+@router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke(credentials: BearerToken, revoked_token_store: RevokedTokenStoreImpl):
+    token = verify_token(credentials.credentials)
+    if token.jti is None:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Token cannot be revoked, it was issued without an id.",
+        )
+
+    await revoked_token_store.revoke_token(
+        uuid.UUID(token.sub), jti=token.jti, exp=token.exp
     )
+
+
+@router.post(
+    "/introspect",
+    dependencies=[RequireInternalCaller],
+    responses={
+        200: {
+            "model": TokenIntrospection,
+            "description": "One json line per token, in request order.",
+            "content": {"application/x-ndjson": {}},
+        }
+    },
+)
+async def introspect(introspect: TokenIntrospect):
+    # Resolve the config once instead of per token, the keyring is still
+    # looked up per token so a reload mid-stream is picked up.
+    config = get_token_config()
+
+    async def lines():
+        for start in range(0, len(introspect.tokens), _INTROSPECT_CHUNK_SIZE):
+            chunk = introspect.tokens[start : start + _INTROSPECT_CHUNK_SIZE]
+            yield b"".join(
+                _introspect_line(start + offset, token, config)
+                for offset, token in enumerate(chunk)
+            )
+            # Verification is CPU bound, let other requests make progress
+            # between chunks.
+            await asyncio.sleep(0)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def _introspect_line(index: int, token: str, config: TokenConfig) -> bytes:
+    # Laid out as a serialized TokenIntrospection, without validating the
+    # trusted claims into a Token first.
+    try:
+        claims = verify_token(token, config=config).as_dict()
+    except AuthInvalidTokenError:
+        result = {"index": index, "active": False, "claims": None}
+    except Exception:
+        # The status is already sent, one token must not cut the stream short.
+        logger.warning(f"Failed to introspect token {index}:", exc_info=True)
+        result = {"index": index, "active": False, "claims": None}
+    else:
+        result = {"index": index, "active": True, "claims": claims}
+    return to_json(result) + b"\n"
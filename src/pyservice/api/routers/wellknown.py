@@ -0,0 +1,40 @@
+import hashlib
+import json
+
+from fastapi import APIRouter, Request, Response, status
+
+from pyservice.auth.keys import Keyring
+from pyservice.auth.token import get_token_config
+from pyservice.context import SettingsContext
+
+router = APIRouter(prefix="/.well-known")
+
+_JWKS_CACHE: tuple[Keyring, bytes, str] | None = None
+"""_JWKS_CACHE holds the rendered JWKS document and its ETag for the keyring it
+was rendered from. Keyrings are immutable, a reload replaces the instance."""
+
+
+def _render_jwks(keyring: Keyring) -> tuple[bytes, str]:
+    global _JWKS_CACHE
+
+    cached = _JWKS_CACHE
+    if cached is not None and cached[0] is keyring:
+        return cached[1], cached[2]
+
+    body = json.dumps(keyring.jwks, separators=(",", ":"), sort_keys=True).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    _JWKS_CACHE = (keyring, body, etag)
+    return body, etag
+
+
+@router.get("/jwks.json")
+async def jwks(request: Request) -> Response:
+    ctx = SettingsContext.get()
+
+    body, etag = _render_jwks(get_token_config().keyring)
+    max_age = int(ctx.settings.JWT_JWKS_MAX_AGE.total_seconds())
+    headers = {"Cache-Control": f"public, max-age={max_age}", "ETag": etag}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
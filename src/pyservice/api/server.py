@@ -1,20 +1,49 @@
+import asyncio
+import datetime
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, status
-from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 import pyservice.logger as logger
+from pyservice.api.middleware import (
+    ProfilingMiddleware,
+    StatementCountMiddleware,
+    TracingMiddleware,
+    TrafficCaptureMiddleware,
+)
+from pyservice.api.responses import PydanticJSONResponse
+from pyservice.api.routers.admin import router as admin_router
 from pyservice.api.routers.auth import router as auth_router
+from pyservice.api.routers.wellknown import router as wellknown_router
+from pyservice.audit import get_audit_log
+from pyservice.auth.revocation import get_revoked_tokens
+from pyservice.context import SettingsContext
 from pyservice.exc import AuthError
+from pyservice.jobs import Interval, Job, Scheduler
+from pyservice.logins import get_login_tracker
+from pyservice.loop_monitor import LoopMonitor
+from pyservice.perf.capture import TrafficCapture
+from pyservice.pg.audit import AuditEventWriter
+from pyservice.pg.context import POOL_BACKGROUND, DatabaseContext
+from pyservice.pg.jobs import database_jobs
+from pyservice.pg.leader import LeaderElection
+from pyservice.pg.logins import LastLoginWriter
+from pyservice.pg.revocation import RevocationListener
+from pyservice.profiling import get_profile_store
+from pyservice.tracing import get_span_exporter
 from pyservice.version import __version__
 
 
-async def integrity_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+async def integrity_exception_handler(
+    request: Request, exc: Exception
+) -> PydanticJSONResponse:
     """Capture database integrity errors."""
     logger.error("Encountered exception in request:", exc_info=True)
-    return JSONResponse(
+    return PydanticJSONResponse(
         content={
             "detail": (
                 "Data integrity conflict. This usually means a "
@@ -28,60 +57,211 @@ async def integrity_exception_handler(request: Request, exc: Exception) -> JSONR
 
 async def no_result_found_exception_handler(
     request: Request, exc: Exception
-) -> JSONResponse:
+) -> PydanticJSONResponse:
     """Capture database result not found errors."""
     logger.error("Encountered exception in request:", exc_info=True)
-    return JSONResponse(
+    return PydanticJSONResponse(
         content={"detail": "Object not found"},
         status_code=status.HTTP_404_NOT_FOUND,
     )
 
 
+async def pool_timeout_exception_handler(
+    request: Request, exc: Exception
+) -> PydanticJSONResponse:
+    """Shed load when no database connection became available in time."""
+    logger.warning(f"Database pool exhausted: {exc}")
+    return PydanticJSONResponse(
+        content={"detail": "Service overloaded, retry later"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
 async def validation_exception_handler(
     request: Request, exc: RequestValidationError
-) -> JSONResponse:
+) -> PydanticJSONResponse:
     """Provide a detailed message for request validation errors."""
     logger.debug("Encountered exception in request:", exc_info=True)
-    return JSONResponse(
+    return PydanticJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-        content=jsonable_encoder(
-            {
-                "exception_message": "Invalid request received.",
-                "exception_detail": exc.errors(),
-                "request_body": exc.body,
-            }
-        ),
+        content={
+            "exception_message": "Invalid request received.",
+            "exception_detail": exc.errors(),
+            "request_body": exc.body,
+        },
     )
 
 
-async def auth_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+async def auth_exception_handler(
+    request: Request, exc: Exception
+) -> PydanticJSONResponse:
     logger.error("Encountered exception in request:", exc_info=True)
-    return JSONResponse(
+    return PydanticJSONResponse(
         content={"detail": "Not authenticated"},
         status_code=status.HTTP_401_UNAUTHORIZED,
     )
 
 
-async def internal_exception_handler(request: Request, exc: Exception) -> JSONResponse:
+async def internal_exception_handler(
+    request: Request, exc: Exception
+) -> PydanticJSONResponse:
     """
     Log a detailed exception for internal server errors before returning.
     """
     logger.error("Encountered exception in request:", exc_info=True)
-    return JSONResponse(
+    return PydanticJSONResponse(
         content={"exception_message": "Internal Server Error"},
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
 
 
+async def _prune_revoked_tokens():
+    get_revoked_tokens().prune()
+
+
+def _create_scheduler(leader: LeaderElection) -> Scheduler:
+    scheduler = Scheduler(is_leader=lambda: leader.is_leader)
+    for job in database_jobs():
+        scheduler.add(job)
+    scheduler.add(
+        Job(
+            name="prune_revoked_tokens",
+            run=_prune_revoked_tokens,
+            schedule=Interval(datetime.timedelta(minutes=5)),
+            timeout=datetime.timedelta(seconds=10),
+        )
+    )
+    return scheduler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = SettingsContext.get().settings
+    database = DatabaseContext.get()
+    # Listeners and the leader election hold their connection for good, on
+    # the default pool, they never wait behind short lived work.
+    engine = database.engine
+
+    tasks: list[asyncio.Task[None]] = [
+        # Cancelling the audit log task flushes the buffered events.
+        asyncio.create_task(
+            get_audit_log().run(AuditEventWriter(database.pool(POOL_BACKGROUND)))
+        ),
+        asyncio.create_task(
+            get_login_tracker().run(
+                LastLoginWriter(
+                    database.data_engines(POOL_BACKGROUND),
+                    directory=(
+                        database.pool(POOL_BACKGROUND) if database.shards else None
+                    ),
+                )
+            )
+        ),
+    ]
+    for shard, shard_engine in database.data_engines().items():
+        listener = RevocationListener(
+            shard_engine,
+            get_revoked_tokens(),
+            resync_interval=settings.JWT_REVOCATION_RESYNC_INTERVAL.total_seconds(),
+            source=shard,
+        )
+        tasks.append(asyncio.create_task(listener.run()))
+
+    if settings.API_LOOP_MONITOR_INTERVAL is not None:
+        monitor = LoopMonitor(
+            interval=settings.API_LOOP_MONITOR_INTERVAL.total_seconds(),
+            stall_threshold=settings.API_LOOP_STALL_THRESHOLD.total_seconds(),
+        )
+        tasks.append(asyncio.create_task(monitor.run()))
+
+    if settings.API_JOBS_ENABLED:
+        leader = LeaderElection(
+            engine,
+            "pyservice_jobs",
+            check_interval=settings.API_JOBS_LEADER_CHECK_INTERVAL.total_seconds(),
+        )
+        tasks.append(asyncio.create_task(leader.run()))
+        tasks.append(asyncio.create_task(_create_scheduler(leader).run()))
+
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        if _TRAFFIC_CAPTURE is not None:
+            _TRAFFIC_CAPTURE.close()
+
+
 app = FastAPI(
     title="pyservice",
     version=__version__,
+    lifespan=lifespan,
+    default_response_class=PydanticJSONResponse,
     exception_handlers={
         IntegrityError: integrity_exception_handler,
         RequestValidationError: validation_exception_handler,
         Exception: internal_exception_handler,
         NoResultFound: no_result_found_exception_handler,
+        PoolTimeoutError: pool_timeout_exception_handler,
         AuthError: auth_exception_handler,
     },
 )
+app.add_middleware(StatementCountMiddleware)
+
+
+def _add_profiling_middleware():
+    settings = SettingsContext.get().settings
+
+    key = settings.API_PROFILE_KEY
+    if settings.API_PROFILE_SAMPLE_RATE <= 0 and key is None:
+        return
+
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=get_profile_store(),
+        interval=settings.API_PROFILE_INTERVAL.total_seconds(),
+        sample_rate=settings.API_PROFILE_SAMPLE_RATE,
+        key=key.get_secret_value().encode() if key is not None else None,
+    )
+
+
+def _add_tracing_middleware():
+    settings = SettingsContext.get().settings
+
+    exporter = get_span_exporter()
+    if exporter is None:
+        return
+
+    app.add_middleware(
+        TracingMiddleware,
+        exporter=exporter,
+        sample_rate=settings.API_TRACE_SAMPLE_RATE,
+        parent_based=settings.API_TRACE_PARENT_BASED,
+    )
+
+
+def _create_traffic_capture() -> TrafficCapture | None:
+    settings = SettingsContext.get().settings
+
+    if settings.API_CAPTURE_DIRECTORY is None:
+        return None
+    key = settings.API_CAPTURE_KEY
+    capture = TrafficCapture(
+        settings.API_CAPTURE_DIRECTORY,
+        key=key.get_secret_value().encode() if key is not None else None,
+    )
+    app.add_middleware(TrafficCaptureMiddleware, capture=capture)
+    return capture
+
+
+_TRAFFIC_CAPTURE = _create_traffic_capture()
+_add_profiling_middleware()
+# Added last to run first, profiles of traced requests show up in the trace.
+_add_tracing_middleware()
 app.include_router(auth_router)
+app.include_router(admin_router)
+app.include_router(wellknown_router)
@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import enum
+import time
+import uuid
+from collections import deque
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Literal
+
+import pyservice.logger as logger
+from pyservice.context import SettingsContext
+from pyservice.memory import CacheSize, register_cache
+from pyservice.metrics import counter, gauge, histogram
+
+_AUDIT_DROPPED = counter(
+    "pyservice_audit_events_dropped",
+    "Audit events dropped because the buffer was full.",
+)
+_AUDIT_FLUSHED = counter(
+    "pyservice_audit_events_flushed",
+    "Audit events written to the database.",
+)
+_AUDIT_FLUSH_FAILURES = counter(
+    "pyservice_audit_flush_failures",
+    "Audit event batches that failed to be written.",
+)
+_AUDIT_FLUSH_LAG = histogram(
+    "pyservice_audit_flush_lag_seconds",
+    "Time from emitting an audit event to it being written.",
+)
+
+OverflowPolicy = Literal["drop_newest", "drop_oldest"]
+
+
+class AuditEventKind(enum.StrEnum):
+    LOGIN = "LOGIN"
+    REFRESH = "REFRESH"
+
+
+@dataclass(slots=True)
+class AuditEvent:
+    kind: AuditEventKind
+    user_id: uuid.UUID
+    identity_provider: str | None = None
+    occurred_at: datetime.datetime = field(
+        default_factory=lambda: datetime.datetime.now(datetime.UTC)
+    )
+    emitted: float = field(default_factory=time.monotonic)
+    "Monotonic time of emission, used for the flush lag."
+
+
+AuditSink = Callable[[Sequence[AuditEvent]], Awaitable[None]]
+
+
+class AuditLog:
+    """A bounded in-memory buffer of audit events, written out in batches.
+
+    Emitting never blocks or touches the database. When the buffer is full,
+    `overflow` decides whether the new or the oldest event is dropped. A
+    failed batch is dropped as well, the buffer never grows beyond its size."""
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow: OverflowPolicy,
+    ):
+        self._events: deque[AuditEvent] = deque()
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._overflow = overflow
+        self._batch_ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def emit(self, event: AuditEvent):
+        if len(self._events) >= self._max_size:
+            _AUDIT_DROPPED.inc()
+            if self._overflow == "drop_newest":
+                return
+            self._events.popleft()
+        self._events.append(event)
+        if len(self._events) >= self._batch_size:
+            self._batch_ready.set()
+
+    async def run(self, sink: AuditSink):
+        """Flush every `flush_interval` seconds, or as soon as a batch is full.
+
+        Remaining events are flushed when the task is cancelled."""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self._batch_ready.wait(), self._flush_interval
+                    )
+                except TimeoutError:
+                    pass
+                await self.flush(sink)
+        except asyncio.CancelledError:
+            await self.flush(sink)
+            raise
+
+    async def flush(self, sink: AuditSink):
+        while self._events:
+            batch = [
+                self._events.popleft()
+                for _ in range(min(self._batch_size, len(self._events)))
+            ]
+            if len(self._events) < self._batch_size:
+                self._batch_ready.clear()
+            try:
+                await sink(batch)
+            except Exception:
+                _AUDIT_FLUSH_FAILURES.inc()
+                logger.error(
+                    f"Failed to write {len(batch)} audit events:", exc_info=True
+                )
+                return
+
+            _AUDIT_FLUSHED.inc(amount=len(batch))
+            now = time.monotonic()
+            for event in batch:
+                _AUDIT_FLUSH_LAG.observe(now - event.emitted)
+
+
+_AUDIT_LOG: AuditLog | None = None
+
+
+def get_audit_log() -> AuditLog:
+    global _AUDIT_LOG
+
+    if _AUDIT_LOG is None:
+        ctx = SettingsContext.get()
+        _AUDIT_LOG = AuditLog(
+            max_size=ctx.settings.API_AUDIT_BUFFER_SIZE,
+            batch_size=ctx.settings.API_AUDIT_FLUSH_BATCH_SIZE,
+            flush_interval=ctx.settings.API_AUDIT_FLUSH_INTERVAL.total_seconds(),
+            overflow=ctx.settings.API_AUDIT_OVERFLOW,
+        )
+        register_cache(
+            "audit_buffer",
+            lambda: CacheSize(
+                entries=len(_AUDIT_LOG or ()),
+                max_entries=ctx.settings.API_AUDIT_BUFFER_SIZE,
+            ),
+        )
+        gauge(
+            "pyservice_audit_buffer_events",
+            "Audit events waiting to be written.",
+            collect=lambda: [((), float(len(_AUDIT_LOG or ())))],
+        )
+    return _AUDIT_LOG
+
+
+def audit(
+    kind: AuditEventKind, user_id: uuid.UUID, identity_provider: str | None = None
+):
+    """Record an audit event, without waiting for it to be written."""
+    get_audit_log().emit(AuditEvent(kind, user_id, identity_provider))
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from jwt.algorithms import get_default_algorithms
+from pydantic import SecretStr, ValidationError
+
+import pyservice.logger as logger
+from pyservice.context import JWTKeyringSettings, JWTKeySettings
+from pyservice.exc import KeyringError
+
+
+@dataclass(frozen=True, slots=True)
+class JWTKey:
+    kid: str | None
+    "The key id sent in the token header, None for tokens issued without one."
+
+    algorithm: str
+
+    signing_key: Any | None
+    "The preloaded key used to sign tokens, None for verification-only keys."
+
+    verifying_key: Any
+    "The preloaded key used to verify tokens."
+
+    jwk: Mapping[str, Any] | None = None
+    "The public key as JWK, None for symmetric keys which must not be published."
+
+    @classmethod
+    def from_settings(cls, settings: JWTKeySettings) -> "JWTKey":
+        secret = settings.key.get_secret_value().encode()
+        if settings.algorithm == "HS256":
+            return cls(
+                kid=settings.kid,
+                algorithm=settings.algorithm,
+                signing_key=secret,
+                verifying_key=secret,
+            )
+        return _load_asymmetric_key(settings.kid, settings.algorithm, secret)
+
+
+def _load_asymmetric_key(kid: str, algorithm: str, pem: bytes) -> JWTKey:
+    try:
+        if b"PRIVATE KEY" in pem:
+            signing_key = serialization.load_pem_private_key(pem, password=None)
+            verifying_key = signing_key.public_key()
+        else:
+            signing_key = None
+            verifying_key = serialization.load_pem_public_key(pem)
+    except ValueError as e:
+        raise KeyringError(f"Could not load the jwt key {kid}.") from e
+
+    if algorithm == "EdDSA":
+        valid = isinstance(verifying_key, ed25519.Ed25519PublicKey)
+    else:
+        valid = isinstance(verifying_key, ec.EllipticCurvePublicKey) and isinstance(
+            verifying_key.curve, ec.SECP256R1
+        )
+    if not valid:
+        raise KeyringError(f"The jwt key {kid} cannot be used with {algorithm}.")
+
+    jwk = get_default_algorithms()[algorithm].to_jwk(verifying_key, as_dict=True)
+    return JWTKey(
+        kid=kid,
+        algorithm=algorithm,
+        signing_key=signing_key,
+        verifying_key=verifying_key,
+        jwk=MappingProxyType({**jwk, "kid": kid, "alg": algorithm, "use": "sig"}),
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class Keyring:
+    active: JWTKey
+    "The key used to issue new tokens."
+
+    keys: Mapping[str, JWTKey]
+    "Every key accepted during verification, indexed by kid."
+
+    fallback: JWTKey | None = None
+    "The key used to verify tokens without a kid header."
+
+    def verification_key(self, kid: str | None) -> JWTKey | None:
+        if kid is None:
+            return self.fallback
+        return self.keys.get(kid)
+
+    @property
+    def jwks(self) -> dict[str, Any]:
+        """The public keys of the keyring as JWK set."""
+        return {
+            "keys": [dict(key.jwk) for key in self.keys.values() if key.jwk is not None]
+        }
+
+    @classmethod
+    def from_settings(
+        cls, keyring: JWTKeyringSettings | None, legacy_key: SecretStr | None = None
+    ) -> "Keyring":
+        fallback = None
+        if legacy_key is not None:
+            secret = legacy_key.get_secret_value().encode()
+            fallback = JWTKey(
+                kid=None,
+                algorithm="HS256",
+                signing_key=secret,
+                verifying_key=secret,
+            )
+
+        if keyring is None:
+            if fallback is None:
+                raise KeyringError("Neither a jwt key nor a keyring is configured.")
+            return cls(active=fallback, keys=MappingProxyType({}), fallback=fallback)
+
+        keys = {entry.kid: JWTKey.from_settings(entry) for entry in keyring.keys}
+
+        active = keys[keyring.active_kid]
+        if active.signing_key is None:
+            raise KeyringError(f"The active jwt key {active.kid} has no private key.")
+
+        return cls(active=active, keys=MappingProxyType(keys), fallback=fallback)
+
+
+class KeyringFile:
+    """Keyring backed by a json file, reloaded when the file changes.
+
+    The file is checked at most once per `reload_interval` seconds, so the
+    cost on the request path is a clock read in the common case. A file that
+    fails to load is logged and the previous keyring stays in use."""
+
+    def __init__(
+        self,
+        path: Path,
+        reload_interval: float,
+        legacy_key: SecretStr | None = None,
+    ):
+        self._path = path
+        self._reload_interval = reload_interval
+        self._legacy_key = legacy_key
+
+        self._lock = threading.Lock()
+        self._keyring: Keyring | None = None
+        self._mtime_ns: int | None = None
+        self._next_check = 0.0
+
+    def get(self) -> Keyring:
+        if self._keyring is None or time.monotonic() >= self._next_check:
+            self.reload()
+        assert self._keyring is not None
+        return self._keyring
+
+    def reload(self, *, force: bool = False):
+        with self._lock:
+            self._next_check = time.monotonic() + self._reload_interval
+            try:
+                mtime_ns = os.stat(self._path).st_mtime_ns
+                if not force and mtime_ns == self._mtime_ns:
+                    return
+
+                settings = JWTKeyringSettings.model_validate_json(
+                    self._path.read_bytes()
+                )
+                self._keyring = Keyring.from_settings(settings, self._legacy_key)
+                self._mtime_ns = mtime_ns
+            except (OSError, ValidationError, KeyringError) as e:
+                if self._keyring is None:
+                    raise KeyringError(
+                        f"Could not load the jwt keyring from {self._path}."
+                    ) from e
+
+                logger.error(
+                    "Could not reload the jwt keyring, keeping the previous one:",
+                    exc_info=True,
+                )
@@ -1,3 +1,8 @@
+import datetime
+import hashlib
+import json
+import time
+import uuid
 from functools import cache
 from typing import Protocol
 from urllib.parse import urlparse
@@ -5,6 +10,7 @@ from urllib.parse import urlparse
 import jwt
 from pydantic import HttpUrl
 
+from pyservice.audit import AuditEventKind, audit
 from pyservice.auth.token import (
     RefreshTokenStore,
     Token,
@@ -13,8 +19,25 @@ from pyservice.auth.token import (
 )
 from pyservice.context import SettingsContext
 from pyservice.exc import AuthInvalidTokenError
+from pyservice.logins import record_login
+from pyservice.memory import functools_cache_size, register_cache
+from pyservice.metrics import counter
+from pyservice.shared_cache import SharedCache
+from pyservice.tracing import span
 from pyservice.user import UserCreate, UserStore
 
+_KEY_FETCHES = counter(
+    "pyservice_oidc_key_fetches",
+    "Fetches of the keys of OIDC providers, by url.",
+    labelnames=("url",),
+)
+
+_KEYS_CACHE_SLOTS = 64
+_KEYS_CACHE_SLOT_SIZE = 64 * 1024
+_ID_TOKEN_CACHE_SLOT_SIZE = 4 * 1024
+_HTTP_CACHE_MAX_TTL = datetime.timedelta(days=1).total_seconds()
+_GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
 
 class OIDCAuth:
     def __init__(
@@ -37,8 +60,17 @@ class OIDCAuth:
         )
         user_id = await self._user_store.create_user(create, exists_ok=True)
 
-        refresh_token = await self._token_store.rotate_refresh_token(user_id)
-        access_token, expires_in = sign_access_token(sub=user_id, email=claims.email)
+        # Every login starts a session, other devices stay logged in.
+        session_id = uuid.uuid4()
+        refresh_token = await self._token_store.rotate_refresh_token(
+            user_id, session_id=session_id
+        )
+        access_token, expires_in = sign_access_token(
+            sub=user_id, email=claims.email, session_id=session_id
+        )
+
+        audit(AuditEventKind.LOGIN, user_id, identity_provider=self._provider.name)
+        record_login(user_id)
 
         return TokenResult(
             access_token=access_token,
@@ -54,26 +86,149 @@ class OIDCProvider(Protocol):
     def name(self) -> str: ...
 
 
+@cache
+def get_keys_cache() -> SharedCache:
+    ctx = SettingsContext.get()
+
+    keys_cache = SharedCache(
+        "oidc-keys",
+        ctx.settings.OIDC_CACHE_DIRECTORY,
+        slots=_KEYS_CACHE_SLOTS,
+        slot_size=_KEYS_CACHE_SLOT_SIZE,
+    )
+    register_cache("oidc_keys", keys_cache.size)
+    return keys_cache
+
+
+@cache
+def get_id_token_cache() -> SharedCache:
+    ctx = SettingsContext.get()
+
+    id_token_cache = SharedCache(
+        "oidc-id-tokens",
+        ctx.settings.OIDC_CACHE_DIRECTORY,
+        slots=ctx.settings.OIDC_ID_TOKEN_CACHE_SIZE,
+        slot_size=_ID_TOKEN_CACHE_SLOT_SIZE,
+    )
+    register_cache("oidc_id_tokens", id_token_cache.size)
+    return id_token_cache
+
+
+def _id_token_key(provider: str, id_token: str) -> str:
+    return f"{provider}:{hashlib.sha256(id_token.encode()).hexdigest()}"
+
+
+def _cached_id_token(provider: str, id_token: str) -> Token | None:
+    entry = get_id_token_cache().get(_id_token_key(provider, id_token))
+    if entry is None:
+        return None
+    return Token.model_validate_json(entry.value)
+
+
+def _cache_id_token(provider: str, id_token: str, claims: Token):
+    ctx = SettingsContext.get()
+
+    ttl = min(
+        ctx.settings.OIDC_ID_TOKEN_CACHE_DURATION.total_seconds(),
+        claims.exp - time.time(),
+    )
+    if ttl > 0:
+        get_id_token_cache().set(
+            _id_token_key(provider, id_token), claims.model_dump_json().encode(), ttl
+        )
+
+
+class SharedJWKClient(jwt.PyJWKClient):
+    """A JWKS client keeping the key set in the shared keys cache.
+
+    Worker processes fetch the key set once between them and parse it again
+    only when its cached version changes. A key id missing from the set
+    refreshes it, unless another worker refreshed it already."""
+
+    def __init__(self, uri: str, cache: SharedCache, lifespan: int):
+        super().__init__(uri, cache_jwk_set=True, lifespan=lifespan)
+        self._shared = cache
+        self._lifespan = lifespan
+        self._key = f"jwks:{uri}"
+        self._jwk_set: jwt.PyJWKSet | None = None
+        self._version: int | None = None
+
+    def get_jwk_set(self, refresh: bool = False) -> jwt.PyJWKSet:
+        entry = self._shared.get(self._key)
+        if entry is None or (refresh and entry.version == self._version):
+            entry = self._shared.fill(
+                self._key,
+                self._fetch,
+                self._lifespan,
+                stale_version=self._version if refresh else None,
+            )
+
+        if self._jwk_set is None or entry.version != self._version:
+            self._jwk_set = jwt.PyJWKSet.from_dict(json.loads(entry.value))
+            self._version = entry.version
+        return self._jwk_set
+
+    def _fetch(self) -> bytes:
+        _KEY_FETCHES.inc(self.uri)
+        with span("oidc.fetch_keys", **{"url.full": self.uri}):
+            return json.dumps(self.fetch_data()).encode()
+
+
+class SharedHTTPCache:
+    """The shared keys cache as a cachecontrol cache, see its BaseCache."""
+
+    def __init__(self, cache: SharedCache):
+        self._shared = cache
+
+    def get(self, key: str) -> bytes | None:
+        entry = self._shared.get(f"http:{key}")
+        return entry.value if entry is not None else None
+
+    def set(
+        self, key: str, value: bytes, expires: int | datetime.datetime | None = None
+    ):
+        if isinstance(expires, datetime.datetime):
+            ttl = (expires - datetime.datetime.now(datetime.UTC)).total_seconds()
+        else:
+            ttl = expires or _HTTP_CACHE_MAX_TTL
+        if ttl > 0:
+            _KEY_FETCHES.inc(key)
+            self._shared.set(f"http:{key}", value, min(ttl, _HTTP_CACHE_MAX_TTL))
+
+    def delete(self, key: str):
+        self._shared.delete(f"http:{key}")
+
+    def close(self):
+        pass
+
+
 class JWKSProvider:
-    def __init__(self, uri: HttpUrl, audience: str | list[str]):
-        parts = urlparse(str(uri))
+    def __init__(
+        self, uri: HttpUrl, audience: str | list[str], issuer: HttpUrl | None = None
+    ):
+        parts = urlparse(str(issuer or uri))
 
         self._client = JWKSProvider.get_client(uri)
         self._issuer = f"{parts.scheme}://{parts.netloc}"
         self._audience = audience
 
     async def verify_id_token(self, id_token: str) -> Token:
+        result = _cached_id_token(self.name, id_token)
+        if result is not None:
+            return result
+
         # TODO: Move to separate loop to not block the main thread.
         try:
-            signing_key = self._client.get_signing_key_from_jwt(id_token)
-
-            token_claims = jwt.decode(
-                id_token,
-                signing_key.key,
-                algorithms=[signing_key.algorithm_name],
-                audience=self._audience,
-                issuer=self._issuer,
-            )
+            with span("oidc.verify_id_token", provider=self.name):
+                signing_key = self._client.get_signing_key_from_jwt(id_token)
+
+                token_claims = jwt.decode(
+                    id_token,
+                    signing_key.key,
+                    algorithms=[signing_key.algorithm_name],
+                    audience=self._audience,
+                    issuer=self._issuer,
+                )
         except (jwt.InvalidTokenError, jwt.PyJWKClientError) as e:
             raise AuthInvalidTokenError(
                 f"Could not verify ID token for provider {self.name}"
@@ -82,6 +237,7 @@ class JWKSProvider:
         result = Token.model_validate(token_claims)
         assert result.intended_for(self._audience)
 
+        _cache_id_token(self.name, id_token, result)
         return result
 
     @property
@@ -91,7 +247,18 @@ class JWKSProvider:
     @staticmethod
     @cache
     def get_client(uri: HttpUrl):
-        return jwt.PyJWKClient(str(uri), cache_jwk_set=True, lifespan=600)
+        ctx = SettingsContext.get()
+
+        return SharedJWKClient(
+            str(uri),
+            get_keys_cache(),
+            lifespan=int(ctx.settings.OIDC_KEYS_CACHE_DURATION.total_seconds()),
+        )
+
+
+register_cache(
+    "oidc_jwk_clients", lambda: functools_cache_size(JWKSProvider.get_client)
+)
 
 
 class AppleProvider(JWKSProvider):
@@ -102,8 +269,9 @@ class AppleProvider(JWKSProvider):
         assert apple_client_id is not None
 
         super().__init__(
-            uri=HttpUrl("https://appleid.apple.com/auth/keys"),
+            uri=ctx.settings.OIDC_APPLE_KEYS_URL,
             audience=apple_client_id,
+            issuer=ctx.settings.OIDC_APPLE_ISSUER,
         )
 
     @property
@@ -119,8 +287,13 @@ class GoogleProvider:
         assert google_client_id is not None
 
         self._audience = google_client_id
+        self._certs_url = str(ctx.settings.OIDC_GOOGLE_CERTS_URL)
 
     async def verify_id_token(self, id_token: str) -> Token:
+        cached_claims = _cached_id_token(self.name, id_token)
+        if cached_claims is not None:
+            return cached_claims
+
         import google.auth.transport.requests as grequests
         import google.oauth2.id_token as impl
         from google.auth.exceptions import GoogleAuthError
@@ -132,17 +305,23 @@ class GoogleProvider:
             #
             # Google verifies the token using public TLS certificates
             # in case their JWKS server doesn't return anything.
-            raw_token_claims = impl.verify_oauth2_token(
-                id_token=id_token,
-                request=request,
-                audience=self._audience,
-            )
+            with span("oidc.verify_id_token", provider=self.name):
+                # verify_oauth2_token, with the certificates url configurable.
+                raw_token_claims = impl.verify_token(
+                    id_token,
+                    request,
+                    audience=self._audience,
+                    certs_url=self._certs_url,
+                )
         except GoogleAuthError as e:
             raise AuthInvalidTokenError("Could not verify Google ID token.") from e
+        if raw_token_claims.get("iss") not in _GOOGLE_ISSUERS:
+            raise AuthInvalidTokenError("Google ID token has the wrong issuer.")
 
         token_claims = Token.model_validate(raw_token_claims)
         assert token_claims.intended_for(self._audience)
 
+        _cache_id_token(self.name, id_token, token_claims)
         return token_claims
 
     @property
@@ -157,5 +336,5 @@ class GoogleProvider:
 
         session = requests.Session()
         # Make use of HTTP Cache-Control headers to keep TLS certificates
-        # in-memory and avoid roundtrips to certificate authorities.
-        return CacheControl(session)
+        # in the shared cache and avoid roundtrips to certificate authorities.
+        return CacheControl(session, cache=SharedHTTPCache(get_keys_cache()))  # type: ignore[arg-type]
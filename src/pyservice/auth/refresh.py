@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from pyservice.auth.token import TokenResult
+from pyservice.context import SettingsContext
+
+
+AfterCommit = Callable[[Callable[[], None]], None]
+"Registers a callback to run once the transaction of the rotation commits."
+
+
+@dataclass(slots=True)
+class _Rotation:
+    result: TokenResult
+    rotated_at: float
+    reuses: int = 0
+
+
+class RefreshCoalescer:
+    """Coalesces refreshes of the same refresh token within this process.
+
+    Concurrent refreshes wait for the first one instead of queueing on the
+    row lock and failing the hash check once it rotated the token. For a
+    short grace window after a rotation the same result is handed out again,
+    a limited number of times.
+
+    Entries are keyed by the SHA-256 of the full refresh token, so only a
+    holder of the rotated token gets its successor. Followers receive the
+    leader's result before the leader's transaction commits, a failed commit
+    makes their tokens unusable the same way it does for the leader. Reuses
+    within the grace window are only offered once `after_commit` calls back,
+    a rolled back rotation is never handed out again."""
+
+    def __init__(self):
+        self._inflight: dict[bytes, asyncio.Future[TokenResult]] = {}
+        self._rotations: OrderedDict[bytes, _Rotation] = OrderedDict()
+
+    async def refresh(
+        self,
+        token: str,
+        rotate: Callable[[], Awaitable[TokenResult]],
+        *,
+        grace: float,
+        max_reuses: int,
+        max_entries: int,
+        after_commit: AfterCommit | None = None,
+    ) -> TokenResult:
+        key = hashlib.sha256(token.encode()).digest()
+        now = time.monotonic()
+
+        self._evict(now - grace, max_entries)
+
+        rotation = self._rotations.get(key)
+        if rotation is not None:
+            if rotation.reuses < max_reuses:
+                rotation.reuses += 1
+                elapsed = int(now - rotation.rotated_at)
+                return rotation.result.model_copy(
+                    update={"expires_in": rotation.result.expires_in - elapsed}
+                )
+            del self._rotations[key]
+
+        while (inflight := self._inflight.get(key)) is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if not inflight.cancelled() or (task and task.cancelling()):
+                    raise
+                # The leader was cancelled, not us. Take over the refresh.
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await rotate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise the exception, don't log it as unretrieved.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if grace > 0 and max_reuses > 0:
+                rotation = _Rotation(result, rotated_at=time.monotonic())
+
+                def remember():
+                    self._rotations[key] = rotation
+
+                if after_commit is None:
+                    remember()
+                else:
+                    after_commit(remember)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def _evict(self, rotated_before: float, max_entries: int):
+        # Rotations are appended in time order, expired ones sit at the front.
+        rotations = self._rotations
+        while rotations:
+            key, rotation = next(iter(rotations.items()))
+            if rotation.rotated_at > rotated_before and len(rotations) < max_entries:
+                break
+            del rotations[key]
+
+    def __len__(self) -> int:
+        return len(self._rotations)
+
+
+_REFRESH_COALESCER = RefreshCoalescer()
+
+
+async def refresh_tokens(
+    token: str,
+    rotate: Callable[[], Awaitable[TokenResult]],
+    *,
+    after_commit: AfterCommit | None = None,
+) -> TokenResult:
+    """Run `rotate` for `token`, coalesced with concurrent and recent refreshes."""
+    ctx = SettingsContext.get()
+
+    return await _REFRESH_COALESCER.refresh(
+        token,
+        rotate,
+        grace=ctx.settings.JWT_REFRESH_REUSE_GRACE.total_seconds(),
+        max_reuses=ctx.settings.JWT_REFRESH_REUSE_MAX,
+        max_entries=ctx.settings.JWT_REFRESH_REUSE_CACHE_SIZE,
+        after_commit=after_commit,
+    )
@@ -0,0 +1,73 @@
+import time
+from collections.abc import Iterable
+
+from pyservice.memory import CacheSize, register_cache
+
+REVOCATION_CHANNEL = "pyservice_revoked_tokens"
+"The postgres notification channel revocations are published on."
+
+
+class RevokedTokens:
+    """The ids of revoked, not yet expired tokens, held in memory.
+
+    Kept up to date by the revocation listeners so verifying a token never
+    has to query the database. With several databases, every listener
+    replaces the revocations of its own source only."""
+
+    def __init__(self):
+        self._expiries: dict[str, int] = {}
+        self._sources: dict[str, dict[str, int]] = {}
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._expiries
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    def add(self, jti: str, exp: int, source: str = ""):
+        if exp > time.time():
+            self._expiries[jti] = exp
+            self._sources.setdefault(source, {})[jti] = exp
+
+    def replace(self, revocations: Iterable[tuple[str, int]], source: str = ""):
+        """Replace every known revocation from `source`, e.g. after a missed
+        notification."""
+        now = time.time()
+        self._sources[source] = {jti: exp for jti, exp in revocations if exp > now}
+        self._merge()
+
+    def prune(self):
+        """Forget revocations of tokens that expired anyway."""
+        now = time.time()
+        self._sources = {
+            source: {jti: exp for jti, exp in expiries.items() if exp > now}
+            for source, expiries in self._sources.items()
+        }
+        self._merge()
+
+    def _merge(self):
+        expiries: dict[str, int] = {}
+        for source_expiries in self._sources.values():
+            expiries.update(source_expiries)
+        self._expiries = expiries
+
+
+_REVOKED_TOKENS = RevokedTokens()
+register_cache("revoked_tokens", lambda: CacheSize(entries=len(_REVOKED_TOKENS)))
+
+
+def get_revoked_tokens() -> RevokedTokens:
+    return _REVOKED_TOKENS
+
+
+def is_revoked(jti: str | None) -> bool:
+    return jti is not None and jti in _REVOKED_TOKENS
+
+
+def encode_notification(jti: str, exp: int) -> str:
+    return f"{jti}:{exp}"
+
+
+def decode_notification(payload: str) -> tuple[str, int]:
+    jti, exp = payload.rsplit(":", 1)
+    return jti, int(exp)
@@ -1,6 +1,10 @@
+import base64
+import time
 import uuid
+import weakref
+from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Protocol, Tuple
+from typing import Any, Literal, Protocol, Tuple
 
 import jwt
 import pendulum
@@ -14,9 +18,12 @@ from pydantic import (
     model_validator,
 )
 
-from pyservice.context import SettingsContext
-from pyservice.exc import AuthInvalidTokenError
+from pyservice.auth.keys import Keyring, KeyringFile
+from pyservice.auth.revocation import is_revoked
+from pyservice.context import Settings, SettingsContext
+from pyservice.exc import AuthInvalidTokenError, KeyringError
 from pyservice.schema import ActionModel, EntityModel
+from pyservice.tracing import span
 
 
 class RefreshTokenStatus(str, Enum):
@@ -38,9 +45,17 @@ class RefreshTokenRotate(ActionModel):
     user_email: EmailStr | None = None
 
 
+class RevokedTokenStore(Protocol):
+    async def revoke_token(self, user_id: uuid.UUID, jti: str, exp: int): ...
+
+
 class RefreshTokenStore(Protocol):
     async def rotate_refresh_token(
-        self, user_id: uuid.UUID, token: str | None = None
+        self,
+        user_id: uuid.UUID,
+        token: str | None = None,
+        *,
+        session_id: uuid.UUID | None = None,
     ) -> str: ...
 
 
@@ -60,6 +75,11 @@ class Token(BaseModel):
     aud: str | list[str]
     exp: int
     iat: int
+    jti: str | None = None
+    "Unique token id, used to revoke individual tokens."
+
+    sid: str | None = None
+    "The session the token belongs to, tokens of a session rotate together."
 
     @property
     def expired(self):
@@ -91,93 +111,295 @@ class Token(BaseModel):
         return value
 
 
-def sign_access_token(*, sub: uuid.UUID, email: EmailStr) -> Tuple[str, int]:
-    ctx = SettingsContext.get()
+class TrustedClaims:
+    """The claims of a token this service signed, taken as decoded.
 
-    iat = pendulum.now(tz="UTC")
-    exp = iat + ctx.settings.JWT_TOKEN_ACCESS_DURATION
+    Claims were validated as a `Token` when the token was signed, and the
+    signature, issuer, audience and timestamps are checked when decoding it,
+    so they are not validated again. Offers the interface of `Token`, third
+    party tokens are still validated as `Token`.
 
-    iss = ctx.settings.JWT_ISSUER_ID
-    assert iss is not None
+    The subject and session of compact tokens are expanded to uuids, their
+    email is None."""
 
-    aud = ctx.settings.JWT_AUDIENCE
-    assert aud is not None
+    __slots__ = ("sub", "email", "iss", "aud", "exp", "iat", "jti", "sid", "_claims")
 
-    return sign_token(
-        Token(
-            sub=str(sub),
-            email=email,
-            iss=iss,
-            aud=aud,
-            iat=iat.int_timestamp,
-            exp=exp.int_timestamp,
+    def __init__(self, claims: dict[str, Any]):
+        self.sub: str = _expand_id(claims["sub"])
+        self.email: str | None = claims.get("email")
+        self.iss: str = claims["iss"]
+        self.aud: str | list[str] = claims["aud"]
+        self.exp: int = claims["exp"]
+        self.iat: int = claims["iat"]
+        self.jti: str | None = claims.get("jti")
+        sid = claims.get("sid")
+        self.sid: str | None = _expand_id(sid) if sid is not None else None
+        self._claims = claims
+
+    @property
+    def expired(self):
+        return self.exp < time.time()
+
+    def intended_for(self, aud: str | list[str]) -> bool:
+        if isinstance(self.aud, list):
+            return aud in self.aud
+        return self.aud == aud
+
+    def get_claim(self, claim: str) -> Any | None:
+        if claim in self.__slots__:
+            return None
+        return self._claims.get(claim)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the claims laid out as a serialized `Token`."""
+        return {
+            **self._claims,
+            "sub": self.sub,
+            "email": self.email,
+            "iss": self.iss,
+            "aud": self.aud,
+            "exp": self.exp,
+            "iat": self.iat,
+            "jti": self.jti,
+            "sid": self.sid,
+        }
+
+
+class TokenIntrospect(ActionModel):
+    tokens: list[str]
+
+    @field_validator("tokens", mode="before")
+    @classmethod
+    def validate_tokens(cls, value):
+        # Before the tokens are validated one by one.
+        max_tokens = SettingsContext.get().settings.API_INTROSPECT_MAX_TOKENS
+        if isinstance(value, list) and len(value) > max_tokens:
+            raise ValueError(f"At most {max_tokens} tokens can be introspected.")
+        return value
+
+
+class TokenIntrospection(BaseModel):
+    index: int
+    "The position of the token in the introspection request."
+
+    active: bool
+    claims: Token | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class TokenConfig:
+    """Immutable snapshot of the jwt settings used to sign and verify tokens.
+
+    Derived once per `Settings` instance, see `get_token_config`."""
+
+    keyring_source: Keyring | KeyringFile | None
+    issuer: str | None
+    audience: tuple[str, ...] | None
+    access_duration: pendulum.Duration
+    refresh_duration: pendulum.Duration
+    claim_profile: Literal["full", "compact"] = "full"
+    compact_issuer: str | None = None
+
+    @property
+    def includes_email(self) -> bool:
+        return self.claim_profile == "full"
+
+    @property
+    def issuers(self) -> tuple[str, ...]:
+        """The issuers accepted when verifying tokens."""
+        assert self.issuer is not None
+        if self.compact_issuer is None:
+            return (self.issuer,)
+        return (self.issuer, self.compact_issuer)
+
+    @property
+    def keyring(self) -> Keyring:
+        source = self.keyring_source
+        if source is None:
+            raise KeyringError("Neither a jwt key nor a keyring is configured.")
+        if isinstance(source, KeyringFile):
+            return source.get()
+        return source
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "TokenConfig":
+        keyring_source = None
+        if settings.JWT_KEYRING_FILE is not None:
+            keyring_source = KeyringFile(
+                settings.JWT_KEYRING_FILE,
+                reload_interval=settings.JWT_KEYRING_RELOAD_INTERVAL.total_seconds(),
+                legacy_key=settings.JWT_KEY,
+            )
+        elif settings.JWT_KEYRING is not None or settings.JWT_KEY is not None:
+            keyring_source = Keyring.from_settings(
+                settings.JWT_KEYRING, legacy_key=settings.JWT_KEY
+            )
+
+        issuer = settings.JWT_ISSUER_ID
+        audience = settings.JWT_AUDIENCE
+        return cls(
+            keyring_source=keyring_source,
+            issuer=str(issuer) if issuer is not None else None,
+            audience=tuple(audience) if audience is not None else None,
+            access_duration=settings.JWT_TOKEN_ACCESS_DURATION,
+            refresh_duration=settings.JWT_TOKEN_REFRESH_DURATION,
+            claim_profile=settings.JWT_CLAIM_PROFILE,
+            compact_issuer=settings.JWT_COMPACT_ISSUER,
         )
-    )
 
 
-def sign_refresh_token(*, sub: uuid.UUID, email: EmailStr) -> Tuple[str, int]:
-    ctx = SettingsContext.get()
+_TOKEN_CONFIGS: dict[int, TokenConfig] = {}
+"""_TOKEN_CONFIGS maps the identity of a `Settings` instance to its snapshot.
+Entries are dropped once the settings instance is garbage collected."""
+
+
+def get_token_config(settings: Settings | None = None) -> TokenConfig:
+    if settings is None:
+        settings = SettingsContext.get().settings
+
+    key = id(settings)
+    config = _TOKEN_CONFIGS.get(key)
+    if config is None:
+        config = TokenConfig.from_settings(settings)
+        _TOKEN_CONFIGS[key] = config
+        weakref.finalize(settings, _TOKEN_CONFIGS.pop, key, None)
+    return config
+
+
+def sign_access_token(
+    *,
+    sub: uuid.UUID,
+    email: EmailStr | None = None,
+    session_id: uuid.UUID | None = None,
+) -> Tuple[str, int]:
+    config = get_token_config()
+    return _sign_claims(config, sub, email, session_id, config.access_duration)
 
-    iat = pendulum.now(tz="UTC")
-    exp = iat + ctx.settings.JWT_TOKEN_REFRESH_DURATION
 
-    iss = ctx.settings.JWT_ISSUER_ID
-    assert iss is not None
+def sign_refresh_token(
+    *,
+    sub: uuid.UUID,
+    email: EmailStr | None = None,
+    session_id: uuid.UUID | None = None,
+) -> Tuple[str, int]:
+    config = get_token_config()
+    return _sign_claims(config, sub, email, session_id, config.refresh_duration)
 
-    aud = ctx.settings.JWT_AUDIENCE
-    assert aud is not None
+
+def _sign_claims(
+    config: TokenConfig,
+    sub: uuid.UUID,
+    email: EmailStr | None,
+    session_id: uuid.UUID | None,
+    duration: pendulum.Duration,
+) -> Tuple[str, int]:
+    iat = pendulum.now(tz="UTC")
+    exp = iat + duration
+
+    assert config.issuer is not None
+    assert config.audience is not None
+
+    if config.claim_profile == "compact":
+        # Built from trusted values only, there is nothing to validate.
+        audience = config.audience
+        payload = {
+            "sub": _compact_id(sub),
+            "iss": config.compact_issuer or config.issuer,
+            "aud": audience[0] if len(audience) == 1 else list(audience),
+            "iat": iat.int_timestamp,
+            "exp": exp.int_timestamp,
+            "jti": _compact_id(uuid.uuid4()),
+        }
+        if session_id is not None:
+            payload["sid"] = _compact_id(session_id)
+        return _encode(payload, config), exp.int_timestamp - iat.int_timestamp
+
+    if email is None:
+        raise AuthInvalidTokenError("Full tokens require the email of the user.")
 
     return sign_token(
         Token(
             sub=str(sub),
             email=email,
-            iss=iss,
-            aud=aud,
+            iss=HttpUrl(config.issuer),
+            aud=list(config.audience),
             iat=iat.int_timestamp,
             exp=exp.int_timestamp,
-        )
+            jti=uuid.uuid4().hex,
+            sid=str(session_id) if session_id is not None else None,
+        ),
+        config=config,
     )
 
 
-def verify_token(token: str) -> Token:
-    ctx = SettingsContext.get()
+def _compact_id(value: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(value.bytes).rstrip(b"=").decode()
+
+
+def _expand_id(value: str) -> str:
+    """Return the uuid encoded in a compact id, other values as they are."""
+    if len(value) != 22:
+        return value
+    try:
+        return str(uuid.UUID(bytes=base64.urlsafe_b64decode(value + "==")))
+    except ValueError:
+        return value
+
+
+_REQUIRED_CLAIMS = ["sub", "exp", "iat"]
+
 
-    key = ctx.settings.JWT_KEY
-    assert key is not None
+def verify_token(token: str, *, config: TokenConfig | None = None) -> TrustedClaims:
+    config = config or get_token_config()
 
-    issuer = ctx.settings.JWT_ISSUER_ID
-    assert issuer is not None
+    assert config.issuer is not None
 
-    audience = ctx.settings.JWT_AUDIENCE
+    with span("jwt.verify"):
+        return _verify_token(token, config)
 
+
+def _verify_token(token: str, config: TokenConfig) -> TrustedClaims:
     try:
+        # Pick the verification key by kid so rotated keys keep verifying.
+        header = jwt.get_unverified_header(token)
+        key = config.keyring.verification_key(header.get("kid"))
+        if key is None:
+            raise AuthInvalidTokenError("Token was signed with an unknown key.")
+
         decoded_token: dict[str, Any] = jwt.decode(
             token,
-            key.get_secret_value(),
-            algorithms=["HS256"],
-            issuer=str(issuer),
-            audience=audience,
+            key.verifying_key,
+            algorithms=[key.algorithm],
+            issuer=config.issuers,
+            audience=config.audience,
+            options={"require": _REQUIRED_CLAIMS},
         )
     except jwt.InvalidTokenError as e:
         raise AuthInvalidTokenError("Failed to verify invalid token.") from e
 
-    return Token.model_validate(decoded_token)
+    if is_revoked(decoded_token.get("jti")):
+        raise AuthInvalidTokenError("Token has been revoked.")
+
+    return TrustedClaims(decoded_token)
 
 
-def sign_token(token: Token) -> Tuple[str, int]:
-    ctx = SettingsContext.get()
+def sign_token(token: Token, *, config: TokenConfig | None = None) -> Tuple[str, int]:
+    config = config or get_token_config()
+    payload = token.model_dump(mode="json", exclude_none=True)
+    return _encode(payload, config), token.exp - token.iat
 
-    key = ctx.settings.JWT_KEY
-    assert key is not None
 
-    payload = token.model_dump(mode="json")
-    expires_in = token.exp - token.iat
+def _encode(payload: dict[str, Any], config: TokenConfig) -> str:
+    key = config.keyring.active
+    assert key.signing_key is not None
 
     try:
-        return jwt.encode(
-            payload,
-            key.get_secret_value(),
-            algorithm="HS256",
-        ), expires_in
+        with span("jwt.sign"):
+            return jwt.encode(
+                payload,
+                key.signing_key,
+                algorithm=key.algorithm,
+                headers={"kid": key.kid} if key.kid is not None else None,
+            )
     except jwt.InvalidTokenError as e:
         raise AuthInvalidTokenError("Failed to sign invalid token.") from e
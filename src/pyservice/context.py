@@ -1,8 +1,19 @@
+import os
+import tempfile
 from contextlib import AbstractContextManager, contextmanager
 from contextvars import ContextVar, Token
-from typing import Any, ClassVar, Mapping, Self, override
-
-from pydantic import BaseModel, ConfigDict, HttpUrl, PrivateAttr, SecretStr
+from pathlib import Path
+from typing import Any, ClassVar, Literal, Mapping, Self, override
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    HttpUrl,
+    PrivateAttr,
+    SecretStr,
+    model_validator,
+)
 from pydantic_extra_types.pendulum_dt import Duration
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -20,25 +31,120 @@ class ContextModel(AbstractContextManager, BaseModel):
 
     @override
     def __enter__(self):
-        if self._token is not None:
+        # Private attributes are accessed through __pydantic_private__
+        # directly, going through BaseModel.__getattr__ is comparatively slow.
+        private = self.__pydantic_private__
+        assert private is not None
+        if private["_token"] is not None:
             raise RuntimeError(
                 "Nesting a context model more than once is prohibited. "
                 "Make sure to release the context model earlier in the call stack "
                 "before entering it again."
             )
-        self._token = self.__var__.set(self)
+        private["_token"] = self.__var__.set(self)
         return self
 
     @override
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._token is None:
+        private = self.__pydantic_private__
+        assert private is not None
+        if private["_token"] is None:
             raise RuntimeError("Cannot exit a context model that has not been entered.")
-        self.__var__.reset(self._token)
+        self.__var__.reset(private["_token"])
 
     @classmethod
     def get(cls) -> Self | None:
         return cls.__var__.get(None)
 
+    @classmethod
+    def unchecked(cls, **values: Any) -> Self:
+        """Construct the context model without running validation.
+
+        Meant for hot paths where the values are known to be valid already,
+        e.g. settings copied from a validated instance."""
+        fields, private = _unchecked_layout(cls)
+        if values.keys() != fields:
+            # Defaults need to be filled in, leave it to pydantic.
+            return cls.model_construct(**values)
+
+        self = cls.__new__(cls)
+        object.__setattr__(self, "__dict__", values)
+        object.__setattr__(self, "__pydantic_fields_set__", set(fields))
+        object.__setattr__(self, "__pydantic_extra__", None)
+        object.__setattr__(self, "__pydantic_private__", dict(private))
+        return self
+
+
+_UNCHECKED_LAYOUTS: dict[type[ContextModel], tuple[frozenset[str], dict[str, Any]]] = {}
+
+
+def _unchecked_layout(
+    cls: type[ContextModel],
+) -> tuple[frozenset[str], dict[str, Any]]:
+    """Return the field names and private attribute defaults of a context model.
+
+    Private attribute defaults are shared between instances, they have to be
+    immutable."""
+    layout = _UNCHECKED_LAYOUTS.get(cls)
+    if layout is None:
+        layout = (
+            frozenset(cls.model_fields),
+            {
+                name: attr.get_default()
+                for name, attr in cls.__private_attributes__.items()
+            },
+        )
+        _UNCHECKED_LAYOUTS[cls] = layout
+    return layout
+
+
+class JWTKeySettings(BaseModel):
+    kid: str
+    "The key id, sent in the header of issued jwt tokens."
+
+    key: SecretStr
+    """The symmetric key for HS256. For EdDSA and ES256, a PEM encoded private
+    key, or a public key for keys that are only kept around for verification."""
+
+    algorithm: Literal["HS256", "EdDSA", "ES256"] = "HS256"
+    "The jwt algorithm the key is used with."
+
+
+class JWTKeyringSettings(BaseModel):
+    active_kid: str
+    "The kid of the key used to issue new tokens. Every other key only verifies."
+
+    keys: list[JWTKeySettings]
+    "All keys accepted when verifying tokens."
+
+    @model_validator(mode="after")
+    def validate_kids(self):
+        kids = [key.kid for key in self.keys]
+        if len(set(kids)) != len(kids):
+            raise ValueError("Keyring kids must be unique")
+        if self.active_kid not in kids:
+            raise ValueError("Keyring active_kid must reference one of its keys")
+        return self
+
+
+class DatabaseShardSettings(BaseModel):
+    name: str
+    "The name of the shard, recorded for every user placed on it."
+
+    url: SecretStr
+    "The database url of the shard, including the driver and credentials."
+
+
+class DatabasePoolSettings(BaseModel):
+    pool_size: int
+    "The connections kept open in the pool."
+
+    max_overflow: int = 0
+    "The connections opened beyond pool_size while the pool is exhausted."
+
+    pool_timeout: Duration = Duration(seconds=30)
+    "How long a checkout waits for a connection before it fails."
+
 
 class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
@@ -52,24 +158,185 @@ class Settings(BaseSettings):
     JWT_KEY: SecretStr | None = None
     "The symmetric key used to issue and verify jwt authentication tokens."
 
+    JWT_KEYRING: JWTKeyringSettings | None = None
+    """The keys used to issue and verify jwt authentication tokens, takes
+    precedence over JWT_KEY. If both are set, JWT_KEY keeps verifying tokens
+    that were issued without a kid."""
+
+    JWT_KEYRING_FILE: Path | None = None
+    """A json file laid out like JWT_KEYRING, takes precedence over JWT_KEYRING.
+    The file is re-read when it changes, without restarting the service."""
+
+    JWT_KEYRING_RELOAD_INTERVAL: Duration = Duration(seconds=30)
+    "How often JWT_KEYRING_FILE is checked for changes."
+
+    JWT_JWKS_MAX_AGE: Duration = Duration(minutes=5)
+    """How long clients may cache the public keys published as JWKS. New
+    asymmetric keys have to be in the keyring at least this long before
+    they become active."""
+
     JWT_TOKEN_ACCESS_DURATION: Duration = Duration(hours=3)
     "How long should a jwt access token be valid for."
 
     JWT_TOKEN_REFRESH_DURATION: Duration = Duration(days=30)
     "How long should a jwt refresh token be valid for."
 
+    JWT_MAX_SESSIONS: int = Field(default=10, ge=1)
+    """The active sessions per user, each with its own refresh token. A login
+    beyond it ends the session refreshed longest ago."""
+
+    JWT_REFRESH_REUSE_GRACE: Duration = Duration(seconds=10)
+    """How long after a refresh the rotated refresh token may be presented
+    again, returning the same result. Zero disables the grace window."""
+
+    JWT_REFRESH_REUSE_MAX: int = 3
+    "How often a rotated refresh token may be reused within the grace window."
+
+    JWT_REFRESH_REUSE_CACHE_SIZE: int = 10_000
+    "The maximum number of rotations remembered for the grace window."
+
+    JWT_REVOCATION_RESYNC_INTERVAL: Duration = Duration(minutes=5)
+    """How often every worker reloads all token revocations, in addition to
+    the notifications it receives for each new revocation."""
+
     JWT_ISSUER_ID: HttpUrl | None = None
     "The issuer id encoded in jwt tokens issued by this service."
 
     JWT_AUDIENCE: list[str] | None = None
     "The allowed audience for jwt tokens issued by this service."
 
+    JWT_CLAIM_PROFILE: Literal["full", "compact"] = "full"
+    """The claims of issued tokens. "compact" leaves out the email and
+    encodes the subject and token id in 22 characters each, tokens of both
+    profiles are verified regardless of this setting."""
+
+    JWT_COMPACT_ISSUER: str | None = None
+    """A short issuer id encoded in compact tokens instead of JWT_ISSUER_ID.
+    Tokens with either issuer are accepted while it is set."""
+
     OIDC_GOOGLE_CLIENT_ID: str | None = None
     "The client id of your service, as defined by Google."
 
     OIDC_APPLE_CLIENT_ID: str | None = None
     "The client id of your service, as defined by Apple."
 
+    OIDC_APPLE_KEYS_URL: HttpUrl = HttpUrl("https://appleid.apple.com/auth/keys")
+    "Where Apple publishes the keys of its ID tokens, as JWKS."
+
+    OIDC_APPLE_ISSUER: HttpUrl = HttpUrl("https://appleid.apple.com")
+    "The issuer of Apple ID tokens."
+
+    OIDC_GOOGLE_CERTS_URL: HttpUrl = HttpUrl(
+        "https://www.googleapis.com/oauth2/v1/certs"
+    )
+    """Where Google publishes the certificates of its ID tokens. Point both
+    urls to stub providers to run the service without the real ones."""
+
+    OIDC_CACHE_DIRECTORY: Path | None = (
+        Path(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir())
+        / f"pyservice-cache-{os.getuid()}"
+    )
+    """The directory of the caches the worker processes of a node share, for
+    the keys of OIDC providers and verified ID tokens. It must be private to
+    the user of the service. None keeps every cache within its process."""
+
+    OIDC_KEYS_CACHE_DURATION: Duration = Duration(minutes=10)
+    "How long the keys of an OIDC provider are used before they are fetched again."
+
+    OIDC_ID_TOKEN_CACHE_DURATION: Duration = Duration(minutes=5)
+    """How long a verified ID token is remembered, never past its expiry. Zero
+    verifies every ID token again."""
+
+    OIDC_ID_TOKEN_CACHE_SIZE: int = 4096
+    "The most verified ID tokens remembered, the first to expire are evicted."
+
+    API_INTERNAL_KEY: SecretStr | None = None
+    """The bearer token internal callers, e.g. gateways, present to reach
+    internal endpoints. Internal endpoints reject every request while unset."""
+
+    API_INTROSPECT_MAX_TOKENS: int = 1000
+    "The maximum number of tokens accepted by a single introspection request."
+
+    API_AUDIT_BUFFER_SIZE: int = 100_000
+    "The most audit events held in memory while waiting to be written."
+
+    API_AUDIT_OVERFLOW: Literal["drop_newest", "drop_oldest"] = "drop_oldest"
+    "Which audit event is dropped when the buffer is full."
+
+    API_AUDIT_FLUSH_INTERVAL: Duration = Duration(milliseconds=500)
+    "How often buffered audit events are written."
+
+    API_AUDIT_FLUSH_BATCH_SIZE: int = 1000
+    "Audit events are written as soon as this many are buffered."
+
+    API_LOGIN_BUFFER_SIZE: int = 100_000
+    """The most users whose last login is buffered between writes, logins of
+    further users are not tracked."""
+
+    API_LOGIN_FLUSH_INTERVAL: Duration = Duration(seconds=10)
+    "How often the buffered last logins are written."
+
+    API_PROFILE_SAMPLE_RATE: float = 0.0
+    "The fraction of requests that are profiled."
+
+    API_PROFILE_KEY: SecretStr | None = None
+    """Requests with a profiling header signed with this key are profiled.
+    Without a key and a sample rate, profiling is disabled entirely."""
+
+    API_PROFILE_INTERVAL: Duration = Duration(milliseconds=5)
+    "How often the stack of a profiled request is sampled."
+
+    API_PROFILE_DIRECTORY: Path = Path(tempfile.gettempdir()) / "pyservice-profiles"
+    "The directory request profiles are written to."
+
+    API_PROFILE_MAX_PROFILES: int = 100
+    "The most profiles kept, the oldest are deleted first."
+
+    API_MEMORY_MAX_SNAPSHOTS: int = 4
+    """The most memory snapshots kept, the oldest are dropped first. Every
+    snapshot holds a copy of the traced allocations."""
+
+    API_LOOP_MONITOR_INTERVAL: Duration | None = Duration(milliseconds=100)
+    "How often the event loop lag is measured, None disables the monitor."
+
+    API_LOOP_STALL_THRESHOLD: Duration = Duration(milliseconds=250)
+    "The stack of code blocking the event loop for longer than this is logged."
+
+    API_TRACE_EXPORTER: Literal["memory", "otlp-file"] | None = "memory"
+    """Where request traces go, the most recent kept in memory and served at
+    /admin/traces, or appended to API_TRACE_FILE. None disables tracing."""
+
+    API_TRACE_SAMPLE_RATE: float = 0.01
+    "The fraction of requests that are traced."
+
+    API_TRACE_PARENT_BASED: bool = False
+    """Whether a W3C traceparent header sent by the caller decides if a request
+    is traced. Enable only when every caller is trusted, such as behind a proxy
+    that drops the header of clients, otherwise clients can force tracing."""
+
+    API_TRACE_BUFFER_SIZE: int = 200
+    "The most traces kept in memory by the memory exporter."
+
+    API_TRACE_FILE: Path = Path(tempfile.gettempdir()) / "pyservice-traces.jsonl"
+    "The file the otlp-file exporter appends traces to, as OTLP/JSON lines."
+
+    API_CAPTURE_DIRECTORY: Path | None = None
+    """Requests are recorded to an anonymized timeline in this directory, one
+    file per worker, to be replayed with `python -m pyservice.perf.replay`.
+    None disables capturing."""
+
+    API_CAPTURE_KEY: SecretStr | None = None
+    """The key token and user pseudonyms are derived with. Workers sharing it
+    link tokens issued by one worker to their use with another, without it
+    every worker uses a random key."""
+
+    API_JOBS_ENABLED: bool = True
+    "Whether this replica runs background jobs."
+
+    API_JOBS_LEADER_CHECK_INTERVAL: Duration = Duration(seconds=10)
+    """How often replicas try to become leader for singleton jobs, and the
+    leader checks it still is."""
+
     API_DATABASE_DRIVER: str = "postgresql+asyncpg"
     "The database dialect and DBAPI driver used to connect to the database."
 
@@ -88,6 +355,60 @@ class Settings(BaseSettings):
     API_DATABASE_NAME: str = "pyservice"
     "The name of the database to connect to."
 
+    API_DATABASE_SHARDS: list[DatabaseShardSettings] | None = None
+    """The databases users and their tokens are spread over. The database
+    configured above keeps the directory of which shard holds which user.
+    Without shards, everything lives in that database."""
+
+    API_DATABASE_POOLS: dict[str, DatabasePoolSettings] = {
+        "auth": DatabasePoolSettings(
+            pool_size=10, max_overflow=5, pool_timeout=Duration(seconds=2)
+        ),
+        "admin": DatabasePoolSettings(
+            pool_size=2, max_overflow=1, pool_timeout=Duration(seconds=10)
+        ),
+        "background": DatabasePoolSettings(
+            pool_size=3, pool_timeout=Duration(seconds=30)
+        ),
+    }
+    """Connection pools by workload, so a slow workload can't take the
+    connections of another. Routes use the pool named by their first tag
+    with one, background jobs the background pool, everything else shares
+    a default pool."""
+
+    API_DATABASE_SLOW_STATEMENT_THRESHOLD: Duration = Duration(milliseconds=250)
+    "Database statements slower than this are logged, with parameters redacted."
+
+    API_DATABASE_SLOW_STATEMENT_LOG_INTERVAL: Duration = Duration(minutes=1)
+    "Per statement, at most one slow statement is logged within this interval."
+
+    API_DATABASE_EXPLAIN_THRESHOLD: Duration | None = None
+    """Debug mode, select statements slower than this are run again with
+    EXPLAIN (ANALYZE, BUFFERS) and their plan is logged."""
+
+    API_DATABASE_MIGRATION_LOCK_TIMEOUT: Duration = Duration(seconds=3)
+    """Migrations waiting longer than this for a lock are rolled back and
+    retried, instead of blocking every query queued behind them."""
+
+    API_DATABASE_MIGRATION_STATEMENT_TIMEOUT: Duration = Duration(minutes=10)
+    "Migration statements running longer than this are cancelled."
+
+    API_DATABASE_MIGRATION_RETRIES: int = 10
+    "The number of times a migration is retried after a lock timeout."
+
+    API_DATABASE_MIGRATION_RETRY_DELAY: Duration = Duration(seconds=1)
+    "The delay before the first retry of a migration, doubled for every retry."
+
+    API_DATABASE_MIGRATION_MAX_REPLICATION_LAG: Duration = Duration(seconds=10)
+    "Backfills pause while a replica lags behind by more than this."
+
+    @model_validator(mode="after")
+    def validate_shard_names(self):
+        names = [shard.name for shard in self.API_DATABASE_SHARDS or []]
+        if len(set(names)) != len(names):
+            raise ValueError("Database shard names must be unique")
+        return self
+
     model_config = SettingsConfigDict(
         env_prefix="PYSERVICE_", env_file=(".env.dev", ".env")
     )
@@ -118,7 +439,10 @@ _SETTINGS_CONTEXT = _create_root_settings_context()
 
 @contextmanager
 def temporary_settings(updates: Mapping[str, Any]):
+    """Overlay `updates` on the current settings for the duration of the block.
+
+    The copy is shallow, settings are treated as immutable once loaded."""
     ctx = SettingsContext.get()
-    settings = ctx.settings.model_copy(update=updates, deep=True)
-    with SettingsContext(settings=settings) as ctx:
+    settings = ctx.settings.model_copy(update=updates)
+    with SettingsContext.unchecked(settings=settings) as ctx:
         yield ctx
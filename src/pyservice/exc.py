@@ -23,3 +23,9 @@ class AuthTokenHashVerifyError(AuthError):
     "Raised when a refresh token cannot be verified against its hash."
 
     ...
+
+
+class KeyringError(PyserviceError):
+    "Raised when the keys used to issue and verify tokens cannot be loaded."
+
+    ...
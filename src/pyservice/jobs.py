@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import random
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Protocol
+
+import pyservice.logger as logger
+from pyservice.metrics import counter, histogram
+
+_JOB_SECONDS = histogram(
+    "pyservice_job_seconds",
+    "Duration of background job runs, by job.",
+    labelnames=("job",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+_JOB_FAILURES = counter(
+    "pyservice_job_failures",
+    "Background job runs that raised or timed out, by job.",
+    labelnames=("job",),
+)
+_JOB_SKIPS = counter(
+    "pyservice_job_skips",
+    "Singleton job runs skipped because another replica leads, by job.",
+    labelnames=("job",),
+)
+
+
+class Schedule(Protocol):
+    def next_run(self, now: datetime.datetime) -> datetime.datetime:
+        """Return when to run next, strictly after `now`."""
+        ...
+
+
+@dataclass(frozen=True, slots=True)
+class Interval:
+    every: datetime.timedelta
+
+    def next_run(self, now: datetime.datetime) -> datetime.datetime:
+        return now + self.every
+
+
+@dataclass(frozen=True, slots=True)
+class Cron:
+    """A cron expression of minute, hour, day of month, month and day of week.
+
+    Fields accept `*`, numbers, ranges `a-b`, steps `*/n` or `a-b/n` and
+    comma separated lists of these. Days of week count from 0, Sunday. As in
+    cron, a restricted day of month and day of week match if either does.
+    Times are UTC."""
+
+    minutes: frozenset[int]
+    hours: frozenset[int]
+    days: frozenset[int]
+    months: frozenset[int]
+    weekdays: frozenset[int]
+    any_day: bool
+    any_weekday: bool
+
+    @classmethod
+    def parse(cls, expression: str) -> "Cron":
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected five fields in cron expression {expression!r}")
+        minutes, hours, days, months, weekdays = fields
+        return cls(
+            minutes=_parse_field(minutes, 0, 59),
+            hours=_parse_field(hours, 0, 23),
+            days=_parse_field(days, 1, 31),
+            months=_parse_field(months, 1, 12),
+            weekdays=frozenset(day % 7 for day in _parse_field(weekdays, 0, 7)),
+            any_day=days == "*",
+            any_weekday=weekdays == "*",
+        )
+
+    def next_run(self, now: datetime.datetime) -> datetime.datetime:
+        run = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # Within eight years every date falls on every weekday, leap days too.
+        limit = run + datetime.timedelta(days=8 * 366)
+        while run < limit:
+            if run.month not in self.months:
+                year, month = divmod(run.month, 12)
+                run = run.replace(year=run.year + year, month=month + 1, day=1)
+                run = run.replace(hour=0, minute=0)
+            elif not self._matches_day(run):
+                run = run.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif run.hour not in self.hours:
+                run = run.replace(minute=0) + datetime.timedelta(hours=1)
+            elif run.minute not in self.minutes:
+                run += datetime.timedelta(minutes=1)
+            else:
+                return run
+        raise ValueError("Cron expression never matches.")
+
+    def _matches_day(self, run: datetime.datetime) -> bool:
+        day = run.day in self.days
+        weekday = (run.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+
+def _parse_field(field: str, low: int, high: int) -> frozenset[int]:
+    values: set[int] = set()
+    for part in field.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron field {field!r} out of range {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return frozenset(values)
+
+
+@dataclass(frozen=True, slots=True)
+class Job:
+    name: str
+    run: Callable[[], Awaitable[None]]
+    schedule: Schedule
+
+    timeout: datetime.timedelta
+    "Runs taking longer are cancelled and count as failed."
+
+    jitter: datetime.timedelta = datetime.timedelta()
+    "Every run is delayed randomly by up to this much, spreading out replicas."
+
+    singleton: bool = False
+    "Singleton jobs only run on the replica that holds the leader lock."
+
+
+class Scheduler:
+    """Runs jobs in the background of this process.
+
+    Runs of a job never overlap, the next run is scheduled once the previous
+    one finished. Whether this replica is the leader is asked right
+    before every run of a singleton job."""
+
+    def __init__(self, is_leader: Callable[[], bool] = lambda: True):
+        self._jobs: list[Job] = []
+        self._is_leader = is_leader
+
+    def add(self, job: Job):
+        self._jobs.append(job)
+
+    async def run(self):
+        async with asyncio.TaskGroup() as group:
+            for job in self._jobs:
+                group.create_task(self._loop(job), name=f"job:{job.name}")
+
+    async def _loop(self, job: Job):
+        while True:
+            now = datetime.datetime.now(datetime.UTC)
+            delay = (job.schedule.next_run(now) - now).total_seconds()
+            delay += random.uniform(0, job.jitter.total_seconds())
+            await asyncio.sleep(max(delay, 0))
+            await self.run_once(job)
+
+    async def run_once(self, job: Job) -> bool:
+        """Run the job now, return whether it ran and succeeded."""
+        if job.singleton and not self._is_leader():
+            _JOB_SKIPS.inc(job.name)
+            return False
+
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(job.timeout.total_seconds()):
+                await job.run()
+        except TimeoutError:
+            _JOB_FAILURES.inc(job.name)
+            logger.error(f"Job {job.name} timed out after {job.timeout}.")
+            return False
+        except Exception:
+            _JOB_FAILURES.inc(job.name)
+            logger.error(f"Job {job.name} failed:", exc_info=True)
+            return False
+        finally:
+            _JOB_SECONDS.observe(time.perf_counter() - start, job.name)
+        return True
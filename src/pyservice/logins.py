@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import uuid
+from collections.abc import Awaitable, Callable, MutableMapping
+from dataclasses import dataclass
+
+import pyservice.logger as logger
+from pyservice.context import SettingsContext
+from pyservice.memory import CacheSize, register_cache
+from pyservice.metrics import counter, gauge
+
+_LOGINS_DROPPED = counter(
+    "pyservice_logins_dropped",
+    "Logins not tracked because the buffer was full.",
+)
+_LOGINS_FLUSHED = counter(
+    "pyservice_login_users_flushed",
+    "Users whose last login was written to the database.",
+)
+_LOGIN_FLUSH_FAILURES = counter(
+    "pyservice_login_flush_failures",
+    "Batches of last logins that failed to be written.",
+)
+
+
+@dataclass(slots=True)
+class LoginUpdate:
+    last_login_at: datetime.datetime
+    logins: int
+    "Logins since the last flush, refreshes update the time only."
+
+
+LoginSink = Callable[[MutableMapping[uuid.UUID, LoginUpdate]], Awaitable[None]]
+"""Writes a batch of last logins. Sinks that write in several transactions
+pop the entries they committed, the entries left when it raises are put
+back, or the whole batch for sinks that pop none."""
+
+
+class LoginTracker:
+    """Coalesces the logins of every user in memory, written out in batches.
+
+    Recording never touches the database. However often a user logs in
+    between two flushes, the buffer keeps one entry with the latest time and
+    the number of logins. A failed flush puts the entries it did not write
+    back, to be merged with newer logins. When `max_users` users are
+    buffered, logins of further users are dropped until the next flush."""
+
+    def __init__(self, *, max_users: int, flush_interval: float):
+        self._updates: dict[uuid.UUID, LoginUpdate] = {}
+        self._max_users = max_users
+        self._flush_interval = flush_interval
+        self._full = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._updates)
+
+    def record(
+        self,
+        user_id: uuid.UUID,
+        *,
+        login: bool = True,
+        at: datetime.datetime | None = None,
+    ):
+        """Record that the user logged in, or with `login` False refreshed
+        its tokens."""
+        at = at or datetime.datetime.now(datetime.UTC)
+        update = self._updates.get(user_id)
+        if update is not None:
+            update.last_login_at = max(update.last_login_at, at)
+            update.logins += login
+            return
+
+        if len(self._updates) >= self._max_users:
+            _LOGINS_DROPPED.inc()
+            return
+        self._updates[user_id] = LoginUpdate(last_login_at=at, logins=int(login))
+        if len(self._updates) >= self._max_users:
+            self._full.set()
+
+    async def run(self, sink: LoginSink):
+        """Flush every `flush_interval` seconds, or as soon as the buffer is
+        full. Remaining logins are flushed when the task is cancelled."""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self._flush_interval)
+                except TimeoutError:
+                    pass
+                await self.flush(sink)
+        except asyncio.CancelledError:
+            await self.flush(sink)
+            raise
+
+    async def flush(self, sink: LoginSink):
+        if not self._updates:
+            return
+        updates, self._updates = self._updates, {}
+        self._full.clear()
+        users = len(updates)
+        try:
+            await sink(updates)
+        except Exception:
+            _LOGIN_FLUSH_FAILURES.inc()
+            logger.error(
+                f"Failed to write the last login of {len(updates)} users:",
+                exc_info=True,
+            )
+            _LOGINS_FLUSHED.inc(amount=users - len(updates))
+            self._restore(updates)
+            return
+        _LOGINS_FLUSHED.inc(amount=users)
+
+    def _restore(self, updates: dict[uuid.UUID, LoginUpdate]):
+        for user_id, update in updates.items():
+            newer = self._updates.get(user_id)
+            if newer is not None:
+                newer.last_login_at = max(newer.last_login_at, update.last_login_at)
+                newer.logins += update.logins
+            elif len(self._updates) < self._max_users:
+                self._updates[user_id] = update
+            else:
+                _LOGINS_DROPPED.inc(amount=update.logins or 1)
+
+
+_LOGIN_TRACKER: LoginTracker | None = None
+
+
+def get_login_tracker() -> LoginTracker:
+    global _LOGIN_TRACKER
+
+    if _LOGIN_TRACKER is None:
+        ctx = SettingsContext.get()
+        _LOGIN_TRACKER = LoginTracker(
+            max_users=ctx.settings.API_LOGIN_BUFFER_SIZE,
+            flush_interval=ctx.settings.API_LOGIN_FLUSH_INTERVAL.total_seconds(),
+        )
+        register_cache(
+            "login_buffer",
+            lambda: CacheSize(
+                entries=len(_LOGIN_TRACKER or ()),
+                max_entries=ctx.settings.API_LOGIN_BUFFER_SIZE,
+            ),
+        )
+        gauge(
+            "pyservice_login_buffer_users",
+            "Users whose last login waits to be written.",
+            collect=lambda: [((), float(len(_LOGIN_TRACKER or ())))],
+        )
+    return _LOGIN_TRACKER
+
+
+def record_login(user_id: uuid.UUID, *, login: bool = True):
+    """Track the user's last login, without waiting for it to be written."""
+    get_login_tracker().record(user_id, login=login)
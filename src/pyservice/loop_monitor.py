@@ -0,0 +1,68 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import pyservice.logger as logger
+from pyservice.metrics import counter, histogram
+
+_LOOP_LAG = histogram(
+    "pyservice_event_loop_lag_seconds",
+    "How late the event loop heartbeat woke up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+_LOOP_STALLS = counter(
+    "pyservice_event_loop_stalls",
+    "Times the event loop was blocked for longer than the stall threshold.",
+)
+
+
+class LoopMonitor:
+    """Measures event loop lag and logs the stack of code blocking the loop.
+
+    A heartbeat task sleeps for `interval` seconds and records how much later
+    than that it woke up. A watchdog thread checks the heartbeat, if it is
+    late by more than `stall_threshold` seconds the loop is blocked, and the
+    stack of the loop's thread is logged while it still blocks."""
+
+    def __init__(self, *, interval: float, stall_threshold: float):
+        self._interval = interval
+        self._stall_threshold = stall_threshold
+        self._last_beat = time.monotonic()
+        self._loop_thread: int | None = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        watchdog = threading.Thread(
+            target=self._watch, name="pyservice-loop-monitor", daemon=True
+        )
+        watchdog.start()
+        try:
+            while True:
+                await asyncio.sleep(self._interval)
+                now = time.monotonic()
+                _LOOP_LAG.observe(max(now - self._last_beat - self._interval, 0.0))
+                self._last_beat = now
+        finally:
+            self._stopped.set()
+            watchdog.join()
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self._stall_threshold / 2):
+            beat = self._last_beat
+            blocked = time.monotonic() - beat - self._interval
+            if blocked < self._stall_threshold or beat == reported_beat:
+                continue
+
+            # Report every stall once, while it is happening.
+            reported_beat = beat
+            _LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread)  # type: ignore[arg-type]
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                f"Event loop blocked for {blocked * 1000:.0f}ms, in:\n{stack}"
+            )
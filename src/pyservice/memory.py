@@ -0,0 +1,218 @@
+import datetime
+import functools
+import os
+import re
+import threading
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Literal
+
+from pyservice.context import SettingsContext
+
+_SNAPSHOT_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+GroupBy = Literal["lineno", "filename", "traceback"]
+
+
+@dataclass(frozen=True, slots=True)
+class CacheSize:
+    entries: int
+    max_entries: int | None = None
+    "None for caches without a limit."
+
+    bytes: int | None = None
+    "The memory the cache reserves, where it is known."
+
+
+_CACHES: dict[str, Callable[[], CacheSize]] = {}
+
+
+def register_cache(name: str, size: Callable[[], CacheSize]):
+    """Report the size of a cache of the service, replacing an earlier cache
+    of the same name."""
+    _CACHES[name] = size
+
+
+def functools_cache_size(function) -> CacheSize:
+    """The size of a function cached with functools.cache or lru_cache."""
+    info = function.cache_info()
+    return CacheSize(entries=info.currsize, max_entries=info.maxsize)
+
+
+def cache_sizes() -> dict[str, CacheSize]:
+    return {name: size() for name, size in sorted(_CACHES.items())}
+
+
+@dataclass(frozen=True, slots=True)
+class SnapshotInfo:
+    name: str
+    taken_at: datetime.datetime
+    traced_bytes: int
+    traced_blocks: int
+    traceback_limit: int
+
+
+@dataclass(frozen=True, slots=True)
+class AllocationSite:
+    location: str
+    "File and line, one per frame from the most recent on with tracebacks."
+
+    size: int
+    size_diff: int
+    count: int
+    count_diff: int
+
+
+@dataclass(frozen=True, slots=True)
+class MemoryStatus:
+    pid: int
+    "Every worker traces its own memory, reports describe this process only."
+
+    rss_bytes: int | None
+    tracing: bool
+    traced_bytes: int
+    traced_peak_bytes: int
+    traceback_limit: int
+    snapshots: list[SnapshotInfo]
+
+
+class MemoryDiagnostics:
+    """Runtime control of tracemalloc, keeping the most recent snapshots.
+
+    Tracing slows down allocations noticeably, it is off until started and
+    meant to run only while looking for growth. Snapshots stay in memory
+    until evicted by newer ones, or tracing stops."""
+
+    def __init__(self, max_snapshots: int):
+        self._max_snapshots = max_snapshots
+        self._snapshots: dict[str, tuple[SnapshotInfo, tracemalloc.Snapshot]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """Start tracing allocations, keeping `frames` frames per allocation.
+        Restarts tracing if it runs with a different frame limit."""
+        if tracemalloc.is_tracing():
+            if tracemalloc.get_traceback_limit() == frames:
+                return
+            self.stop()
+        tracemalloc.start(frames)
+
+    def stop(self):
+        """Stop tracing and drop the snapshots, freeing tracemalloc's memory."""
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def status(self) -> MemoryStatus:
+        traced, peak = tracemalloc.get_traced_memory()
+        return MemoryStatus(
+            pid=os.getpid(),
+            rss_bytes=_rss_bytes(),
+            tracing=tracemalloc.is_tracing(),
+            traced_bytes=traced,
+            traced_peak_bytes=peak,
+            traceback_limit=tracemalloc.get_traceback_limit(),
+            snapshots=self.snapshots(),
+        )
+
+    def snapshots(self) -> list[SnapshotInfo]:
+        """List the snapshots kept, oldest first."""
+        with self._lock:
+            return [info for info, _ in self._snapshots.values()]
+
+    def take_snapshot(self, name: str | None = None) -> SnapshotInfo:
+        """Take a snapshot of the traced allocations, replacing a snapshot of
+        the same name. Raises RuntimeError when not tracing."""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Memory allocations are not traced.")
+
+        now = datetime.datetime.now(datetime.UTC)
+        name = name or f"{now:%Y%m%dT%H%M%S%fZ}"
+        if not _SNAPSHOT_NAME.match(name):
+            raise ValueError(f"Invalid snapshot name {name!r}.")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        stats = snapshot.statistics("filename")
+        info = SnapshotInfo(
+            name=name,
+            taken_at=now,
+            traced_bytes=sum(stat.size for stat in stats),
+            traced_blocks=sum(stat.count for stat in stats),
+            traceback_limit=snapshot.traceback_limit,
+        )
+        with self._lock:
+            self._snapshots.pop(name, None)
+            self._snapshots[name] = (info, snapshot)
+            while len(self._snapshots) > self._max_snapshots:
+                del self._snapshots[next(iter(self._snapshots))]
+        return info
+
+    def top(
+        self, name: str, *, limit: int = 25, group_by: GroupBy = "lineno"
+    ) -> list[AllocationSite]:
+        """Return the largest allocation sites of a snapshot.
+        Raises KeyError for unknown snapshots."""
+        stats = self._snapshot(name).statistics(group_by)
+        return [
+            AllocationSite(
+                location=_location(stat.traceback),
+                size=stat.size,
+                size_diff=0,
+                count=stat.count,
+                count_diff=0,
+            )
+            for stat in stats[:limit]
+        ]
+
+    def diff(
+        self, old: str, new: str, *, limit: int = 25, group_by: GroupBy = "lineno"
+    ) -> list[AllocationSite]:
+        """Return the allocation sites that grew or shrank most from snapshot
+        `old` to `new`. Raises KeyError for unknown snapshots."""
+        stats = self._snapshot(new).compare_to(self._snapshot(old), group_by)
+        return [
+            AllocationSite(
+                location=_location(stat.traceback),
+                size=stat.size,
+                size_diff=stat.size_diff,
+                count=stat.count,
+                count_diff=stat.count_diff,
+            )
+            for stat in stats[:limit]
+        ]
+
+    def _snapshot(self, name: str) -> tracemalloc.Snapshot:
+        with self._lock:
+            return self._snapshots[name][1]
+
+
+def _location(traceback: tracemalloc.Traceback) -> str:
+    return " <- ".join(
+        f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback)
+    )
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@functools.cache
+def get_memory_diagnostics() -> MemoryDiagnostics:
+    ctx = SettingsContext.get()
+
+    return MemoryDiagnostics(ctx.settings.API_MEMORY_MAX_SNAPSHOTS)
@@ -0,0 +1,165 @@
+"""Recording anonymized request timelines, to replay them against a build.
+
+A capture holds no secrets. Tokens are replaced by keyed hashes, so a replay
+still sees which request used the refresh token another request received,
+and users of OIDC logins by a keyed hash of their provider and subject."""
+
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Any
+
+import jwt
+
+import pyservice.logger as logger
+
+CAPTURE_VERSION = 1
+
+
+@dataclass(slots=True)
+class CapturedRequest:
+    offset: float
+    "Seconds from the start of the capture to the start of the request."
+
+    method: str
+    route: str
+    status: int
+    duration: float
+    user: str | None = None
+    "Pseudonym of the user logging in, for OIDC logins."
+
+    token: str | None = None
+    "Pseudonym of the bearer token presented."
+
+    issued: list[str] = field(default_factory=list)
+    "Pseudonyms of the tokens in the response."
+
+    def to_json(self) -> dict[str, Any]:
+        line: dict[str, Any] = {
+            "t": round(self.offset, 6),
+            "m": self.method,
+            "r": self.route,
+            "s": self.status,
+            "d": round(self.duration, 6),
+        }
+        if self.user is not None:
+            line["u"] = self.user
+        if self.token is not None:
+            line["i"] = self.token
+        if self.issued:
+            line["o"] = self.issued
+        return line
+
+    @classmethod
+    def from_json(cls, line: dict[str, Any], start: float = 0.0) -> "CapturedRequest":
+        return cls(
+            offset=start + line["t"],
+            method=line["m"],
+            route=line["r"],
+            status=line["s"],
+            duration=line["d"],
+            user=line.get("u"),
+            token=line.get("i"),
+            issued=line.get("o", []),
+        )
+
+
+class TrafficCapture:
+    """Appends captured requests to a gzipped json lines file per process.
+
+    Every file starts with a header line holding the capture's start time,
+    offsets of requests are relative to it. Pseudonyms are keyed with `key`,
+    workers need the same key for tokens issued by one and used with another
+    to be linked."""
+
+    def __init__(self, directory: Path, key: bytes | None = None):
+        self._key = key or secrets.token_bytes(32)
+        self._start = time.time()
+        self._start_monotonic = time.monotonic()
+        self._lock = threading.Lock()
+        self._file: IO[str] | None = None
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = (
+            directory
+            / f"capture-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.ndjson.gz"
+        )
+
+    def pseudonym(self, value: str) -> str:
+        digest = hmac.new(self._key, value.encode(), hashlib.sha256).hexdigest()
+        return digest[:16]
+
+    def user_pseudonym(self, id_token: str) -> str | None:
+        """Return the pseudonym of the user an ID token is for, read without
+        verifying the token, None if it can't be read."""
+        try:
+            claims = jwt.decode(id_token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            return None
+        return self.pseudonym(f"{claims.get('iss')}|{claims.get('sub')}")
+
+    def offset(self) -> float:
+        return time.monotonic() - self._start_monotonic
+
+    def record(self, request: CapturedRequest):
+        line = json.dumps(request.to_json(), separators=(",", ":")) + "\n"
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = gzip.open(self.path, "at")
+                    header = {"v": CAPTURE_VERSION, "start": self._start}
+                    self._file.write(json.dumps(header) + "\n")
+                self._file.write(line)
+        except OSError:
+            logger.error(f"Failed to write capture {self.path}:", exc_info=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_captures(paths: list[Path]) -> list[CapturedRequest]:
+    """Read capture files, e.g. of several workers, into one timeline.
+
+    Offsets of the result are relative to the earliest capture start."""
+    requests: list[CapturedRequest] = []
+    starts: list[float] = []
+    for path in paths:
+        lines = _read_lines(path)
+        header = next(lines, None)
+        if header is None:
+            continue
+        if header.get("v") != CAPTURE_VERSION:
+            raise ValueError(f"Unsupported capture version in {path}.")
+        starts.append(header["start"])
+        requests.extend(
+            CapturedRequest.from_json(line, start=header["start"]) for line in lines
+        )
+
+    if not requests:
+        return []
+    start = min(starts)
+    for request in requests:
+        request.offset -= start
+    requests.sort(key=lambda request: request.offset)
+    return requests
+
+
+def _read_lines(path: Path) -> Iterator[dict[str, Any]]:
+    # A worker killed mid write leaves a truncated file.
+    try:
+        with gzip.open(path, "rt") as file:
+            for line in file:
+                yield json.loads(line)
+    except (EOFError, json.JSONDecodeError):
+        return
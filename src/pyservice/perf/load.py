@@ -0,0 +1,391 @@
+"""Drive a running instance of the service with logins and refreshes at a
+fixed rate, to find the rate it sustains.
+
+Start the instance with its OIDC key urls pointing to the stub this tool
+serves, as for replays, e.g. for the default stub port:
+
+    PYSERVICE_OIDC_APPLE_KEYS_URL=http://127.0.0.1:9100/apple/keys
+    PYSERVICE_OIDC_GOOGLE_CERTS_URL=http://127.0.0.1:9100/google/keys
+
+then run `python -m pyservice.perf.load --rate 50 --rate 100 --duration 60`.
+Every rate runs for `--duration` seconds, one after the other.
+
+The load is open loop: requests start at their scheduled times whether
+earlier ones finished or not. Latencies are reported from sending the
+request and, corrected for coordinated omission, from its scheduled start.
+When the generator falls behind, e.g. waiting for a connection or for a
+session to refresh, only the corrected numbers include that wait."""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal, cast, get_args
+
+from pyservice.context import SettingsContext
+from pyservice.perf.stats import percentile
+from pyservice.perf.stub_oidc import Provider, StubOIDC
+
+Scenario = Literal["first_login", "returning_login", "refresh", "duplicate_refresh"]
+SCENARIOS: tuple[Scenario, ...] = get_args(Scenario)
+
+DEFAULT_MIX = "first_login=1,returning_login=4,refresh=4,duplicate_refresh=1"
+
+
+@dataclass(slots=True)
+class Sample:
+    scenario: Scenario
+    status: int
+    "The status of the response, 0 if none was received."
+
+    latency: float
+    "Seconds from sending the request to its response."
+
+    corrected: float
+    "Seconds from the scheduled start of the request to its response."
+
+    completed: float
+    error: str | None = None
+
+
+@dataclass(slots=True)
+class _Session:
+    provider: Provider
+    sub: str
+    refresh_token: str
+
+
+def parse_mix(mix: str) -> dict[Scenario, float]:
+    """Parse weights like `refresh=4,first_login=1`."""
+    weights: dict[Scenario, float] = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, expected one of {SCENARIOS}.")
+        weights[cast(Scenario, name)] = float(weight or 1)
+    if not any(weight > 0 for weight in weights.values()):
+        raise ValueError("At least one scenario needs a positive weight.")
+    return weights
+
+
+class LoadGenerator:
+    """Logs in stub users and refreshes their tokens.
+
+    Returning logins and refreshes use separate users: a login rotates the
+    user's refresh token, the sessions kept for refreshing would break."""
+
+    def __init__(
+        self,
+        *,
+        client,
+        stub: StubOIDC,
+        audiences: dict[Provider, str],
+        mix: dict[Scenario, float],
+        seed: int = 0,
+    ):
+        self._client = client
+        self._stub = stub
+        self._audiences = audiences
+        self._providers = itertools.cycle(sorted(audiences))
+        self._mix = mix
+        self._random = random.Random(seed)
+        self._prefix = f"load-{uuid.UUID(int=self._random.getrandbits(128)).hex[:8]}"
+        self._users = itertools.count()
+        self._returning: list[tuple[Provider, str]] = []
+        self._sessions: asyncio.Queue[_Session] = asyncio.Queue()
+        self._session_count = 0
+        self._relogins: set[asyncio.Task] = set()
+
+    async def prepare(self, *, users: int, sessions: int, concurrency: int = 50):
+        """Log in the users of returning logins and the sessions to refresh."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login(returning: bool):
+            async with semaphore:
+                provider, sub = self._new_user()
+                response = await self._login(provider, sub)
+                response.raise_for_status()
+            if returning:
+                self._returning.append((provider, sub))
+            else:
+                self._sessions.put_nowait(
+                    _Session(provider, sub, response.json()["refresh_token"])
+                )
+
+        await asyncio.gather(
+            *(login(True) for _ in range(users)),
+            *(login(False) for _ in range(sessions)),
+        )
+        self._session_count += sessions
+
+    async def run(
+        self,
+        rate: float,
+        duration: float,
+        *,
+        arrival: Literal["constant", "poisson"] = "constant",
+    ) -> list[Sample]:
+        """Start requests at `rate` per second for `duration` seconds, with
+        constant or exponentially distributed gaps, and wait for all."""
+        scenarios: list[Scenario] = [
+            scenario for scenario, weight in self._mix.items() if weight > 0
+        ]
+        weights = [self._mix[scenario] for scenario in scenarios]
+        if "returning_login" in scenarios and not self._returning:
+            raise ValueError("Returning logins require users, see prepare().")
+        if {"refresh", "duplicate_refresh"} & set(
+            scenarios
+        ) and not self._session_count:
+            raise ValueError("Refreshes require sessions, see prepare().")
+
+        tasks = []
+        start = time.perf_counter()
+        offset = 0.0
+        while offset < duration:
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            scenario = self._random.choices(scenarios, weights)[0]
+            tasks.append(asyncio.create_task(self._start(scenario, scheduled)))
+            if arrival == "poisson":
+                offset += self._random.expovariate(rate)
+            else:
+                offset += 1 / rate
+
+        samples = []
+        for result in await asyncio.gather(*tasks):
+            samples.extend(result)
+        return samples
+
+    async def _start(self, scenario: Scenario, scheduled: float) -> list[Sample]:
+        if scenario == "first_login":
+            sample, _ = await self._measure(scenario, scheduled, self._login_new)
+            return [sample]
+        if scenario == "returning_login":
+            sample, _ = await self._measure(scenario, scheduled, self._login_returning)
+            return [sample]
+
+        # Waiting for a session is part of the corrected latency.
+        session = await self._sessions.get()
+        results = await asyncio.gather(
+            *(
+                self._measure(
+                    scenario, scheduled, lambda: self._refresh(session.refresh_token)
+                )
+                for _ in range(1 if scenario == "refresh" else 2)
+            )
+        )
+        responses = [
+            response
+            for _, response in results
+            if response is not None and response.is_success
+        ]
+        if responses:
+            session.refresh_token = responses[0].json()["refresh_token"]
+            self._sessions.put_nowait(session)
+        else:
+            task = asyncio.create_task(self._replace_session(session))
+            self._relogins.add(task)
+            task.add_done_callback(self._relogins.discard)
+        return [sample for sample, _ in results]
+
+    async def _measure(self, scenario: Scenario, scheduled: float, send):
+        start = time.perf_counter()
+        try:
+            response = await send()
+        except Exception as e:
+            end = time.perf_counter()
+            error = type(e).__name__
+            return Sample(scenario, 0, end - start, end - scheduled, end, error), None
+        end = time.perf_counter()
+        status = response.status_code
+        return Sample(scenario, status, end - start, end - scheduled, end), response
+
+    async def _replace_session(self, session: _Session):
+        """Log in again for a session whose refresh failed, to keep the
+        number of sessions. Retried until it succeeds."""
+        while True:
+            try:
+                response = await self._login(session.provider, session.sub)
+                if response.is_success:
+                    session.refresh_token = response.json()["refresh_token"]
+                    self._sessions.put_nowait(session)
+                    return
+            except Exception:
+                pass
+            await asyncio.sleep(1)
+
+    def _new_user(self) -> tuple[Provider, str]:
+        return next(self._providers), f"{self._prefix}-{next(self._users)}"
+
+    async def _login_new(self):
+        return await self._login(*self._new_user())
+
+    async def _login_returning(self):
+        return await self._login(*self._random.choice(self._returning))
+
+    async def _login(self, provider: Provider, sub: str):
+        id_token = self._stub.id_token(provider, sub, self._audiences[provider])
+        return await self._client.post(
+            f"/auth/{provider}", headers={"Authorization": f"Bearer {id_token}"}
+        )
+
+    async def _refresh(self, refresh_token: str):
+        return await self._client.post(
+            "/auth/refresh", headers={"Authorization": f"Bearer {refresh_token}"}
+        )
+
+
+def summarize(
+    samples: list[Sample], *, rate: float, start: float, slo: float
+) -> dict[str, Any]:
+    """Summarize throughput, errors and latencies in milliseconds, by
+    scenario and overall. A rate is sustained if the service completed at
+    least 95% of it, with under 1% errors and a corrected p99 within `slo`
+    seconds."""
+    by_scenario: dict[str, list[Sample]] = defaultdict(list)
+    for sample in samples:
+        by_scenario[sample.scenario].append(sample)
+        by_scenario["*"].append(sample)
+
+    elapsed = max((sample.completed for sample in samples), default=start) - start
+    summary: dict[str, Any] = {"target_rps": rate, "scenarios": {}}
+    for scenario, scenario_samples in sorted(by_scenario.items()):
+        latencies = [sample.latency * 1000 for sample in scenario_samples]
+        corrected = [sample.corrected * 1000 for sample in scenario_samples]
+        errors = sum(
+            sample.error is not None or not 200 <= sample.status < 300
+            for sample in scenario_samples
+        )
+        summary["scenarios"][scenario] = {
+            "requests": len(scenario_samples),
+            "errors": errors,
+            "throughput_rps": (
+                (len(scenario_samples) - errors) / elapsed if elapsed > 0 else 0.0
+            ),
+            **{f"p{p}_ms": percentile(latencies, p) for p in (50, 90, 99, 99.9)},
+            "max_ms": max(latencies, default=0.0),
+            **{
+                f"corrected_p{p}_ms": percentile(corrected, p)
+                for p in (50, 90, 99, 99.9)
+            },
+            "corrected_max_ms": max(corrected, default=0.0),
+        }
+
+    overall = summary["scenarios"].get("*")
+    summary["sustained"] = overall is not None and (
+        overall["throughput_rps"] >= 0.95 * rate
+        and overall["errors"] <= 0.01 * overall["requests"]
+        and overall["corrected_p99_ms"] <= slo * 1000
+    )
+    return summary
+
+
+def _print_summary(summary: dict[str, Any]):
+    verdict = "sustained" if summary["sustained"] else "NOT sustained"
+    print(f"\n{summary['target_rps']:g} req/s target, {verdict}")
+    print(
+        f"{'scenario':<18} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        f"{'p50':>8} {'p99':>8} {'p99.9':>8} {'cp50':>8} {'cp99':>8} {'cp99.9':>8}"
+    )
+    for scenario, row in summary["scenarios"].items():
+        print(
+            f"{scenario:<18} {row['requests']:>8} {row['errors']:>6} "
+            f"{row['throughput_rps']:>8.1f} {row['p50_ms']:>8.1f} "
+            f"{row['p99_ms']:>8.1f} {row['p99.9_ms']:>8.1f} "
+            f"{row['corrected_p50_ms']:>8.1f} {row['corrected_p99_ms']:>8.1f} "
+            f"{row['corrected_p99.9_ms']:>8.1f}"
+        )
+
+
+async def _load(args: argparse.Namespace) -> list[dict[str, Any]]:
+    import httpx
+
+    settings = SettingsContext.get().settings
+    audiences: dict[Provider, str] = {}
+    if settings.OIDC_APPLE_CLIENT_ID is not None:
+        audiences["apple"] = settings.OIDC_APPLE_CLIENT_ID
+    if settings.OIDC_GOOGLE_CLIENT_ID is not None:
+        audiences["google"] = settings.OIDC_GOOGLE_CLIENT_ID
+    if not audiences:
+        raise SystemExit("Set the OIDC client id of at least one provider.")
+
+    limits = httpx.Limits(max_connections=args.max_connections)
+    reports = []
+    with StubOIDC(port=args.stub_port) as stub:
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=args.timeout
+        ) as client:
+            generator = LoadGenerator(
+                client=client,
+                stub=stub,
+                audiences=audiences,
+                mix=parse_mix(args.mix),
+                seed=args.seed,
+            )
+            await generator.prepare(users=args.users, sessions=args.sessions)
+            for rate in args.rate:
+                start = time.perf_counter()
+                samples = await generator.run(rate, args.duration, arrival=args.arrival)
+                summary = summarize(
+                    samples, rate=rate, start=start, slo=args.slo_ms / 1000
+                )
+                _print_summary(summary)
+                reports.append(summary)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m pyservice.perf.load",
+        description="Drive a running instance with logins and refreshes.",
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        action="append",
+        required=True,
+        help="Requests per second, repeat to run several rates in turn.",
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX, help=f"Scenario weights, e.g. {DEFAULT_MIX}."
+    )
+    parser.add_argument(
+        "--arrival", choices=["constant", "poisson"], default="constant"
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="Users of returning logins."
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=200, help="Sessions refreshed in turn."
+    )
+    parser.add_argument(
+        "--slo-ms",
+        type=float,
+        default=250.0,
+        help="The corrected p99 a sustained rate stays within.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", type=Path, help="Also write the report here.")
+    args = parser.parse_args()
+
+    reports = asyncio.run(_load(args))
+    if args.json is not None:
+        args.json.write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
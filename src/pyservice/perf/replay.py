@@ -0,0 +1,303 @@
+"""Replay captured traffic against a running instance of the service.
+
+Start the instance with its OIDC key urls pointing to the stub this tool
+serves, e.g. for the default stub port:
+
+    PYSERVICE_OIDC_APPLE_KEYS_URL=http://127.0.0.1:9100/apple/keys
+    PYSERVICE_OIDC_GOOGLE_CERTS_URL=http://127.0.0.1:9100/google/keys
+
+then replay with `python -m pyservice.perf.replay capture-*.ndjson.gz`. The
+OIDC client ids are read from the settings like the service does.
+
+Requests are sent at the captured times, divided by `--speed`, whether
+earlier requests finished or not. Logins are sent with stub ID tokens for
+the captured user pseudonyms, requests presenting a token wait for the
+request that issued it. Tokens issued before the capture started are
+obtained by logins before the replay starts."""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from pyservice.context import SettingsContext
+from pyservice.perf.capture import CapturedRequest, read_captures
+from pyservice.perf.stats import percentile
+from pyservice.perf.stub_oidc import Provider, StubOIDC
+
+_LOGIN_ROUTES: dict[str, Provider] = {"/auth/apple": "apple", "/auth/google": "google"}
+_REFRESH_ROUTE = "/auth/refresh"
+
+
+@dataclass(slots=True)
+class ReplayResult:
+    route: str
+    captured_status: int
+    status: int
+    "The status of the response, 0 if none was received."
+
+    latency: float
+    lateness: float
+    "How much later than scheduled the request was sent."
+
+    error: str | None = None
+
+
+class Replay:
+    def __init__(
+        self,
+        requests: list[CapturedRequest],
+        *,
+        client,
+        stub: StubOIDC,
+        audiences: dict[Provider, str],
+        speed: float,
+        internal_key: str | None,
+        dependency_timeout: float = 30.0,
+    ):
+        self._requests = requests
+        self._client = client
+        self._stub = stub
+        self._audiences = audiences
+        self._speed = speed
+        self._internal_key = internal_key
+        self._dependency_timeout = dependency_timeout
+        self._tokens: dict[str, asyncio.Future[str]] = {}
+
+    def replayable(self, request: CapturedRequest) -> bool:
+        if "{" in request.route or request.route == "unmatched":
+            return False
+        if request.route in _LOGIN_ROUTES:
+            return _LOGIN_ROUTES[request.route] in self._audiences
+        if request.route.startswith("/admin/"):
+            return self._internal_key is not None
+        return True
+
+    async def run(self) -> list[ReplayResult]:
+        requests = [request for request in self._requests if self.replayable(request)]
+        loop = asyncio.get_running_loop()
+        for request in requests:
+            for token in request.issued:
+                self._tokens[token] = loop.create_future()
+        await self._issue_missing_tokens(requests)
+
+        tasks = []
+        start = time.perf_counter()
+        for request in requests:
+            scheduled = start + request.offset / self._speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._send(request, scheduled)))
+        return list(await asyncio.gather(*tasks))
+
+    async def _issue_missing_tokens(self, requests: list[CapturedRequest]):
+        """Log in once for every token used but not issued within the capture."""
+        missing = {
+            request.token: request.route
+            for request in requests
+            if request.token is not None and request.token not in self._tokens
+        }
+        provider = next(iter(self._audiences))
+        for token, route in missing.items():
+            response = await self._client.post(
+                f"/auth/{provider}",
+                headers=self._bearer(self._login_token(provider, token)),
+            )
+            response.raise_for_status()
+            result = response.json()
+            key = "refresh_token" if route == _REFRESH_ROUTE else "access_token"
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(result[key])
+            self._tokens[token] = future
+
+    async def _send(self, request: CapturedRequest, scheduled: float) -> ReplayResult:
+        lateness = time.perf_counter() - scheduled
+        result = ReplayResult(
+            route=request.route,
+            captured_status=request.status,
+            status=0,
+            latency=0.0,
+            lateness=lateness,
+        )
+        try:
+            headers = await self._headers(request)
+        except Exception as e:
+            result.error = f"dependency: {type(e).__name__}"
+            self._fail_issued(request, e)
+            return result
+
+        start = time.perf_counter()
+        try:
+            response = await self._client.request(
+                request.method, request.route, headers=headers
+            )
+        except Exception as e:
+            result.latency = time.perf_counter() - start
+            result.error = type(e).__name__
+            self._fail_issued(request, e)
+            return result
+        result.latency = time.perf_counter() - start
+        result.status = response.status_code
+
+        if request.issued:
+            if response.is_success:
+                body = response.json()
+                tokens = [body.get("access_token"), body.get("refresh_token")]
+                for pseudonym, token in zip(request.issued, tokens):
+                    # Reused refresh tokens within the grace window are
+                    # answered with the tokens issued already.
+                    future = self._tokens[pseudonym]
+                    if token is not None and not future.done():
+                        future.set_result(token)
+            else:
+                self._fail_issued(request, RuntimeError(f"status {result.status}"))
+        return result
+
+    async def _headers(self, request: CapturedRequest) -> dict[str, str]:
+        provider = _LOGIN_ROUTES.get(request.route)
+        if provider is not None:
+            return self._bearer(
+                self._login_token(provider, request.user or "anonymous")
+            )
+        if request.route.startswith("/admin/"):
+            return self._bearer(self._internal_key or "")
+        if request.token is not None:
+            token = await asyncio.wait_for(
+                asyncio.shield(self._tokens[request.token]), self._dependency_timeout
+            )
+            return self._bearer(token)
+        return {}
+
+    def _login_token(self, provider: Provider, user: str) -> str:
+        return self._stub.id_token(provider, user, self._audiences[provider])
+
+    def _fail_issued(self, request: CapturedRequest, error: Exception):
+        for token in request.issued:
+            future = self._tokens[token]
+            if not future.done():
+                future.set_exception(error)
+                # Requests that never wait for it shouldn't log a warning.
+                future.exception()
+
+    @staticmethod
+    def _bearer(token: str) -> dict[str, str]:
+        return {"Authorization": f"Bearer {token}"}
+
+
+def summarize(results: list[ReplayResult]) -> dict[str, Any]:
+    """Summarize latencies in milliseconds and errors, by route and overall."""
+    by_route: dict[str, list[ReplayResult]] = defaultdict(list)
+    for result in results:
+        by_route[result.route].append(result)
+        by_route["*"].append(result)
+
+    summary = {}
+    for route, route_results in sorted(by_route.items()):
+        latencies = [result.latency * 1000 for result in route_results]
+        summary[route] = {
+            "requests": len(route_results),
+            "errors": sum(
+                result.error is not None or result.status >= 500
+                for result in route_results
+            ),
+            "status_mismatches": sum(
+                result.error is None and result.status != result.captured_status
+                for result in route_results
+            ),
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies, default=0.0),
+            "p99_lateness_ms": percentile(
+                [result.lateness * 1000 for result in route_results], 99
+            ),
+        }
+    return summary
+
+
+def _print_summary(summary: dict[str, Any]):
+    print(
+        f"{'route':<28} {'requests':>8} {'errors':>6} {'mismatch':>8} "
+        f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'late p99':>8}"
+    )
+    for route, row in summary.items():
+        print(
+            f"{route:<28} {row['requests']:>8} {row['errors']:>6} "
+            f"{row['status_mismatches']:>8} {row['p50_ms']:>8.1f} "
+            f"{row['p90_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f} "
+            f"{row['p99_lateness_ms']:>8.1f}"
+        )
+
+
+async def _replay(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+
+    settings = SettingsContext.get().settings
+    audiences: dict[Provider, str] = {}
+    if settings.OIDC_APPLE_CLIENT_ID is not None:
+        audiences["apple"] = settings.OIDC_APPLE_CLIENT_ID
+    if settings.OIDC_GOOGLE_CLIENT_ID is not None:
+        audiences["google"] = settings.OIDC_GOOGLE_CLIENT_ID
+    if not audiences:
+        raise SystemExit("Set the OIDC client id of at least one provider.")
+
+    requests = read_captures(args.captures)
+    limits = httpx.Limits(max_connections=args.max_connections)
+    with StubOIDC(port=args.stub_port) as stub:
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=args.timeout
+        ) as client:
+            replay = Replay(
+                requests,
+                client=client,
+                stub=stub,
+                audiences=audiences,
+                speed=args.speed,
+                internal_key=args.internal_key,
+            )
+            results = await replay.run()
+
+    return {
+        "captured_requests": len(requests),
+        "replayed_requests": len(results),
+        "speed": args.speed,
+        "routes": summarize(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m pyservice.perf.replay",
+        description="Replay captured traffic against a running instance.",
+    )
+    parser.add_argument("captures", nargs="+", type=Path)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="2.0 replays twice as fast."
+    )
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument(
+        "--internal-key", help="Replay /admin requests with this internal key."
+    )
+    parser.add_argument("--json", type=Path, help="Also write the report here.")
+    args = parser.parse_args()
+
+    report = asyncio.run(_replay(args))
+    print(
+        f"Replayed {report['replayed_requests']} of "
+        f"{report['captured_requests']} captured requests at {args.speed}x."
+    )
+    _print_summary(report["routes"])
+    if args.json is not None:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+def percentile(values: list[float], percentile: float) -> float:
+    """The nearest-rank percentile of `values`, 0 for no values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(percentile / 100 * len(values)) - 1))
+    return values[index]
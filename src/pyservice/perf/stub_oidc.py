@@ -0,0 +1,131 @@
+"""Stand-ins for Apple and Google as OIDC providers, for load tests.
+
+The stub serves the keys of both providers in the format each publishes them
+in, so the service verifies stub tokens on the same path as real ones, and
+issues ID tokens signed with them. Point OIDC_APPLE_KEYS_URL and
+OIDC_GOOGLE_CERTS_URL of the service to `keys_url` and the service accepts
+these tokens instead of real ones."""
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Literal
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from jwt.algorithms import ECAlgorithm
+
+Provider = Literal["apple", "google"]
+
+ISSUERS: dict[Provider, str] = {
+    "apple": "https://appleid.apple.com",
+    "google": "https://accounts.google.com",
+}
+
+
+def _certificate(key: ec.EllipticCurvePrivateKey) -> str:
+    """Return a self-signed certificate of the key in PEM."""
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "pyservice-stub")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC))
+        .not_valid_after(datetime.datetime(2100, 1, 1, tzinfo=datetime.UTC))
+        .sign(key, hashes.SHA256())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class StubOIDC:
+    """Serves a JWKS at /apple/keys and x509 certificates by kid at
+    /google/keys, like Apple and Google do, in a background thread.
+
+    Keys derive from `seed`, a service that cached the keys of an earlier
+    run keeps accepting tokens of the next."""
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 0, seed: str = "pyservice-stub"
+    ):
+        secret = int.from_bytes(hashlib.sha256(seed.encode()).digest())
+        self._key = ec.derive_private_key(secret, ec.SECP256R1())
+        jwk = json.loads(ECAlgorithm.to_jwk(self._key.public_key()))
+        self.kid = hashlib.sha256(json.dumps(jwk, sort_keys=True).encode()).hexdigest()[
+            :16
+        ]
+        documents = {
+            "/apple/keys": json.dumps(
+                {"keys": [{**jwk, "kid": self.kid, "use": "sig", "alg": "ES256"}]}
+            ).encode(),
+            "/google/keys": json.dumps({self.kid: _certificate(self._key)}).encode(),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                document = documents.get(self.path)
+                if document is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(document)))
+                self.send_header("Cache-Control", "public, max-age=3600")
+                self.end_headers()
+                self.wfile.write(document)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def keys_url(self, provider: Provider) -> str:
+        return f"{self.url}/{provider}/keys"
+
+    def id_token(
+        self, provider: Provider, sub: str, audience: str, lifetime: int = 600
+    ) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": ISSUERS[provider],
+            "sub": sub,
+            "aud": audience,
+            "email": f"{sub}@example.com",
+            "iat": now,
+            "exp": now + lifetime,
+        }
+        return jwt.encode(
+            claims, self._key, algorithm="ES256", headers={"kid": self.kid}
+        )
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="pyservice-stub-oidc", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubOIDC":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,39 @@
+import datetime
+import uuid
+from collections.abc import Sequence
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from pyservice.audit import AuditEvent
+from pyservice.pg.models import PGAuditEvent
+
+_COLUMNS = ("id", "created_at", "updated_at", "user_id", "kind", "identity_provider")
+
+
+class AuditEventWriter:
+    """Writes batches of audit events with COPY, outside of any request."""
+
+    def __init__(self, engine: AsyncEngine):
+        self._engine = engine
+
+    async def __call__(self, events: Sequence[AuditEvent]):
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        records = [
+            (
+                uuid.uuid4(),
+                event.occurred_at.astimezone(datetime.UTC).replace(tzinfo=None),
+                now,
+                event.user_id,
+                event.kind.value,
+                event.identity_provider,
+            )
+            for event in events
+        ]
+
+        async with self._engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection
+            assert driver is not None
+            await driver.copy_records_to_table(
+                PGAuditEvent.__tablename__, records=records, columns=_COLUMNS
+            )
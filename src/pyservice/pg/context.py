@@ -4,6 +4,22 @@ from typing import override
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 
 from pyservice.context import ContextModel, SettingsContext
+from pyservice.memory import CacheSize, register_cache
+from pyservice.metrics import gauge
+from pyservice.pg.instrumentation import StatementInstrumentation
+from pyservice.pg.ring import HashRing
+
+PRIMARY = "primary"
+"The name of the database configured by the API_DATABASE_* settings."
+
+POOL_AUTH = "auth"
+POOL_ADMIN = "admin"
+POOL_BACKGROUND = "background"
+DEFAULT_POOL = "default"
+"The name of engine in pool metrics."
+
+_QUERY_CACHE_SIZE = 500
+"The compiled statements cached per engine, SQLAlchemy's default."
 
 _DATABASE_CONTEXT = None
 
@@ -14,14 +30,41 @@ class DatabaseContext(ContextModel):
     engine: AsyncEngine
     "engine is the connection pool used for database operations."
 
+    pools: dict[str, AsyncEngine] = {}
+    """pools are connection pools to the same database as engine, reserved
+    for a class of work, by name. Work without a pool of its own uses
+    engine."""
+
+    shards: dict[str, AsyncEngine] = {}
+    """shards are the connection pools of the databases users are spread over,
+    by shard name. Without shards, users live in the database of engine."""
+
+    ring: HashRing | None = None
+    "ring places new users on shards, set if there are shards."
+
     @override
     @classmethod
     def get(cls) -> "DatabaseContext":
         assert _DATABASE_CONTEXT is not None
         return super().get() or _DATABASE_CONTEXT
 
-    def session(self) -> AsyncSession:
-        return AsyncSession(self.engine, expire_on_commit=False, autobegin=False)
+    def pool(self, name: str | None) -> AsyncEngine:
+        if name is None:
+            return self.engine
+        return self.pools.get(name, self.engine)
+
+    def session(self, pool: str | None = None) -> AsyncSession:
+        return AsyncSession(self.pool(pool), expire_on_commit=False, autobegin=False)
+
+    def shard_session(self, shard: str) -> AsyncSession:
+        return AsyncSession(self.shards[shard], expire_on_commit=False, autobegin=False)
+
+    def data_engines(self, pool: str | None = None) -> dict[str, AsyncEngine]:
+        """Return the engines of every database holding users, by shard name.
+
+        Without shards, that is the engine of `pool`. Shards have a single
+        pool each."""
+        return self.shards or {PRIMARY: self.pool(pool)}
 
 
 def get_database_url():
@@ -37,11 +80,105 @@ def get_database_url():
     return f"{driver}://{user}:{password}@{host}:{port}/{name}"
 
 
+def create_database_engine(database_url: str, **kwargs) -> AsyncEngine:
+    """Create an engine with statement instrumentation attached."""
+    ctx = SettingsContext.get()
+
+    explain_threshold = ctx.settings.API_DATABASE_EXPLAIN_THRESHOLD
+    instrumentation = StatementInstrumentation(
+        slow_threshold=ctx.settings.API_DATABASE_SLOW_STATEMENT_THRESHOLD.total_seconds(),
+        log_interval=ctx.settings.API_DATABASE_SLOW_STATEMENT_LOG_INTERVAL.total_seconds(),
+        explain_threshold=(
+            explain_threshold.total_seconds() if explain_threshold is not None else None
+        ),
+    )
+
+    engine = create_async_engine(
+        database_url, query_cache_size=_QUERY_CACHE_SIZE, **kwargs
+    )
+    instrumentation.attach(engine)
+    return engine
+
+
 def _create_root_database_context() -> DatabaseContext:
+    ctx = SettingsContext.get()
+
     database_url = get_database_url()
-    engine = create_async_engine(database_url)
-    with DatabaseContext(engine=engine) as ctx:
+    engine = create_database_engine(database_url)
+
+    pools = {
+        name: create_database_engine(
+            database_url,
+            pool_size=pool.pool_size,
+            max_overflow=pool.max_overflow,
+            pool_timeout=pool.pool_timeout.total_seconds(),
+        )
+        for name, pool in ctx.settings.API_DATABASE_POOLS.items()
+    }
+
+    shards = {
+        shard.name: create_database_engine(shard.url.get_secret_value())
+        for shard in ctx.settings.API_DATABASE_SHARDS or []
+    }
+    ring = HashRing(shards) if shards else None
+
+    with DatabaseContext(engine=engine, pools=pools, shards=shards, ring=ring) as ctx:
         return ctx
 
 
+def _compiled_cache_size(engine: AsyncEngine) -> CacheSize:
+    cache = engine.sync_engine._compiled_cache
+    if cache is None:
+        return CacheSize(entries=0, max_entries=0)
+    return CacheSize(entries=len(cache), max_entries=_QUERY_CACHE_SIZE)
+
+
+def _register_compiled_caches(ctx: DatabaseContext):
+    engines = {
+        DEFAULT_POOL: ctx.engine,
+        **ctx.pools,
+        **{f"shard.{shard}": engine for shard, engine in ctx.shards.items()},
+    }
+    for name, engine in engines.items():
+        register_cache(
+            f"sqlalchemy_compiled.{name}",
+            lambda engine=engine: _compiled_cache_size(engine),
+        )
+
+
+def _named_pools() -> dict[str, AsyncEngine]:
+    ctx = DatabaseContext.get()
+    return {DEFAULT_POOL: ctx.engine, **ctx.pools}
+
+
+def _collect_pool_connections():
+    for name, engine in _named_pools().items():
+        pool = engine.pool
+        yield (name, "checked_out"), pool.checkedout()  # type: ignore[attr-defined]
+        yield (name, "idle"), pool.checkedin()  # type: ignore[attr-defined]
+
+
+def _collect_pool_capacity():
+    for name, engine in _named_pools().items():
+        pool = engine.pool
+        # Without overflow limit (-1), the pool grows unbounded.
+        overflow = max(pool._max_overflow, 0)  # type: ignore[attr-defined]
+        yield (name,), pool.size() + overflow  # type: ignore[attr-defined]
+
+
+gauge(
+    "pyservice_db_pool_connections",
+    "Connections of the database pools, checked out or idle, by pool.",
+    labelnames=("pool", "state"),
+    collect=_collect_pool_connections,
+)
+gauge(
+    "pyservice_db_pool_capacity",
+    "How many connections the database pools open at most, by pool.",
+    labelnames=("pool",),
+    collect=_collect_pool_capacity,
+)
+
+
 _DATABASE_CONTEXT = _create_root_database_context()
+_register_compiled_caches(_DATABASE_CONTEXT)
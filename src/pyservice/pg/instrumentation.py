@@ -0,0 +1,203 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import pyservice.logger as logger
+from pyservice.metrics import counter, histogram
+from pyservice.tracing import record_span
+
+_STATEMENT_SECONDS = histogram(
+    "pyservice_db_statement_seconds",
+    "Database statement latency by statement fingerprint.",
+    labelnames=("fingerprint",),
+)
+_SLOW_STATEMENTS = counter(
+    "pyservice_db_slow_statements",
+    "Database statements slower than the slow statement threshold.",
+    labelnames=("fingerprint",),
+)
+_REQUEST_STATEMENTS = histogram(
+    "pyservice_db_statements_per_request",
+    "Database statements executed per request, by route.",
+    labelnames=("route",),
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34),
+)
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDERS = re.compile(r"\$\d+|%\(\w+\)s|%s")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+_MAX_FINGERPRINTS = 1000
+
+_EXPLAIN_SAVEPOINT = "pyservice_explain"
+
+
+@dataclass(slots=True)
+class RequestStatements:
+    count: int = 0
+    seconds: float = 0.0
+
+
+_REQUEST_STATS: ContextVar[RequestStatements | None] = ContextVar(
+    "pyservice_request_statements", default=None
+)
+
+
+def track_request_statements() -> RequestStatements:
+    """Count the statements executed by the current task from now on."""
+    stats = RequestStatements()
+    _REQUEST_STATS.set(stats)
+    return stats
+
+
+def observe_request_statements(route: str, stats: RequestStatements):
+    _REQUEST_STATEMENTS.observe(stats.count, route)
+
+
+@dataclass
+class StatementInstrumentation:
+    slow_threshold: float
+    "Statements slower than this many seconds are logged."
+
+    log_interval: float
+    "Per fingerprint, at most one slow statement is logged in this many seconds."
+
+    explain_threshold: float | None = None
+    "Select statements slower than this many seconds are explained, if set."
+
+    _fingerprints: OrderedDict[str, str] = field(default_factory=OrderedDict)
+    _last_logged: dict[str, tuple[float, int]] = field(default_factory=dict)
+
+    def fingerprint(self, statement: str) -> str:
+        """Return a short, stable id for the statement text without literals."""
+        fingerprint = self._fingerprints.get(statement)
+        if fingerprint is None:
+            normalized = _normalize(statement)
+            fingerprint = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+            self._fingerprints[statement] = fingerprint
+            if len(self._fingerprints) > _MAX_FINGERPRINTS:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("pyservice_statement_start", []).append(
+            time.perf_counter()
+        )
+
+    def after_cursor_execute(
+        self, conn: Connection, cursor, statement, parameters, context, executemany
+    ):
+        elapsed = time.perf_counter() - conn.info["pyservice_statement_start"].pop()
+        fingerprint = self.fingerprint(statement)
+
+        _STATEMENT_SECONDS.observe(elapsed, fingerprint)
+        end_ns = time.time_ns()
+        record_span(
+            "db.statement",
+            end_ns - int(elapsed * 1e9),
+            end_ns,
+            **{"db.statement.fingerprint": fingerprint},
+        )
+        stats = _REQUEST_STATS.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+        if elapsed >= self.slow_threshold:
+            _SLOW_STATEMENTS.inc(fingerprint)
+            self._log_slow(fingerprint, statement, parameters, elapsed)
+
+        if self.explain_threshold is not None and elapsed >= self.explain_threshold:
+            self._explain(conn, statement, parameters, context)
+
+    def handle_error(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("pyservice_statement_start"):
+            conn.info["pyservice_statement_start"].pop()
+
+    def _log_slow(self, fingerprint: str, statement: str, parameters, elapsed: float):
+        now = time.monotonic()
+        last_logged, suppressed = self._last_logged.get(fingerprint, (0.0, 0))
+        if now - last_logged < self.log_interval:
+            self._last_logged[fingerprint] = (last_logged, suppressed + 1)
+            return
+        self._last_logged[fingerprint] = (now, 0)
+
+        logger.warning(
+            f"Slow statement {fingerprint} took {elapsed * 1000:.1f}ms "
+            f"({suppressed} more suppressed) with parameters "
+            f"{_redact(parameters)}: {_WHITESPACE.sub(' ', statement)}"
+        )
+
+    def _explain(self, conn: Connection, statement: str, parameters, context):
+        # EXPLAIN ANALYZE executes the statement a second time, restrict it
+        # to plain selects. Server side cursors still occupy the connection.
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return
+        if context is not None and context.execution_options.get("stream_results"):
+            return
+
+        # Explained in a savepoint that is always rolled back, a failing
+        # explain does not abort the transaction of the statement and the
+        # effects of executing it again are undone.
+        dbapi_connection = conn.connection.dbapi_connection
+        savepoint = not getattr(dbapi_connection, "autocommit", False)
+        try:
+            cursor = dbapi_connection.cursor()  # type: ignore[union-attr]
+            try:
+                if savepoint:
+                    cursor.execute(f"SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+                try:
+                    cursor.execute(
+                        f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters
+                    )
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                finally:
+                    if savepoint:
+                        cursor.execute(f"ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+                        cursor.execute(f"RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+            finally:
+                cursor.close()
+        except Exception:
+            logger.warning("Could not explain slow statement:", exc_info=True)
+            return
+
+        logger.info(f"Plan of slow statement {self.fingerprint(statement)}:\n{plan}")
+
+    def attach(self, engine: AsyncEngine | Engine):
+        sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+        event.listen(sync_engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(sync_engine, "handle_error", self.handle_error)
+
+
+def _normalize(statement: str) -> str:
+    statement = _PLACEHOLDERS.sub("?", statement)
+    statement = _LITERALS.sub("?", statement)
+    statement = _PARAMETER_LISTS.sub("(...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _redact(parameters) -> str:
+    """Describe the parameters without their values."""
+    if isinstance(parameters, dict):
+        return (
+            "{"
+            + ", ".join(
+                f"{key}: {type(value).__name__}" for key, value in parameters.items()
+            )
+            + "}"
+        )
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
@@ -0,0 +1,71 @@
+import datetime
+from collections.abc import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import pyservice.logger as logger
+from pyservice.context import SettingsContext
+from pyservice.jobs import Cron, Job
+from pyservice.pg.context import POOL_BACKGROUND, DatabaseContext
+from pyservice.pg.store import Store
+
+_BATCH_SIZE = 1000
+"How many rows a maintenance job changes per transaction."
+
+
+async def _in_batches(name: str, batch: Callable[[Store], Awaitable[int]]):
+    ctx = DatabaseContext.get()
+
+    for shard, engine in ctx.data_engines(POOL_BACKGROUND).items():
+        total = 0
+        while True:
+            # Commit every batch, row locks are held briefly and the work
+            # done survives a timeout.
+            async with AsyncSession(engine) as session, session.begin():
+                count = await batch(Store(session))
+            total += count
+            if count < _BATCH_SIZE:
+                break
+        if total:
+            logger.info(f"{name} on {shard}: {total} rows.")
+
+
+async def expire_refresh_tokens():
+    ctx = SettingsContext.get()
+
+    issued_before = (
+        datetime.datetime.now(datetime.UTC) - ctx.settings.JWT_TOKEN_REFRESH_DURATION
+    ).replace(tzinfo=None)
+    await _in_batches(
+        "Expired refresh tokens",
+        lambda store: store.expire_refresh_tokens(issued_before, limit=_BATCH_SIZE),
+    )
+
+
+async def delete_expired_revocations():
+    await _in_batches(
+        "Deleted expired revocations",
+        lambda store: store.delete_expired_revocations(limit=_BATCH_SIZE),
+    )
+
+
+def database_jobs() -> list[Job]:
+    """The database maintenance jobs, each runs on the leader only."""
+    return [
+        Job(
+            name="expire_refresh_tokens",
+            run=expire_refresh_tokens,
+            schedule=Cron.parse("*/15 * * * *"),
+            timeout=datetime.timedelta(minutes=10),
+            jitter=datetime.timedelta(minutes=1),
+            singleton=True,
+        ),
+        Job(
+            name="delete_expired_revocations",
+            run=delete_expired_revocations,
+            schedule=Cron.parse("30 * * * *"),
+            timeout=datetime.timedelta(minutes=10),
+            jitter=datetime.timedelta(minutes=1),
+            singleton=True,
+        ),
+    ]
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+import pyservice.logger as logger
+from pyservice.metrics import gauge
+
+
+def advisory_lock_key(name: str) -> int:
+    """Map a name onto the signed 64 bit key space of advisory locks."""
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], signed=True)
+
+
+class LeaderElection:
+    """Elects one leader among all replicas through a session advisory lock.
+
+    The lock is held on a pooled connection for as long as the replica leads.
+    If the connection breaks, postgres releases the lock and another replica
+    takes over within `check_interval` seconds. A leader notices it lost the
+    lock within the same interval, so for that long two replicas may both
+    consider themselves leader; singleton jobs must tolerate this."""
+
+    def __init__(self, engine: AsyncEngine, name: str, *, check_interval: float):
+        self._engine = engine
+        self._name = name
+        self._key = advisory_lock_key(name)
+        self._check_interval = check_interval
+        self._is_leader = False
+
+        self._gauge = gauge(
+            "pyservice_leader",
+            "Whether this replica holds the leader lock, by election.",
+            labelnames=("election",),
+        )
+        self._gauge.set(0, name)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    async def run(self):
+        while True:
+            try:
+                await self._campaign()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Leader election {self._name} failed:", exc_info=True)
+            finally:
+                self._set_leader(False)
+            await asyncio.sleep(self._check_interval)
+
+    async def _campaign(self):
+        async with self._engine.connect() as conn:
+            try:
+                await self._hold(conn)
+            finally:
+                if self._is_leader:
+                    # Closing the session releases the lock, instead of
+                    # returning it to the pool with the connection.
+                    await conn.invalidate()
+
+    async def _hold(self, conn: AsyncConnection):
+        while True:
+            if not self._is_leader:
+                stmt = select(func.pg_try_advisory_lock(self._key))
+                acquired = (await conn.execute(stmt)).scalar_one()
+                # Don't hold a transaction open, the lock belongs to the
+                # session.
+                await conn.commit()
+                if acquired:
+                    logger.info(f"Became leader of {self._name}.")
+                    self._set_leader(True)
+            else:
+                # Checks the connection, and with it the lock, is alive.
+                await conn.exec_driver_sql("SELECT 1")
+                await conn.commit()
+            await asyncio.sleep(self._check_interval)
+
+    def _set_leader(self, is_leader: bool):
+        if self._is_leader and not is_leader:
+            logger.warning(f"Lost leadership of {self._name}.")
+        self._is_leader = is_leader
+        self._gauge.set(float(is_leader), self._name)
@@ -0,0 +1,97 @@
+import datetime
+import uuid
+from collections import defaultdict
+from collections.abc import Mapping, MutableMapping
+
+import sqlalchemy as sa
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from pyservice.logins import LoginUpdate
+from pyservice.pg.models import PGUser, PGUserShard
+
+_BATCH_SIZE = 1000
+"How many users are updated per statement and transaction."
+
+_Row = tuple[uuid.UUID, datetime.datetime, int]
+
+
+class LastLoginWriter:
+    """Writes batches of last logins, one UPDATE ... FROM (VALUES ...) each.
+
+    Users are updated in id order, concurrent writers of several workers lock
+    rows in the same order and never deadlock. With several shards, the
+    directory in `directory` tells which shard holds each user of a batch,
+    every shard only gets the updates of its own users.
+
+    Each shard commits every batch on its own, the updates are popped from
+    the mapping once committed. A failing batch leaves the updates that
+    were not written, login counts are never added twice."""
+
+    def __init__(
+        self,
+        engines: Mapping[str, AsyncEngine],
+        directory: AsyncEngine | None = None,
+    ):
+        assert directory is not None or len(engines) == 1
+        self._engines = engines
+        self._directory = directory
+
+    async def __call__(self, updates: MutableMapping[uuid.UUID, LoginUpdate]):
+        rows = [
+            (
+                user_id,
+                update.last_login_at.astimezone(datetime.UTC).replace(tzinfo=None),
+                update.logins,
+            )
+            for user_id, update in sorted(updates.items())
+        ]
+        for start in range(0, len(rows), _BATCH_SIZE):
+            batch = rows[start : start + _BATCH_SIZE]
+            for shard, shard_rows in (await self._by_shard(batch)).items():
+                async with self._engines[shard].begin() as conn:
+                    await conn.execute(_update_statement(shard_rows))
+                for user_id, *_ in shard_rows:
+                    del updates[user_id]
+            # Users missing from the directory were deleted since their login.
+            for user_id, *_ in batch:
+                updates.pop(user_id, None)
+
+    async def _by_shard(self, rows: list[_Row]) -> dict[str, list[_Row]]:
+        if self._directory is None:
+            (name,) = self._engines
+            return {name: rows}
+
+        stmt = select(PGUserShard.user_id, PGUserShard.shard).where(
+            PGUserShard.user_id.in_([user_id for user_id, *_ in rows])
+        )
+        async with self._directory.connect() as conn:
+            shards = dict((await conn.execute(stmt)).tuples().all())
+
+        by_shard: dict[str, list[_Row]] = defaultdict(list)
+        for row in rows:
+            shard = shards.get(row[0])
+            if shard is not None:
+                by_shard[shard].append(row)
+        return by_shard
+
+
+def _update_statement(rows: list[_Row]):
+    logins = sa.values(
+        sa.column("user_id", sa.Uuid),
+        sa.column("last_login_at", sa.DateTime),
+        sa.column("logins", sa.Integer),
+        name="logins",
+    ).data(rows)
+
+    return (
+        update(PGUser)
+        .where(PGUser.id == logins.c.user_id)
+        .values(
+            # Batches of several workers arrive out of order.
+            last_login_at=func.greatest(PGUser.last_login_at, logins.c.last_login_at),
+            login_count=PGUser.login_count + logins.c.logins,
+            # A login doesn't change the user.
+            updated_at=PGUser.updated_at,
+        )
+    )
@@ -0,0 +1,157 @@
+"""Helpers for migrations that must not block the service.
+
+Every migration runs in its own transaction with a `lock_timeout`, a
+migration that cannot get its locks in time is rolled back and retried.
+The helpers here leave that transaction for the parts that would otherwise
+hold locks for the duration of a table scan, so they commit whatever the
+revision did before them. Keep such revisions small and idempotent."""
+
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import op
+
+import pyservice.logger as logger
+from pyservice.context import SettingsContext
+
+
+def timeout_statements(*, statement_timeout: bool = True) -> list[str]:
+    """Return the statements that set the session timeouts for migrations."""
+    ctx = SettingsContext.get()
+
+    lock_timeout = ctx.settings.API_DATABASE_MIGRATION_LOCK_TIMEOUT
+    timeout = ctx.settings.API_DATABASE_MIGRATION_STATEMENT_TIMEOUT
+    timeout_ms = int(timeout.total_seconds() * 1000) if statement_timeout else 0
+    return [
+        f"SET lock_timeout = {int(lock_timeout.total_seconds() * 1000)}",
+        f"SET statement_timeout = {timeout_ms}",
+    ]
+
+
+@contextmanager
+def _without_statement_timeout() -> Iterator[None]:
+    """Leave the migration transaction and disable the `statement_timeout`."""
+    with op.get_context().autocommit_block():
+        for statement in timeout_statements(statement_timeout=False):
+            op.execute(statement)
+        try:
+            yield
+        finally:
+            for statement in timeout_statements():
+                op.execute(statement)
+
+
+def create_index_concurrently(
+    index_name: str, table_name: str, columns: list[str], **kwargs
+):
+    """Build an index without blocking writes to the table.
+
+    A build that failed, e.g. on the `lock_timeout`, leaves an invalid index
+    behind, it is dropped before trying again."""
+    with _without_statement_timeout():
+        if _is_invalid_index(index_name):
+            op.drop_index(index_name, postgresql_concurrently=True, if_exists=True)
+        op.create_index(
+            index_name,
+            table_name,
+            columns,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kwargs,
+        )
+
+
+def _is_invalid_index(index_name: str) -> bool:
+    if op.get_context().as_sql:
+        return False
+    result = op.get_bind().execute(
+        sa.text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+            "WHERE relname = :name AND NOT indisvalid"
+        ),
+        {"name": index_name},
+    )
+    return result.scalar() is not None
+
+
+def drop_index_concurrently(index_name: str, table_name: str | None = None):
+    with _without_statement_timeout():
+        op.drop_index(
+            index_name,
+            table_name=table_name,
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def replication_lag() -> float:
+    """Return the replay lag of the slowest replica, in seconds."""
+    lag = (
+        op.get_bind()
+        .exec_driver_sql(
+            "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) "
+            "FROM pg_stat_replication"
+        )
+        .scalar()
+    )
+    return float(lag or 0)
+
+
+def backfill(
+    table_name: str,
+    set_clause: str,
+    where_clause: str,
+    *,
+    batch_size: int = 1000,
+    max_replication_lag: float | None = None,
+):
+    """Update the rows of a table in committed batches.
+
+    Runs `UPDATE table_name SET set_clause` for the rows matching
+    `where_clause`, `batch_size` rows at a time in order of their primary key
+    `id`. The update must make `where_clause` false, so an interrupted
+    backfill continues where it stopped. Between batches, waits while a
+    replica lags behind by more than `max_replication_lag` seconds."""
+    if op.get_context().as_sql:
+        raise RuntimeError("Backfills cannot run in offline mode.")
+
+    ctx = SettingsContext.get()
+    if max_replication_lag is None:
+        max_replication_lag = (
+            ctx.settings.API_DATABASE_MIGRATION_MAX_REPLICATION_LAG.total_seconds()
+        )
+
+    def batch(after: bool) -> sa.TextClause:
+        keyset = "id > :after AND " if after else ""
+        return sa.text(
+            f"WITH batch AS ("
+            f"SELECT id FROM {table_name} WHERE {keyset}({where_clause}) "
+            f"ORDER BY id LIMIT :batch_size FOR UPDATE"
+            f") UPDATE {table_name} SET {set_clause} FROM batch "
+            f"WHERE {table_name}.id = batch.id RETURNING {table_name}.id"
+        ).bindparams(batch_size=batch_size)
+
+    first, rest = batch(after=False), batch(after=True)
+
+    total = 0
+    after = None
+    # Every statement commits on its own, locking at most one batch of rows.
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            if after is None:
+                ids = bind.execute(first).scalars().all()
+            else:
+                ids = bind.execute(rest, {"after": after}).scalars().all()
+            if not ids:
+                break
+            total += len(ids)
+            after = max(ids)
+
+            while (lag := replication_lag()) > max_replication_lag:
+                logger.info(f"Backfill of {table_name} waits for replicas ({lag}s).")
+                time.sleep(min(lag, 10.0))
+
+    logger.info(f"Backfilled {total} rows of {table_name}.")
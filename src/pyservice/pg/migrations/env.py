@@ -4,9 +4,17 @@ from logging.config import fileConfig
 from alembic import context
 from sqlalchemy import pool
 from sqlalchemy.engine import Connection
-from sqlalchemy.ext.asyncio import async_engine_from_config
-
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_engine_from_config,
+    create_async_engine,
+)
+
+import pyservice.logger as logger
+from pyservice.context import SettingsContext
 from pyservice.pg.context import get_database_url
+from pyservice.pg.migration import timeout_statements
 from pyservice.pg.models import Base
 
 # this is the Alembic Config object, which provides
@@ -50,23 +58,66 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
+    for statement in timeout_statements():
+        context.execute(statement)
+
     with context.begin_transaction():
         context.run_migrations()
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # Each revision commits on its own, so a retry after a lock timeout
+    # continues with the revision that failed.
+    for statement in timeout_statements():
+        connection.exec_driver_sql(statement)
+    connection.commit()
+
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
 
 
+def _is_lock_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == "55P03"
+
+
+async def migrate(connectable: AsyncEngine) -> None:
+    ctx = SettingsContext.get()
+    retries = ctx.settings.API_DATABASE_MIGRATION_RETRIES
+    delay = ctx.settings.API_DATABASE_MIGRATION_RETRY_DELAY.total_seconds()
+
+    try:
+        for attempt in range(retries + 1):
+            try:
+                async with connectable.connect() as connection:
+                    await connection.run_sync(do_run_migrations)
+                break
+            except DBAPIError as e:
+                if not _is_lock_timeout(e) or attempt == retries:
+                    raise
+                logger.warning(
+                    f"Migration timed out waiting for a lock, retrying in {delay}s."
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+    finally:
+        await connectable.dispose()
+
+
 async def run_async_migrations() -> None:
     """In this scenario we need to create an Engine
     and associate a connection with the context.
 
+    Every shard shares the schema of the primary database and is migrated
+    after it.
     """
 
     connectable = async_engine_from_config(
@@ -74,11 +125,15 @@ async def run_async_migrations() -> None:
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
-
-    async with connectable.connect() as connection:
-        await connection.run_sync(do_run_migrations)
-
-    await connectable.dispose()
+    await migrate(connectable)
+
+    ctx = SettingsContext.get()
+    for shard in ctx.settings.API_DATABASE_SHARDS or []:
+        logger.info(f"Migrating shard {shard.name}.")
+        connectable = create_async_engine(
+            shard.url.get_secret_value(), poolclass=pool.NullPool
+        )
+        await migrate(connectable)
 
 
 def run_migrations_online() -> None:
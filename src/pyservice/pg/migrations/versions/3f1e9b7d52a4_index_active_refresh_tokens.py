@@ -0,0 +1,41 @@
+"""index active refresh tokens
+
+Revision ID: 3f1e9b7d52a4
+Revises: c6b29d8ca8b0
+Create Date: 2026-10-19 10:12:07.412583
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from pyservice.pg.migration import (
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1e9b7d52a4"
+down_revision: Union[str, None] = "c6b29d8ca8b0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The index was declared on the model but never created. Besides
+    # enforcing one active token per user, it serves the lookups by user.
+    create_index_concurrently(
+        "ix_one_active_token_per_user",
+        "refresh_tokens",
+        ["user_id"],
+        unique=True,
+        postgresql_where=sa.text("status = 'ACTIVE'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently("ix_one_active_token_per_user", "refresh_tokens")
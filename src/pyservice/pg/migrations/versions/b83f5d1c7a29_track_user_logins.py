@@ -0,0 +1,35 @@
+"""track user logins
+
+Revision ID: b83f5d1c7a29
+Revises: 5a7c2e90b13d
+Create Date: 2026-10-19 14:02:17.480361
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b83f5d1c7a29"
+down_revision: Union[str, None] = "5a7c2e90b13d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Columns with a constant default are added without rewriting the table.
+    op.add_column("users", sa.Column("last_login_at", sa.DateTime(), nullable=True))
+    op.add_column(
+        "users",
+        sa.Column("login_count", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("users", "login_count")
+    op.drop_column("users", "last_login_at")
@@ -0,0 +1,63 @@
+"""refresh token sessions
+
+Revision ID: e41a9c6d2f58
+Revises: b83f5d1c7a29
+Create Date: 2026-10-19 16:48:31.207914
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from pyservice.pg.migration import (
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e41a9c6d2f58"
+down_revision: Union[str, None] = "b83f5d1c7a29"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing tokens keep rotating in a session without an id. The index
+    # below commits the column, a retry after a lock timeout finds it.
+    op.execute("ALTER TABLE refresh_tokens ADD COLUMN IF NOT EXISTS session_id uuid")
+    # Rotation looks up the active token of a session, the prefix on
+    # user_id serves the lookups of all sessions of a user. The session
+    # without an id is unique per user as well.
+    create_index_concurrently(
+        "ix_one_active_token_per_session",
+        "refresh_tokens",
+        ["user_id", "session_id"],
+        unique=True,
+        postgresql_where=sa.text("status = 'ACTIVE'"),
+        postgresql_nulls_not_distinct=True,
+    )
+    drop_index_concurrently("ix_one_active_token_per_user", "refresh_tokens")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Keep the session refreshed last, one active token per user.
+    op.execute(
+        "UPDATE refresh_tokens SET status = 'REVOKED' "
+        "WHERE status = 'ACTIVE' AND id NOT IN ("
+        "SELECT DISTINCT ON (user_id) id FROM refresh_tokens "
+        "WHERE status = 'ACTIVE' ORDER BY user_id, created_at DESC)"
+    )
+    create_index_concurrently(
+        "ix_one_active_token_per_user",
+        "refresh_tokens",
+        ["user_id"],
+        unique=True,
+        postgresql_where=sa.text("status = 'ACTIVE'"),
+    )
+    drop_index_concurrently("ix_one_active_token_per_session", "refresh_tokens")
+    op.drop_column("refresh_tokens", "session_id")
@@ -0,0 +1,39 @@
+"""user shard emails
+
+Revision ID: f2c8a6d4e3b1
+Revises: e41a9c6d2f58
+Create Date: 2026-10-19 19:12:05.631842
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from pyservice.pg.migration import (
+    create_index_concurrently,
+    drop_index_concurrently,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f2c8a6d4e3b1"
+down_revision: Union[str, None] = "e41a9c6d2f58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing entries are completed by `sync-directory`. The index below
+    # commits the column, a retry after a lock timeout finds it.
+    op.execute("ALTER TABLE user_shards ADD COLUMN IF NOT EXISTS email varchar")
+    create_index_concurrently(
+        op.f("ix_user_shards_email"), "user_shards", ["email"], unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently(op.f("ix_user_shards_email"), "user_shards")
+    op.drop_column("user_shards", "email")
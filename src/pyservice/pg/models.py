@@ -7,6 +7,7 @@ from sqlalchemy.schema import ForeignKey
 from sqlalchemy.types import Enum as SQLAlchemyEnum
 from sqlalchemy.types import Uuid
 
+from pyservice.audit import AuditEventKind
 from pyservice.auth.token import RefreshTokenStatus
 from pyservice.pg.utils import PasswordHashType, UserIdentity, UserIdentityType, utcnow
 
@@ -34,14 +35,36 @@ class PGUser(Base):
     email: Mapped[str] = mapped_column(unique=True)
     identity: Mapped[UserIdentity] = mapped_column(UserIdentityType(), unique=True)
 
+    last_login_at: Mapped[datetime.datetime | None] = mapped_column(default=None)
+    "The last login or token refresh, written with a delay of seconds."
+
+    login_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    "The logins with an identity provider, refreshes excluded."
+
+
+class PGUserShard(Base):
+    """The directory of which shard holds which user, in the primary database."""
+
+    __tablename__ = "user_shards"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(unique=True)
+    identity: Mapped[UserIdentity] = mapped_column(UserIdentityType(), unique=True)
+    shard: Mapped[str] = mapped_column(index=True)
+
+    email: Mapped[str | None] = mapped_column(default=None, index=True, unique=True)
+    """Keeps emails unique across shards. None for entries added before the
+    directory held emails, until `sync-directory` fills them in."""
+
 
 class PGRefreshToken(Base):
     __tablename__ = "refresh_tokens"
     __table_args__ = (
         Index(
-            "ix_one_active_token_per_user",
+            "ix_one_active_token_per_session",
             "user_id",
+            "session_id",
             unique=True,
+            postgresql_nulls_not_distinct=True,
             postgresql_where=(
                 literal_column("status") == RefreshTokenStatus.ACTIVE.value
             ),
@@ -55,6 +78,37 @@ class PGRefreshToken(Base):
     )
     user: Mapped[PGUser] = relationship()
 
+    session_id: Mapped[uuid.UUID | None] = mapped_column(default=None)
+    "None for the session of tokens issued before sessions were introduced."
+
     status: Mapped[RefreshTokenStatus] = mapped_column(
         SQLAlchemyEnum(RefreshTokenStatus, name="refresh_token_status")
     )
+
+
+class PGRevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti: Mapped[str] = mapped_column(unique=True)
+
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE")
+    )
+    user: Mapped[PGUser] = relationship()
+
+    expires_at: Mapped[datetime.datetime] = mapped_column(index=True)
+
+
+class PGAuditEvent(Base):
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        Index("ix_audit_events_user_id_created_at", "user_id", "created_at"),
+    )
+
+    # No foreign key, the audit trail outlives deleted users.
+    user_id: Mapped[uuid.UUID]
+
+    kind: Mapped[AuditEventKind] = mapped_column(
+        SQLAlchemyEnum(AuditEventKind, name="audit_event_kind")
+    )
+    identity_provider: Mapped[str | None]
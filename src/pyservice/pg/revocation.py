@@ -0,0 +1,86 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+import pyservice.logger as logger
+from pyservice.auth.revocation import (
+    REVOCATION_CHANNEL,
+    RevokedTokens,
+    decode_notification,
+)
+from pyservice.pg.store import Store
+
+
+class RevocationListener:
+    """Keeps the in-memory revoked tokens in sync with the database.
+
+    Listens for revocations on one connection of the engine's pool. After
+    every (re)connect, and every `resync_interval` seconds, the full set of
+    revocations is reloaded, covering notifications missed while the
+    connection was down."""
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        revoked_tokens: RevokedTokens,
+        *,
+        resync_interval: float,
+        reconnect_delay: float = 1.0,
+        source: str = "",
+    ):
+        self._engine = engine
+        self._source = source
+        self._revoked_tokens = revoked_tokens
+        self._resync_interval = resync_interval
+        self._reconnect_delay = reconnect_delay
+
+    async def run(self):
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error("Revocation listener failed, reconnecting:", exc_info=True)
+            await asyncio.sleep(self._reconnect_delay)
+
+    async def _listen(self):
+        async with self._engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection
+            assert driver is not None
+
+            closed = asyncio.Event()
+            driver.add_termination_listener(lambda _: closed.set())
+            await driver.add_listener(REVOCATION_CHANNEL, self._on_notification)
+            try:
+                while not closed.is_set():
+                    # Listen before loading, so nothing falls in between.
+                    # Loading through the listening connection also checks
+                    # that it is still alive.
+                    await self._resync(conn)
+                    try:
+                        await asyncio.wait_for(closed.wait(), self._resync_interval)
+                    except TimeoutError:
+                        pass
+                logger.warning("Revocation listener connection closed.")
+            finally:
+                if not driver.is_closed():
+                    await driver.remove_listener(
+                        REVOCATION_CHANNEL, self._on_notification
+                    )
+
+    async def _resync(self, conn: AsyncConnection):
+        async with AsyncSession(bind=conn) as session, session.begin():
+            revocations = await Store(session).read_revoked_tokens()
+            # Replace while the transaction is open, notifications for later
+            # revocations are only delivered once it ends and add on top.
+            self._revoked_tokens.replace(revocations, source=self._source)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            jti, exp = decode_notification(payload)
+        except ValueError:
+            logger.error(f"Ignoring malformed revocation notification {payload!r}.")
+            return
+        self._revoked_tokens.add(jti, exp, source=self._source)
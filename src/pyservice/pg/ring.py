@@ -0,0 +1,31 @@
+import bisect
+import hashlib
+import uuid
+from collections.abc import Iterable
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest())
+
+
+class HashRing:
+    """Places users on shards by consistent hashing of their id.
+
+    Every shard owns `replicas` points on the ring, a user belongs to the
+    shard owning the first point after the hash of its id. Adding a shard
+    moves only the users that land on its points, about 1/n of them."""
+
+    def __init__(self, shards: Iterable[str], replicas: int = 128):
+        points = sorted(
+            (_hash(f"{shard}#{replica}".encode()), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError("A hash ring needs at least one shard.")
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id: uuid.UUID) -> str:
+        index = bisect.bisect(self._points, _hash(user_id.bytes))
+        return self._shards[index % len(self._shards)]
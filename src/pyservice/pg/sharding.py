@@ -0,0 +1,345 @@
+"""Spreading users and their tokens over several databases.
+
+Every user lives on exactly one shard, together with its refresh tokens and
+revocations. The primary database keeps the directory of which shard that
+is. New users are placed by consistent hashing of their id, ids of sharded
+users derive from their identity, so a retried login always lands on the
+same shard.
+
+The directory also holds the email of every user, emails are unique across
+all shards like they are in a single database.
+
+To shard an existing database, configure it as the first shard, run
+`python -m pyservice.pg.sharding sync-directory` and then `rebalance` to
+move users to the shards the ring assigns them. Both run online."""
+
+import argparse
+import asyncio
+import uuid
+from collections import defaultdict
+from collections.abc import Sequence
+from types import TracebackType
+
+import sqlalchemy as sa
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import pyservice.logger as logger
+from pyservice.pg.context import DatabaseContext
+from pyservice.pg.models import PGRefreshToken, PGRevokedToken, PGUser, PGUserShard
+from pyservice.pg.store import Store
+from pyservice.pg.utils import UserIdentity
+from pyservice.user import UserCreate
+
+USER_ID_NAMESPACE = uuid.UUID("5b0d7a52-3c1e-4f7e-9a0b-7f2c7e3d9c41")
+"The namespace of the ids of sharded users, derived from their identity."
+
+
+def sharded_user_id(identity: UserIdentity) -> uuid.UUID:
+    return uuid.uuid5(USER_ID_NAMESPACE, str(identity))
+
+
+class ShardedStore:
+    """Routes store operations to the shard holding the user.
+
+    Users are looked up in the directory with FOR SHARE, in the request's
+    transaction on the primary database. Moves lock the same directory rows
+    FOR UPDATE, so a user is never written to while it moves. Shard
+    transactions are opened on first use and committed before the primary
+    transaction, a failed primary commit leaves at worst a user on its shard
+    without a directory entry. The next login of the user adds the entry,
+    `sync-directory` adds the entries of all such users."""
+
+    def __init__(self, ctx: DatabaseContext, directory: AsyncSession):
+        assert ctx.ring is not None
+        self._ctx = ctx
+        self._ring = ctx.ring
+        self._directory = directory
+        self._sessions: dict[str, AsyncSession] = {}
+        self._user_shards: dict[uuid.UUID, str] = {}
+
+    async def __aenter__(self) -> "ShardedStore":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: TracebackType | None,
+    ):
+        try:
+            for session in self._sessions.values():
+                if exc_type is None:
+                    await session.commit()
+                else:
+                    await session.rollback()
+        finally:
+            for session in self._sessions.values():
+                await session.close()
+
+    async def _shard_store(self, shard: str) -> Store:
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._ctx.shard_session(shard)
+            await session.begin()
+            self._sessions[shard] = session
+        return Store(session)
+
+    async def _user_store(self, user_id: uuid.UUID) -> Store:
+        shard = self._user_shards.get(user_id)
+        if shard is None:
+            stmt = (
+                select(PGUserShard.shard)
+                .where(PGUserShard.user_id == user_id)
+                .with_for_update(read=True)
+            )
+            result = await self._directory.execute(stmt)
+            shard = self._user_shards[user_id] = result.scalar_one()
+        return await self._shard_store(shard)
+
+    async def create_user(
+        self, create: UserCreate, *, exists_ok: bool = False
+    ) -> uuid.UUID:
+        # The directory entry claims the email, an email taken on any shard
+        # fails with an IntegrityError before the shard is written to.
+        identity = UserIdentity(
+            provider=create.identity_provider, id=create.identity_provider_id
+        )
+        user_id = sharded_user_id(identity)
+
+        stmt = (
+            insert(PGUserShard)
+            .values(
+                user_id=user_id,
+                identity=identity,
+                shard=self._ring.shard_for(user_id),
+                email=create.email,
+            )
+            .on_conflict_do_update(
+                index_elements=[PGUserShard.identity],
+                set_={"identity": PGUserShard.identity},
+            )
+            .returning(PGUserShard.user_id, PGUserShard.shard)
+        )
+        result = await self._directory.execute(stmt)
+        user_id, shard = result.one()._t
+        self._user_shards[user_id] = shard
+
+        store = await self._shard_store(shard)
+        return await store.create_user(create, exists_ok=exists_ok, user_id=user_id)
+
+    async def read_user_email(self, user_id: uuid.UUID) -> str | None:
+        store = await self._user_store(user_id)
+        return await store.read_user_email(user_id)
+
+    async def rotate_refresh_token(
+        self,
+        user_id: uuid.UUID,
+        token: str | None = None,
+        *,
+        session_id: uuid.UUID | None = None,
+    ) -> str:
+        store = await self._user_store(user_id)
+        return await store.rotate_refresh_token(
+            user_id, token=token, session_id=session_id
+        )
+
+    async def revoke_token(self, user_id: uuid.UUID, jti: str, exp: int):
+        store = await self._user_store(user_id)
+        await store.revoke_token(user_id, jti=jti, exp=exp)
+
+
+def _plain_table(table: sa.Table) -> sa.TableClause:
+    # Untyped columns copy values as stored, e.g. token hashes aren't hashed
+    # again on insert.
+    return sa.table(table.name, *(sa.column(column.name) for column in table.columns))
+
+
+_USERS = _plain_table(PGUser.__table__)  # type: ignore[arg-type]
+_USER_ROWS = [
+    (_plain_table(PGRefreshToken.__table__), "user_id"),  # type: ignore[arg-type]
+    (_plain_table(PGRevokedToken.__table__), "user_id"),  # type: ignore[arg-type]
+]
+
+
+async def _copy_rows(
+    source: AsyncSession,
+    target: AsyncSession,
+    table: sa.TableClause,
+    key: str,
+    user_ids: Sequence[uuid.UUID],
+):
+    result = await source.execute(
+        select(table).where(table.c[key].in_(user_ids)).order_by(table.c.id)
+    )
+    rows = [row._asdict() for row in result]
+    if rows:
+        await target.execute(insert(table).values(rows).on_conflict_do_nothing())
+
+
+async def move_users(user_ids: Sequence[uuid.UUID], source: str, target: str) -> int:
+    """Move users with their tokens from one shard to another, online.
+
+    The directory rows of the users stay locked until they point to the
+    target, requests for these users wait meanwhile. Returns how many users
+    were moved. Safe to run again after a failure."""
+    ctx = DatabaseContext.get()
+
+    async with (
+        ctx.session() as directory,
+        ctx.shard_session(source) as source_session,
+        ctx.shard_session(target) as target_session,
+    ):
+        async with directory.begin():
+            stmt = (
+                select(PGUserShard.user_id)
+                .where(
+                    PGUserShard.user_id.in_(user_ids) & (PGUserShard.shard == source)
+                )
+                .with_for_update()
+            )
+            locked = (await directory.execute(stmt)).scalars().all()
+            if not locked:
+                return 0
+
+            async with source_session.begin(), target_session.begin():
+                await _copy_rows(source_session, target_session, _USERS, "id", locked)
+                for table, key in _USER_ROWS:
+                    await _copy_rows(source_session, target_session, table, key, locked)
+
+            # Users copied by an earlier, interrupted move are gone from the
+            # source already, their directory rows still need to change.
+            stmt = select(PGUser.id).where(PGUser.id.in_(locked))
+            async with target_session.begin():
+                moved = (await target_session.execute(stmt)).scalars().all()
+
+            stmt = (
+                update(PGUserShard)
+                .where(PGUserShard.user_id.in_(moved))
+                .values(shard=target)
+            )
+            await directory.execute(stmt)
+
+        # Deleting cascades to the tokens. If this fails, the copies left on
+        # the source are never read again.
+        async with source_session.begin():
+            await source_session.execute(delete(PGUser).where(PGUser.id.in_(moved)))
+
+    return len(moved)
+
+
+async def sync_directory(*, batch_size: int = 1000) -> int:
+    """Add the users of every shard that are missing in the directory, and
+    the emails of entries added before the directory held emails. Returns how
+    many entries were added or completed. Fails on an email held by users on
+    two shards, one of them has to be changed first."""
+    ctx = DatabaseContext.get()
+
+    added = 0
+    for shard in ctx.shards:
+        after = None
+        while True:
+            async with ctx.shard_session(shard) as session, session.begin():
+                stmt = select(PGUser.id, PGUser.identity, PGUser.email).order_by(
+                    PGUser.id
+                )
+                if after is not None:
+                    stmt = stmt.where(PGUser.id > after)
+                rows = (await session.execute(stmt.limit(batch_size))).all()
+            if not rows:
+                break
+            after = rows[-1].id
+
+            async with ctx.session() as directory, directory.begin():
+                stmt = insert(PGUserShard).values(
+                    [
+                        {
+                            "user_id": id,
+                            "identity": identity,
+                            "shard": shard,
+                            "email": email,
+                        }
+                        for id, identity, email in rows
+                    ]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[PGUserShard.identity],
+                    set_={"email": stmt.excluded.email},
+                    where=PGUserShard.email.is_(None),
+                )
+                result = await directory.execute(stmt)
+                added += result.rowcount  # type: ignore[attr-defined]
+    return added
+
+
+async def rebalance(
+    *, source: str | None = None, batch_size: int = 100, dry_run: bool = False
+) -> int:
+    """Move every user, optionally only those on `source`, to the shard the
+    ring assigns it. Returns how many users were, or would be, moved."""
+    ctx = DatabaseContext.get()
+    assert ctx.ring is not None, "Rebalancing requires configured shards."
+
+    total = 0
+    after = None
+    while True:
+        async with ctx.session() as directory, directory.begin():
+            stmt = select(PGUserShard.user_id, PGUserShard.shard).order_by(
+                PGUserShard.user_id
+            )
+            if after is not None:
+                stmt = stmt.where(PGUserShard.user_id > after)
+            if source is not None:
+                stmt = stmt.where(PGUserShard.shard == source)
+            rows = (await directory.execute(stmt.limit(batch_size))).all()
+        if not rows:
+            return total
+        after = rows[-1].user_id
+
+        misplaced: dict[tuple[str, str], list[uuid.UUID]] = defaultdict(list)
+        for user_id, shard in rows:
+            target = ctx.ring.shard_for(user_id)
+            if target != shard:
+                misplaced[(shard, target)].append(user_id)
+
+        for (from_shard, to_shard), user_ids in misplaced.items():
+            if dry_run:
+                total += len(user_ids)
+                continue
+            moved = await move_users(user_ids, from_shard, to_shard)
+            logger.info(f"Moved {moved} users from {from_shard} to {to_shard}.")
+            total += moved
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m pyservice.pg.sharding")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser(
+        "sync-directory", help="Add users and emails missing in the directory."
+    )
+    sync.add_argument("--batch-size", type=int, default=1000)
+
+    move = commands.add_parser(
+        "rebalance", help="Move users to the shards the ring assigns them."
+    )
+    move.add_argument("--source", help="Only move users off this shard.")
+    move.add_argument("--batch-size", type=int, default=100)
+    move.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "sync-directory":
+        added = asyncio.run(sync_directory(batch_size=args.batch_size))
+        print(f"Added or completed {added} directory entries.")
+    else:
+        moved = asyncio.run(
+            rebalance(
+                source=args.source, batch_size=args.batch_size, dry_run=args.dry_run
+            )
+        )
+        print(f"{'Would move' if args.dry_run else 'Moved'} {moved} users.")
+
+
+if __name__ == "__main__":
+    main()
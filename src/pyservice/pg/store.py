@@ -1,18 +1,24 @@
+import datetime
 import uuid
+from collections.abc import AsyncIterator
 
-from sqlalchemy import select, update
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from pyservice.auth.context import HashContext
+from pyservice.auth.revocation import REVOCATION_CHANNEL, encode_notification
 from pyservice.auth.token import (
     RefreshTokenStatus,
+    get_token_config,
     sign_refresh_token,
 )
-from pyservice.exc import AuthTokenHashVerifyError
-from pyservice.pg.models import PGRefreshToken, PGUser
-from pyservice.pg.utils import UserIdentity
-from pyservice.user import UserCreate
+from pyservice.context import SettingsContext
+from pyservice.exc import AuthInvalidTokenError, AuthTokenHashVerifyError
+from pyservice.pg.models import PGRefreshToken, PGRevokedToken, PGUser
+from pyservice.pg.utils import UserIdentity, utcnow
+from pyservice.tracing import span
+from pyservice.user import UserCreate, UserExport
 
 
 class Store:
@@ -20,9 +26,14 @@ class Store:
         self._session = session
 
     async def create_user(
-        self, create: UserCreate, *, exists_ok: bool = False
+        self,
+        create: UserCreate,
+        *,
+        exists_ok: bool = False,
+        user_id: uuid.UUID | None = None,
     ) -> uuid.UUID:
         stmt = insert(PGUser).values(
+            id=user_id or uuid.uuid4(),
             email=create.email,
             identity=UserIdentity(
                 provider=create.identity_provider, id=create.identity_provider_id
@@ -42,25 +53,124 @@ class Store:
         result = await self._session.execute(stmt)
         return result.scalar_one_or_none()
 
+    async def stream_users(
+        self,
+        *,
+        limit: int,
+        after: uuid.UUID | None = None,
+        identity_provider: str | None = None,
+        created_after: datetime.datetime | None = None,
+        created_before: datetime.datetime | None = None,
+        with_sessions: bool = False,
+        yield_per: int = 500,
+    ) -> AsyncIterator[UserExport]:
+        """Stream up to `limit` users ordered by id, starting after `after`.
+
+        Rows are fetched through a server side cursor, `yield_per` at a time.
+        The filters are applied while walking the primary key index, a page
+        never sorts more than the rows it returns."""
+        columns = [
+            PGUser.id,
+            PGUser.created_at,
+            PGUser.updated_at,
+            PGUser.email,
+            PGUser.identity,
+            PGUser.last_login_at,
+            PGUser.login_count,
+        ]
+        if with_sessions:
+            columns.append(
+                select(func.count())
+                .where(
+                    (PGRefreshToken.user_id == PGUser.id)
+                    & (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
+                )
+                .scalar_subquery()
+            )
+
+        stmt = select(*columns).order_by(PGUser.id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(PGUser.id > after)
+        if identity_provider is not None:
+            stmt = stmt.where(
+                PGUser.identity.startswith(f"{identity_provider}:", autoescape=True)
+            )
+        if created_after is not None:
+            stmt = stmt.where(PGUser.created_at >= created_after)
+        if created_before is not None:
+            stmt = stmt.where(PGUser.created_at < created_before)
+
+        result = await self._session.stream(stmt.execution_options(yield_per=yield_per))
+        async for row in result:
+            (
+                id,
+                created_at,
+                updated_at,
+                email,
+                identity,
+                last_login_at,
+                login_count,
+                *active_sessions,
+            ) = row
+            # Rows are trusted, skip validation.
+            yield UserExport.model_construct(
+                id=id,
+                created_at=created_at.replace(tzinfo=datetime.UTC),
+                updated_at=updated_at.replace(tzinfo=datetime.UTC),
+                email=email,
+                identity_provider=identity.provider,
+                identity_provider_id=identity.id,
+                last_login_at=(
+                    last_login_at.replace(tzinfo=datetime.UTC)
+                    if last_login_at is not None
+                    else None
+                ),
+                login_count=login_count,
+                active_sessions=active_sessions[0] if active_sessions else None,
+            )
+
     async def rotate_refresh_token(
-        self, user_id: uuid.UUID, token: str | None = None
+        self,
+        user_id: uuid.UUID,
+        token: str | None = None,
+        *,
+        session_id: uuid.UUID | None = None,
     ) -> str:
+        """Issue the next refresh token of a session, revoking the active one.
+
+        Starting a session beyond `JWT_MAX_SESSIONS` ends the sessions of the
+        user that were refreshed longest ago. Concurrent logins may exceed the
+        limit briefly, until the next login of the user."""
+        # One probe of the unique index on (user_id, session_id).
         stmt = (
             select(PGRefreshToken.id, PGRefreshToken.token_hash)
             .where(
                 (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
                 & (PGRefreshToken.user_id == user_id)
+                & (
+                    PGRefreshToken.session_id == session_id
+                    if session_id is not None
+                    else PGRefreshToken.session_id.is_(None)
+                )
             )
             .with_for_update()
         )
         result = await self._session.execute(stmt)
         row = result.one_or_none()
-        if row:
+        if row is None:
+            if token:
+                # Ended by a newer login, or on another device.
+                raise AuthInvalidTokenError("Refresh token session has ended.")
+            await self._evict_sessions(user_id)
+        else:
             pg_token_id, pg_token_hash = row._t
 
             ctx = HashContext.get()
-            if token and not ctx.crypt.verify(token, pg_token_hash):
-                raise AuthTokenHashVerifyError("Refresh token hash mismatch.")
+            if token:
+                with span("crypt.verify"):
+                    verified = ctx.crypt.verify(token, pg_token_hash)
+                if not verified:
+                    raise AuthTokenHashVerifyError("Refresh token hash mismatch.")
 
             stmt = (
                 update(PGRefreshToken)
@@ -69,16 +179,111 @@ class Store:
             )
             _ = await self._session.execute(stmt)
 
-        user_email = await self.read_user_email(user_id)
-        assert user_email is not None
+        # Compact tokens leave out the email, saving the lookup.
+        user_email = None
+        if get_token_config().includes_email:
+            user_email = await self.read_user_email(user_id)
+            assert user_email is not None
 
-        refresh_token, _ = sign_refresh_token(sub=user_id, email=user_email)
+        refresh_token, _ = sign_refresh_token(
+            sub=user_id, email=user_email, session_id=session_id
+        )
 
         stmt = insert(PGRefreshToken).values(
             token_hash=refresh_token,
             user_id=user_id,
+            session_id=session_id,
             status=RefreshTokenStatus.ACTIVE,
         )
         _ = await self._session.execute(stmt)
 
         return refresh_token
+
+    async def _evict_sessions(self, user_id: uuid.UUID):
+        """Revoke the oldest sessions of the user, leaving room for one more."""
+        ctx = SettingsContext.get()
+
+        # A token is created on each rotation, its age is the time since the
+        # session was last refreshed. Tokens created in one transaction share
+        # their created_at, the id breaks the tie.
+        oldest = (
+            select(PGRefreshToken.id)
+            .where(
+                (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
+                & (PGRefreshToken.user_id == user_id)
+            )
+            .order_by(PGRefreshToken.created_at.desc(), PGRefreshToken.id.desc())
+            .offset(ctx.settings.JWT_MAX_SESSIONS - 1)
+            .with_for_update()
+        )
+        stmt = (
+            update(PGRefreshToken)
+            .where(PGRefreshToken.id.in_(oldest.scalar_subquery()))
+            .values(status=RefreshTokenStatus.REVOKED)
+        )
+        _ = await self._session.execute(stmt)
+
+    async def revoke_token(self, user_id: uuid.UUID, jti: str, exp: int):
+        expires_at = datetime.datetime.fromtimestamp(exp, datetime.UTC)
+        stmt = (
+            insert(PGRevokedToken)
+            .values(
+                jti=jti,
+                user_id=user_id,
+                expires_at=expires_at.replace(tzinfo=None),
+            )
+            .on_conflict_do_nothing(index_elements=[PGRevokedToken.jti])
+        )
+        _ = await self._session.execute(stmt)
+
+        # Notifications are delivered on commit, listeners never see
+        # revocations that were rolled back.
+        stmt = select(func.pg_notify(REVOCATION_CHANNEL, encode_notification(jti, exp)))
+        _ = await self._session.execute(stmt)
+
+    async def read_revoked_tokens(self) -> list[tuple[str, int]]:
+        stmt = select(PGRevokedToken.jti, PGRevokedToken.expires_at).where(
+            PGRevokedToken.expires_at > utcnow()
+        )
+        result = await self._session.execute(stmt)
+        return [
+            (jti, int(expires_at.replace(tzinfo=datetime.UTC).timestamp()))
+            for jti, expires_at in result.tuples()
+        ]
+
+    async def expire_refresh_tokens(
+        self, issued_before: datetime.datetime, *, limit: int
+    ) -> int:
+        """Mark up to `limit` active refresh tokens issued before the given
+        time as expired, return how many were."""
+        batch = (
+            select(PGRefreshToken.id)
+            .where(
+                (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
+                & (PGRefreshToken.created_at < issued_before)
+            )
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(PGRefreshToken)
+            .where(PGRefreshToken.id.in_(batch.scalar_subquery()))
+            .values(status=RefreshTokenStatus.EXPIRED)
+        )
+        result = await self._session.execute(stmt)
+        return result.rowcount  # type: ignore[attr-defined]
+
+    async def delete_expired_revocations(self, *, limit: int) -> int:
+        """Delete up to `limit` revocations of expired tokens, return how many
+        were."""
+        batch = (
+            select(PGRevokedToken.id)
+            .where(PGRevokedToken.expires_at <= utcnow())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = delete(PGRevokedToken).where(
+            PGRevokedToken.id.in_(batch.scalar_subquery())
+        )
+        result = await self._session.execute(stmt)
+        return result.rowcount  # type: ignore[attr-defined]
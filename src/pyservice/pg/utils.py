@@ -1,10 +1,14 @@
+from collections.abc import Callable
 from dataclasses import dataclass
 
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import expression
 from sqlalchemy.types import DateTime, String, Text, TypeDecorator
 
 from pyservice.auth.context import HashContext
+from pyservice.tracing import span
 
 
 class utcnow(expression.FunctionElement):
@@ -66,7 +70,31 @@ class PasswordHashType(TypeDecorator):
             raise TypeError(f"Cannot convert {type(value)} to PasswordHash")
 
         ctx = HashContext.get()
-        return ctx.crypt.hash(value)
+        with span("crypt.hash"):
+            return ctx.crypt.hash(value)
 
     def process_result_value(self, value, dialect):
         return value
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """Run `callback` once the current transaction of `session` commits, never
+    if it rolls back. With shards, their transactions commit before it."""
+    sync_session = session.sync_session
+    transaction = sync_session.get_transaction()
+    assert transaction is not None
+    pending = True
+
+    # Listeners cannot be removed while events are dispatched, they stay
+    # with the session and do nothing once the transaction ended.
+    def committed(_):
+        if pending:
+            callback()
+
+    def ended(_, ended_transaction):
+        nonlocal pending
+        if ended_transaction is transaction:
+            pending = False
+
+    event.listen(sync_session, "after_commit", committed)
+    event.listen(sync_session, "after_transaction_end", ended)
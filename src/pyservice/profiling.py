@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from types import CoroutineType, FrameType
+
+from pyservice.context import SettingsContext
+
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _thread_stack(frame: FrameType | None) -> list[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _awaiting_stack(coroutine) -> list[str]:
+    """Return the stack of a suspended coroutine, down to what it awaits."""
+    stack = []
+    while coroutine is not None:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(
+            coroutine, "gi_frame", None
+        )
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(
+            coroutine, "gi_yieldfrom", None
+        )
+    if coroutine is not None and not isinstance(coroutine, CoroutineType):
+        stack.append(f"[await {type(coroutine).__name__}]")
+    else:
+        stack.append("[await]")
+    return stack
+
+
+class SamplingProfiler:
+    """Samples where one asyncio task spends its wall-clock time.
+
+    A background thread looks at the task every `interval` seconds. While the
+    task runs, the stack of the event loop thread is sampled, while it is
+    suspended the chain of coroutines it awaits. Samples are counted by their
+    stack, ready to be written in the collapsed format of flame graph tools."""
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        task = asyncio.current_task()
+        assert task is not None, "Profiling requires a running task."
+        loop = task.get_loop()
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(task, loop, threading.get_ident()),
+            name="pyservice-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._samples
+
+    def _sample(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, ident: int):
+        while not self._stopped.wait(self._interval):
+            if asyncio.current_task(loop) is task:
+                frame = sys._current_frames().get(ident)
+                stack = _thread_stack(frame)
+            else:
+                stack = _awaiting_stack(task.get_coro())
+            self._samples[";".join(stack)] += 1
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileInfo:
+    name: str
+    size: int
+    created_at: datetime.datetime
+
+
+class ProfileStore:
+    """A ring buffer of profiles on disk, the oldest are deleted first."""
+
+    def __init__(self, directory: Path, max_profiles: int):
+        self._directory = directory
+        self._max_profiles = max_profiles
+
+    def save(self, method: str, path: str, elapsed: float, samples: Counter[str]):
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        now = datetime.datetime.now(datetime.UTC)
+        slug = _SLUG.sub("_", path).strip("_") or "root"
+        name = (
+            f"{now:%Y%m%dT%H%M%S%fZ}-{method}-{slug}-{elapsed * 1000:.0f}ms.collapsed"
+        )
+        body = "".join(f"{stack} {count}\n" for stack, count in samples.items())
+        (self._directory / name).write_text(body)
+
+        for info in self.list()[self._max_profiles :]:
+            (self._directory / info.name).unlink(missing_ok=True)
+
+    def list(self) -> list[ProfileInfo]:
+        """List the stored profiles, newest first."""
+        if not self._directory.is_dir():
+            return []
+        profiles = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(".collapsed"):
+                stat = entry.stat()
+                profiles.append(
+                    ProfileInfo(
+                        name=entry.name,
+                        size=stat.st_size,
+                        created_at=datetime.datetime.fromtimestamp(
+                            stat.st_mtime, datetime.UTC
+                        ),
+                    )
+                )
+        profiles.sort(key=lambda info: info.name, reverse=True)
+        return profiles
+
+    def path(self, name: str) -> Path | None:
+        """Return the path of a stored profile, None for unknown names."""
+        if Path(name).name != name or not name.endswith(".collapsed"):
+            return None
+        path = self._directory / name
+        return path if path.is_file() else None
+
+
+def get_profile_store() -> ProfileStore:
+    ctx = SettingsContext.get()
+
+    return ProfileStore(
+        ctx.settings.API_PROFILE_DIRECTORY, ctx.settings.API_PROFILE_MAX_PROFILES
+    )
+
+
+def sign_profile_request(key: bytes, expires: int) -> str:
+    """Return a profiling header value, valid until the unix time `expires`."""
+    signature = hmac.new(key, str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}:{signature}"
+
+
+def verify_profile_request(key: bytes, value: str) -> bool:
+    expires, _, _ = value.partition(":")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sign_profile_request(key, int(expires)), value)
@@ -0,0 +1,294 @@
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from stat import S_ISDIR
+
+from pyservice.memory import CacheSize
+from pyservice.metrics import counter
+
+_CACHE_LOOKUPS = counter(
+    "pyservice_shared_cache_lookups",
+    "Shared cache lookups, by cache and whether they hit.",
+    labelnames=("cache", "result"),
+)
+
+_MAGIC = b"pysvc-cache-v1\0\0"
+_FILE_HEADER = struct.Struct("<16sQ")
+"Magic and the last version handed out, padded to the first slot."
+
+_SLOT_HEADER = struct.Struct("<QQdQIII")
+"Sequence, key hash, expiry, version, key length, value length and checksum."
+
+_SEQUENCE = struct.Struct("<Q")
+_PROBES = 8
+_READ_RETRIES = 100
+
+
+@dataclass(frozen=True, slots=True)
+class CacheEntry:
+    value: bytes
+    version: int
+    "Increases with every write to the cache, a changed version means new data."
+
+    expires_at: float
+
+
+class SharedCache:
+    """A fixed-size hash table in a memory-mapped file, shared by processes.
+
+    Every entry lives in one of `slots` slots of `slot_size` bytes, placed by
+    the hash of its key and found by probing a few slots on. Reads take no
+    lock: a slot's sequence number is odd while it is written and changes
+    with every write, a reader that sees it change, or a checksum mismatch,
+    reads again. Writers exclude each other with a lock on the file.
+
+    Expired entries are misses and the first to be overwritten, when all
+    candidate slots are in use the entry expiring first is evicted. Without
+    a directory, the table is private to this process."""
+
+    def __init__(
+        self, name: str, directory: Path | None, *, slots: int, slot_size: int
+    ):
+        if slot_size <= _SLOT_HEADER.size:
+            raise ValueError(f"Slots must be larger than {_SLOT_HEADER.size} bytes.")
+        self._name = name
+        self._slots = slots
+        self._slot_size = slot_size
+        self._size = _FILE_HEADER.size + slots * slot_size
+        self._write_thread_lock = threading.Lock()
+        self._fill_thread_lock = threading.Lock()
+
+        if directory is None:
+            self._fd = None
+            self._fill_fd = None
+            self._map = mmap.mmap(-1, self._size)
+            _FILE_HEADER.pack_into(self._map, 0, _MAGIC, 0)
+            return
+
+        # Anyone able to write the file could plant verified tokens.
+        _private_directory(directory)
+        path = directory / f"{name}-{slots}x{slot_size}.cache"
+        self._fd = _open_private(path)
+        self._fill_fd = _open_private(path.with_suffix(".lock"))
+
+        with self._write_lock():
+            if os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+            self._map = mmap.mmap(self._fd, self._size)
+            magic, _ = _FILE_HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC:
+                _FILE_HEADER.pack_into(self._map, 0, _MAGIC, 0)
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self._lookup(key)
+        _CACHE_LOOKUPS.inc(self._name, "miss" if entry is None else "hit")
+        return entry
+
+    def set(self, key: str, value: bytes, ttl: float) -> CacheEntry | None:
+        """Store `value` for `ttl` seconds. Values too large for a slot are
+        not stored, None is returned for them."""
+        key_bytes = key.encode()
+        if _SLOT_HEADER.size + len(key_bytes) + len(value) > self._slot_size:
+            return None
+
+        key_hash = _hash(key_bytes)
+        with self._write_lock():
+            index = self._slot_for(key_hash, key_bytes)
+            _, version = _FILE_HEADER.unpack_from(self._map, 0)
+            version += 1
+            _FILE_HEADER.pack_into(self._map, 0, _MAGIC, version)
+
+            entry = CacheEntry(
+                value=value, version=version, expires_at=time.time() + ttl
+            )
+            self._write(index, key_hash, key_bytes, entry)
+            return entry
+
+    def delete(self, key: str):
+        key_bytes = key.encode()
+        key_hash = _hash(key_bytes)
+        with self._write_lock():
+            for index in self._candidates(key_hash):
+                if self._read(index, key_hash, key_bytes) is not None:
+                    self._write(index, 0, b"", CacheEntry(b"", 0, 0.0))
+
+    def size(self) -> CacheSize:
+        """Count the live entries, reading every slot."""
+        now = time.time()
+        entries = 0
+        for index in range(self._slots):
+            _, slot_hash, expires_at, *_ = _SLOT_HEADER.unpack_from(
+                self._map, self._offset(index)
+            )
+            if slot_hash != 0 and expires_at > now:
+                entries += 1
+        return CacheSize(entries=entries, max_entries=self._slots, bytes=self._size)
+
+    def fill(
+        self,
+        key: str,
+        fetch: Callable[[], bytes],
+        ttl: float,
+        *,
+        stale_version: int | None = None,
+    ) -> CacheEntry:
+        """Return the entry of `key`, fetching and storing it on a miss.
+
+        Only one process fetches a key at a time, the others wait and use
+        what it stored. With `stale_version`, an entry of that version
+        counts as a miss, to refresh data known to be outdated."""
+        with self._fill_lock(_hash(key.encode())):
+            entry = self._lookup(key)
+            if entry is not None and entry.version != stale_version:
+                return entry
+
+            value = fetch()
+            entry = self.set(key, value, ttl)
+            if entry is None:
+                return CacheEntry(value=value, version=0, expires_at=0.0)
+            return entry
+
+    def _lookup(self, key: str) -> CacheEntry | None:
+        key_bytes = key.encode()
+        key_hash = _hash(key_bytes)
+        now = time.time()
+        for index in self._candidates(key_hash):
+            entry = self._read(index, key_hash, key_bytes)
+            if entry is not None and entry.expires_at > now:
+                return entry
+        return None
+
+    def _candidates(self, key_hash: int) -> Iterator[int]:
+        start = key_hash % self._slots
+        for probe in range(min(_PROBES, self._slots)):
+            yield (start + probe) % self._slots
+
+    def _offset(self, index: int) -> int:
+        return _FILE_HEADER.size + index * self._slot_size
+
+    def _read(self, index: int, key_hash: int, key: bytes) -> CacheEntry | None:
+        offset = self._offset(index)
+        for _ in range(_READ_RETRIES):
+            sequence, slot_hash, expires_at, version, key_length, value_length, crc = (
+                _SLOT_HEADER.unpack_from(self._map, offset)
+            )
+            if sequence & 1:
+                time.sleep(0)
+                continue
+
+            start = offset + _SLOT_HEADER.size
+            end = min(start + key_length + value_length, offset + self._slot_size)
+            body = self._map[start:end] if slot_hash == key_hash else b""
+
+            if _SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+                continue
+            if slot_hash != key_hash:
+                return None
+            if zlib.crc32(body) != crc:
+                continue
+            if body[:key_length] != key:
+                return None
+            return CacheEntry(
+                value=body[key_length:], version=version, expires_at=expires_at
+            )
+        return None
+
+    def _slot_for(self, key_hash: int, key: bytes) -> int:
+        now = time.time()
+        free = None
+        oldest, oldest_expiry = 0, float("inf")
+        for index in self._candidates(key_hash):
+            _, slot_hash, expires_at, *_ = _SLOT_HEADER.unpack_from(
+                self._map, self._offset(index)
+            )
+            if slot_hash == key_hash and self._read(index, key_hash, key):
+                return index
+            if free is None and (slot_hash == 0 or expires_at <= now):
+                free = index
+            if expires_at < oldest_expiry:
+                oldest, oldest_expiry = index, expires_at
+        return free if free is not None else oldest
+
+    def _write(self, index: int, key_hash: int, key: bytes, entry: CacheEntry):
+        offset = self._offset(index)
+        (sequence,) = _SEQUENCE.unpack_from(self._map, offset)
+        _SEQUENCE.pack_into(self._map, offset, sequence + 1)
+
+        body = key + entry.value
+        start = offset + _SLOT_HEADER.size
+        self._map[start : start + len(body)] = body
+        _SLOT_HEADER.pack_into(
+            self._map,
+            offset,
+            sequence + 1,
+            key_hash,
+            entry.expires_at,
+            entry.version,
+            len(key),
+            len(entry.value),
+            zlib.crc32(body),
+        )
+        _SEQUENCE.pack_into(self._map, offset, sequence + 2)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        with self._write_thread_lock:
+            if self._fd is None:
+                yield
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _fill_lock(self, key_hash: int):
+        with self._fill_thread_lock:
+            if self._fill_fd is None:
+                yield
+                return
+            # One byte per slot, keys of different slots fill concurrently.
+            index = key_hash % self._slots
+            fcntl.lockf(self._fill_fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fill_fd, fcntl.LOCK_UN, 1, index)
+
+
+def _hash(key: bytes) -> int:
+    # Zero marks empty slots.
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest()) | 1
+
+
+def _private_directory(directory: Path):
+    """Create the directory, or check that an existing one is ours alone.
+
+    Other users must not be able to create or replace files in it, e.g. a
+    symlink in place of the cache that makes us overwrite another file."""
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    stat = os.lstat(directory)
+    if not S_ISDIR(stat.st_mode) or stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError(
+            f"Shared cache directory {directory} must be private to this user."
+        )
+
+
+def _open_private(path: Path) -> int:
+    flags = os.O_RDWR | os.O_CREAT | os.O_CLOEXEC | os.O_NOFOLLOW
+    fd = os.open(path, flags, 0o600)
+    stat = os.fstat(fd)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        os.close(fd)
+        raise PermissionError(f"Shared cache {path} must be private to this user.")
+    return fd
@@ -0,0 +1,341 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Sequence
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Protocol
+
+import pyservice.logger as logger
+from pyservice.context import ContextModel, SettingsContext
+from pyservice.memory import CacheSize, register_cache
+from pyservice.metrics import counter
+from pyservice.version import __version__
+
+_TRACES_SAMPLED = counter(
+    "pyservice_traces_sampled",
+    "Requests traced and exported.",
+)
+_SPANS_DROPPED = counter(
+    "pyservice_trace_spans_dropped",
+    "Spans dropped because their trace had too many spans already.",
+)
+
+_MAX_SPANS_PER_TRACE = 1000
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+AttributeValue = str | int | float | bool
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict[str, AttributeValue] = field(default_factory=dict)
+    error: str | None = None
+    "The type of the exception the span ended with, if any."
+
+
+@dataclass(slots=True)
+class _Trace:
+    spans: list[Span] = field(default_factory=list)
+    dropped: int = 0
+
+    def record(self, span: Span):
+        if len(self.spans) < _MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+            _SPANS_DROPPED.inc()
+
+
+class TraceContext(ContextModel):
+    """The span the current task runs in, only set for sampled traces."""
+
+    __var__ = ContextVar("pyservice_trace")
+
+    trace: _Trace
+    trace_id: str
+    span_id: str
+
+
+# Looked up on every span, reading the variable directly skips the
+# comparatively slow class attribute lookup of pydantic models.
+_TRACE_CONTEXT: ContextVar[TraceContext] = TraceContext.__var__
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: Sequence[Span]):
+        """Export the spans of a finished trace, without blocking for long."""
+        ...
+
+
+class RingBufferExporter:
+    """Keeps the most recent traces in memory."""
+
+    def __init__(self, max_traces: int):
+        self._traces: deque[list[Span]] = deque(maxlen=max_traces)
+
+    def export(self, spans: Sequence[Span]):
+        self._traces.append(list(spans))
+
+    def __len__(self) -> int:
+        return len(self._traces)
+
+    def traces(self) -> list[list[Span]]:
+        """Return the buffered traces, newest first."""
+        return list(reversed(self._traces))
+
+
+class OTLPFileExporter:
+    """Appends traces to a file as OTLP/JSON, one export request per line.
+
+    The format of the OpenTelemetry collector's file exporter, so traces can
+    be loaded into any OTLP capable backend later."""
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[Span]):
+        line = json.dumps(_otlp_request(spans), separators=(",", ":")) + "\n"
+        try:
+            with self._lock, self._path.open("a") as file:
+                file.write(line)
+        except OSError:
+            logger.error(f"Failed to write trace to {self._path}:", exc_info=True)
+
+
+def _otlp_request(spans: Sequence[Span]) -> dict[str, Any]:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes(
+                        {"service.name": "pyservice", "service.version": __version__}
+                    )
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "pyservice"},
+                        "spans": [_otlp_span(span) for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _otlp_span(span: Span) -> dict[str, Any]:
+    otlp: dict[str, Any] = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 2 if span.parent_id is None else 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": 2, "message": span.error} if span.error else {},
+    }
+    if span.parent_id is not None:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+def _otlp_attributes(attributes: dict[str, AttributeValue]) -> list[dict[str, Any]]:
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        values.append({"key": key, "value": typed})
+    return values
+
+
+_SPAN_EXPORTER: SpanExporter | None = None
+
+
+def get_span_exporter() -> SpanExporter | None:
+    """Return the exporter configured by the API_TRACE_* settings, None if
+    tracing is disabled."""
+    global _SPAN_EXPORTER
+
+    if _SPAN_EXPORTER is None:
+        settings = SettingsContext.get().settings
+        if settings.API_TRACE_EXPORTER == "memory":
+            exporter = RingBufferExporter(settings.API_TRACE_BUFFER_SIZE)
+            register_cache(
+                "traces",
+                lambda: CacheSize(
+                    entries=len(exporter), max_entries=settings.API_TRACE_BUFFER_SIZE
+                ),
+            )
+            _SPAN_EXPORTER = exporter
+        elif settings.API_TRACE_EXPORTER == "otlp-file":
+            _SPAN_EXPORTER = OTLPFileExporter(settings.API_TRACE_FILE)
+    return _SPAN_EXPORTER
+
+
+def set_span_exporter(exporter: SpanExporter | None):
+    """Replace the exporter, e.g. with one shipping traces elsewhere."""
+    global _SPAN_EXPORTER
+
+    _SPAN_EXPORTER = exporter
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ("_span", "_parent", "_context")
+
+    def __init__(self, parent: TraceContext, name: str, attributes: dict):
+        self._parent = parent
+        self._span = Span(
+            name=name,
+            trace_id=parent.trace_id,
+            span_id=_new_id(64),
+            parent_id=parent.span_id,
+            start_ns=time.time_ns(),
+            attributes=attributes,
+        )
+        self._context = TraceContext.unchecked(
+            trace=parent.trace, trace_id=parent.trace_id, span_id=self._span.span_id
+        )
+
+    def __enter__(self) -> Span:
+        self._context.__enter__()
+        return self._span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._context.__exit__(exc_type, exc_val, exc_tb)
+        self._span.end_ns = time.time_ns()
+        if exc_type is not None:
+            self._span.error = exc_type.__name__
+        self._parent.trace.record(self._span)
+
+
+def span(name: str, **attributes: AttributeValue) -> _ActiveSpan | _NoSpan:
+    """Trace the block as a child of the current span.
+
+    Outside of sampled traces this costs a context variable lookup, the
+    block runs with None instead of a span."""
+    parent = _TRACE_CONTEXT.get(None)
+    if parent is None:
+        return _NO_SPAN
+    return _ActiveSpan(parent, name, attributes)
+
+
+def record_span(
+    name: str, start_ns: int, end_ns: int, **attributes: AttributeValue
+) -> Span | None:
+    """Record a finished child of the current span, for work measured by
+    hooks instead of a block, e.g. database statements."""
+    parent = _TRACE_CONTEXT.get(None)
+    if parent is None:
+        return None
+    recorded = Span(
+        name=name,
+        trace_id=parent.trace_id,
+        span_id=_new_id(64),
+        parent_id=parent.span_id,
+        start_ns=start_ns,
+        end_ns=end_ns,
+        attributes=attributes,
+    )
+    parent.trace.record(recorded)
+    return recorded
+
+
+class RootSpan:
+    """The span of a whole request, its trace is exported when it ends."""
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        name: str,
+        *,
+        trace_id: str | None = None,
+        parent_id: str | None = None,
+    ):
+        self._exporter = exporter
+        self._trace = _Trace()
+        self.span = Span(
+            name=name,
+            trace_id=trace_id or _new_id(128),
+            span_id=_new_id(64),
+            parent_id=parent_id,
+            start_ns=time.time_ns(),
+        )
+        self._context = TraceContext.unchecked(
+            trace=self._trace, trace_id=self.span.trace_id, span_id=self.span.span_id
+        )
+
+    def __enter__(self) -> Span:
+        self._context.__enter__()
+        return self.span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._context.__exit__(exc_type, exc_val, exc_tb)
+        self.span.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        if self._trace.dropped:
+            self.span.attributes["spans.dropped"] = self._trace.dropped
+
+        _TRACES_SAMPLED.inc()
+        try:
+            self._exporter.export([self.span, *self._trace.spans])
+        except Exception:
+            logger.error("Failed to export trace:", exc_info=True)
+
+
+def start_trace(
+    exporter: SpanExporter,
+    name: str,
+    *,
+    sample_rate: float,
+    traceparent: str | None = None,
+) -> RootSpan | None:
+    """Start the trace of a request, None if it is not sampled.
+
+    A W3C traceparent header continues the caller's trace and follows its
+    sampling decision, without one `sample_rate` of requests are traced."""
+    if traceparent is not None:
+        match = _TRACEPARENT.match(traceparent)
+        if match is not None:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+            return RootSpan(exporter, name, trace_id=trace_id, parent_id=parent_id)
+
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    return RootSpan(exporter, name)
@@ -1,3 +1,4 @@
+import datetime
 import uuid
 from typing import Protocol
 
@@ -12,6 +13,14 @@ class User(EntityModel):
     identity_provider_id: str
 
 
+class UserExport(User):
+    last_login_at: datetime.datetime | None = None
+    login_count: int = 0
+
+    active_sessions: int | None = None
+    "The number of active refresh tokens, if requested."
+
+
 class UserCreate(ActionModel):
     email: EmailStr
     identity_provider: str
@@ -22,3 +31,5 @@ class UserStore(Protocol):
     async def create_user(
         self, create: UserCreate, *, exists_ok: bool = False
     ) -> uuid.UUID: ...
+
+    async def read_user_email(self, user_id: uuid.UUID) -> str | None: ...
@@ -0,0 +1,74 @@
+import json
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+
+from pyservice.api.server import app
+from pyservice.auth.token import sign_access_token
+from pyservice.context import temporary_settings
+
+INTERNAL_KEY = "internal-key"
+
+
+@pytest.fixture
+def client():
+    with temporary_settings(
+        updates={
+            "JWT_KEY": SecretStr("test-key-with-at-least-32-bytes!"),
+            "JWT_ISSUER_ID": "https://pyservice-test/",
+            "JWT_AUDIENCE": ["ios", "android"],
+            "API_INTERNAL_KEY": SecretStr(INTERNAL_KEY),
+            "API_INTROSPECT_MAX_TOKENS": 3,
+        }
+    ):
+        yield TestClient(app)
+
+
+def introspect(client: TestClient, tokens: list[str], key: str = INTERNAL_KEY):
+    return client.post(
+        "/auth/introspect",
+        json={"tokens": tokens},
+        headers={"Authorization": f"Bearer {key}"},
+    )
+
+
+def test_introspect_requires_internal_caller(client: TestClient):
+    assert introspect(client, [], key="other-key").status_code == 401
+    assert client.post("/auth/introspect", json={"tokens": []}).status_code == 401
+
+
+def test_introspect_mixed_tokens_in_order(client: TestClient):
+    sub = uuid.uuid4()
+    token, _ = sign_access_token(sub=sub, email="test@test.io")
+
+    response = introspect(client, [token, "bad.jwt.token", token])
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["index"], line["active"]) for line in lines] == [
+        (0, True),
+        (1, False),
+        (2, True),
+    ]
+    assert lines[0]["claims"]["sub"] == str(sub)
+    assert lines[1]["claims"] is None
+
+
+def test_introspect_limits_tokens(client: TestClient):
+    assert introspect(client, ["a"] * 4).status_code == 422
+
+
+def test_introspect_token_errors_mark_token_inactive(client: TestClient, monkeypatch):
+    token, _ = sign_access_token(sub=uuid.uuid4(), email="test@test.io")
+
+    def verify_token(token, *, config=None):
+        raise KeyError("aud")
+
+    monkeypatch.setattr("pyservice.api.routers.auth.verify_token", verify_token)
+    response = introspect(client, [token])
+
+    assert response.status_code == 200
+    assert json.loads(response.text) == {"index": 0, "active": False, "claims": None}
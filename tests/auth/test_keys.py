@@ -0,0 +1,132 @@
+import json
+import uuid
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from pydantic import SecretStr
+
+from pyservice.auth.keys import Keyring, KeyringFile
+from pyservice.auth.token import sign_access_token, verify_token
+from pyservice.context import JWTKeyringSettings, JWTKeySettings, temporary_settings
+from pyservice.exc import AuthInvalidTokenError
+
+JWT_SETTINGS = {
+    "JWT_ISSUER_ID": "https://pyservice-test/",
+    "JWT_AUDIENCE": ["ios", "android"],
+}
+
+
+def keyring(active_kid: str, *kids: str):
+    return JWTKeyringSettings(
+        active_kid=active_kid,
+        keys=[JWTKeySettings(kid=kid, key=SecretStr(f"key-{kid}")) for kid in kids],
+    )
+
+
+def dump(settings: JWTKeyringSettings):
+    return json.dumps(
+        {
+            "active_kid": settings.active_kid,
+            "keys": [
+                {"kid": key.kid, "key": key.key.get_secret_value()}
+                for key in settings.keys
+            ],
+        }
+    )
+
+
+def sign(**updates):
+    with temporary_settings(updates={**JWT_SETTINGS, **updates}):
+        token, _ = sign_access_token(sub=uuid.uuid4(), email="test@test.io")
+    return token
+
+
+def verify(token, **updates):
+    with temporary_settings(updates={**JWT_SETTINGS, **updates}):
+        return verify_token(token)
+
+
+def test_issued_tokens_carry_kid():
+    token = sign(JWT_KEYRING=keyring("one", "one"))
+    assert jwt.get_unverified_header(token)["kid"] == "one"
+
+
+def test_rotated_key_keeps_verifying():
+    token = sign(JWT_KEYRING=keyring("one", "one"))
+    rotated = keyring("two", "one", "two")
+
+    assert verify(token, JWT_KEYRING=rotated).email == "test@test.io"
+    assert jwt.get_unverified_header(sign(JWT_KEYRING=rotated))["kid"] == "two"
+
+    with pytest.raises(AuthInvalidTokenError):
+        verify(token, JWT_KEYRING=keyring("two", "two"))
+
+
+def test_legacy_key_verifies_tokens_without_kid():
+    token = sign(JWT_KEY=SecretStr("legacy"))
+    assert "kid" not in jwt.get_unverified_header(token)
+
+    updates = {"JWT_KEY": SecretStr("legacy"), "JWT_KEYRING": keyring("one", "one")}
+    assert verify(token, **updates).email == "test@test.io"
+
+    with pytest.raises(AuthInvalidTokenError):
+        verify(token, JWT_KEYRING=keyring("one", "one"))
+
+
+def test_keyring_file_reloads(tmp_path):
+    path = tmp_path / "keyring.json"
+    path.write_text(dump(keyring("one", "one")))
+
+    keyring_file = KeyringFile(path, reload_interval=3600)
+    assert keyring_file.get().active.kid == "one"
+
+    path.write_text(dump(keyring("two", "one", "two")))
+    assert keyring_file.get().active.kid == "one"
+
+    keyring_file.reload(force=True)
+    assert keyring_file.get().active.kid == "two"
+
+    path.write_text("not a keyring")
+    keyring_file.reload(force=True)
+    assert keyring_file.get().active.kid == "two"
+
+
+@pytest.mark.parametrize("algorithm", ["EdDSA", "ES256"])
+def test_asymmetric_keys_verify_through_jwks(algorithm):
+    if algorithm == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+
+    settings = JWTKeyringSettings(
+        active_kid="asym",
+        keys=[
+            JWTKeySettings(
+                kid="asym", key=SecretStr(pem.decode()), algorithm=algorithm
+            ),
+            JWTKeySettings(kid="sym", key=SecretStr("secret")),
+        ],
+    )
+    token = sign(JWT_KEYRING=settings)
+    assert verify(token, JWT_KEYRING=settings).email == "test@test.io"
+
+    jwks = Keyring.from_settings(settings).jwks
+    assert [key["kid"] for key in jwks["keys"]] == ["asym"]
+
+    # Other services verify with nothing but the published JWKS.
+    jwk = jwt.PyJWKSet.from_dict(jwks)["asym"]
+    claims = jwt.decode(
+        token,
+        jwk.key,
+        algorithms=[algorithm],
+        audience="ios",
+        issuer="https://pyservice-test/",
+    )
+    assert claims["email"] == "test@test.io"
@@ -0,0 +1,51 @@
+import pytest
+import requests
+from pydantic import HttpUrl
+
+from pyservice.auth.oidc import AppleProvider, GoogleProvider
+from pyservice.context import temporary_settings
+from pyservice.exc import AuthInvalidTokenError
+from pyservice.perf.stub_oidc import StubOIDC
+
+
+@pytest.fixture
+def stub():
+    with StubOIDC() as stub:
+        with temporary_settings(
+            updates={
+                "OIDC_APPLE_CLIENT_ID": "apple-client",
+                "OIDC_APPLE_KEYS_URL": HttpUrl(stub.keys_url("apple")),
+                "OIDC_GOOGLE_CLIENT_ID": "google-client",
+                "OIDC_GOOGLE_CERTS_URL": HttpUrl(stub.keys_url("google")),
+            }
+        ):
+            yield stub
+
+
+@pytest.mark.asyncio
+async def test_providers_accept_stub_tokens(stub: StubOIDC):
+    apple = await AppleProvider().verify_id_token(
+        stub.id_token("apple", "apple-user", "apple-client")
+    )
+    assert apple.sub == "apple-user"
+
+    google = await GoogleProvider().verify_id_token(
+        stub.id_token("google", "google-user", "google-client")
+    )
+    assert google.sub == "google-user"
+
+
+@pytest.mark.asyncio
+async def test_provider_rejects_other_audience(stub: StubOIDC):
+    with pytest.raises(AuthInvalidTokenError):
+        await AppleProvider().verify_id_token(
+            stub.id_token("apple", "apple-user", "other-client")
+        )
+
+
+def test_stub_serves_google_certificates(stub: StubOIDC):
+    # Google publishes x509 certificates, which google-auth verifies with
+    # the certificates fetched through the cached session.
+    certs = requests.get(stub.keys_url("google")).json()
+    assert list(certs) == [stub.kid]
+    assert certs[stub.kid].startswith("-----BEGIN CERTIFICATE-----")
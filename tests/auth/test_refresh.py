@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from pyservice.auth.refresh import RefreshCoalescer
+from pyservice.auth.token import TokenResult
+from pyservice.exc import AuthTokenHashVerifyError
+
+pytestmark = pytest.mark.asyncio
+
+
+class Rotator:
+    def __init__(self, error: Exception | None = None):
+        self.calls = 0
+        self.error = error
+
+    async def __call__(self) -> TokenResult:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return TokenResult(
+            access_token=f"access-{self.calls}",
+            expires_in=3600,
+            refresh_token=f"refresh-{self.calls}",
+        )
+
+
+def refresh(coalescer: RefreshCoalescer, rotate: Rotator, **kwargs):
+    options = {"grace": 10.0, "max_reuses": 3, "max_entries": 100, **kwargs}
+    return coalescer.refresh("token", rotate, **options)
+
+
+async def test_concurrent_refreshes_rotate_once():
+    coalescer, rotate = RefreshCoalescer(), Rotator()
+
+    results = await asyncio.gather(*(refresh(coalescer, rotate) for _ in range(5)))
+
+    assert rotate.calls == 1
+    assert {result.refresh_token for result in results} == {"refresh-1"}
+
+
+async def test_grace_window_reuse_is_bounded():
+    coalescer, rotate = RefreshCoalescer(), Rotator()
+
+    for _ in range(4):
+        result = await refresh(coalescer, rotate, max_reuses=3)
+        assert result.refresh_token == "refresh-1"
+
+    result = await refresh(coalescer, rotate, max_reuses=3)
+    assert result.refresh_token == "refresh-2"
+
+
+async def test_grace_window_disabled():
+    coalescer, rotate = RefreshCoalescer(), Rotator()
+
+    await refresh(coalescer, rotate, grace=0)
+    await refresh(coalescer, rotate, grace=0)
+
+    assert rotate.calls == 2
+    assert len(coalescer) == 0
+
+
+async def test_followers_receive_leader_error():
+    coalescer = RefreshCoalescer()
+    rotate = Rotator(error=AuthTokenHashVerifyError("mismatch"))
+
+    results = await asyncio.gather(
+        *(refresh(coalescer, rotate) for _ in range(3)), return_exceptions=True
+    )
+
+    assert rotate.calls == 1
+    assert all(isinstance(result, AuthTokenHashVerifyError) for result in results)
+    assert len(coalescer) == 0
+
+
+async def test_reuse_waits_for_commit():
+    coalescer, rotate = RefreshCoalescer(), Rotator()
+    callbacks = []
+
+    await refresh(coalescer, rotate, after_commit=callbacks.append)
+    # Not committed yet, or rolled back: the token is rotated again.
+    result = await refresh(coalescer, rotate, after_commit=callbacks.append)
+    assert result.refresh_token == "refresh-2"
+    assert len(coalescer) == 0
+
+    callbacks[-1]()
+    result = await refresh(coalescer, rotate)
+    assert result.refresh_token == "refresh-2"
@@ -1,11 +1,19 @@
 import uuid
 
+import jwt
 import pendulum
 import pytest
 from pendulum.duration import Duration
 from pydantic import HttpUrl, SecretStr, ValidationError
 
-from pyservice.auth.token import Token, sign_access_token, verify_token
+from pyservice.auth.revocation import RevokedTokens, get_revoked_tokens
+from pyservice.auth.token import (
+    Token,
+    TrustedClaims,
+    get_token_config,
+    sign_access_token,
+    verify_token,
+)
 from pyservice.context import Settings, temporary_settings
 from pyservice.exc import AuthInvalidTokenError
 
@@ -59,6 +67,139 @@ def test_sign_verify_token(settings, user_id):
     assert (claims.exp - claims.iat) == expires_in
 
 
+def test_trusted_claims_match_token(settings, user_id):
+    sub, email = user_id
+
+    token, _ = sign_access_token(sub=sub, email=email)
+    claims = verify_token(token)
+    assert isinstance(claims, TrustedClaims)
+    assert claims.intended_for("ios")
+    assert not claims.expired
+
+    validated = Token.model_validate(claims.as_dict())
+    assert validated.model_dump(mode="json") == claims.as_dict()
+
+
+def test_verify_token_missing_claim(settings, user_id):
+    config = get_token_config()
+    now = pendulum.now("UTC").int_timestamp
+    token = jwt.encode(
+        {
+            "sub": str(user_id[0]),
+            "iss": config.issuer,
+            "aud": list(config.audience or ()),
+            "exp": now + 60,
+        },
+        "test-key",
+    )
+
+    with pytest.raises(AuthInvalidTokenError):
+        verify_token(token)
+
+
+@pytest.fixture
+def compact_settings(settings):
+    with temporary_settings(
+        updates={"JWT_CLAIM_PROFILE": "compact", "JWT_COMPACT_ISSUER": "pys"}
+    ) as ctx:
+        yield ctx.settings
+
+
+def test_sign_verify_compact_token(compact_settings, user_id):
+    sub, _ = user_id
+
+    token, expires_in = sign_access_token(sub=sub)
+    claims = verify_token(token)
+
+    payload = jwt.decode(token, options={"verify_signature": False})
+    assert "email" not in payload
+    assert len(payload["sub"]) == 22
+    assert payload["iss"] == "pys"
+
+    assert claims.sub == str(sub)
+    assert claims.email is None
+    assert claims.intended_for("android")
+    assert (claims.exp - claims.iat) == expires_in
+
+
+def test_sign_verify_session_id(settings, user_id):
+    sub, email = user_id
+    session_id = uuid.uuid4()
+
+    token, _ = sign_access_token(sub=sub, email=email, session_id=session_id)
+    assert verify_token(token).sid == str(session_id)
+    assert verify_token(token).as_dict()["sid"] == str(session_id)
+
+    with temporary_settings(updates={"JWT_CLAIM_PROFILE": "compact"}):
+        token, _ = sign_access_token(sub=sub, session_id=session_id)
+        assert verify_token(token).sid == str(session_id)
+
+    token, _ = sign_access_token(sub=sub, email=email)
+    assert verify_token(token).sid is None
+
+
+def test_compact_token_is_smaller(settings, user_id):
+    sub, email = user_id
+    full_token, _ = sign_access_token(sub=sub, email=email)
+
+    with temporary_settings(updates={"JWT_CLAIM_PROFILE": "compact"}):
+        compact_token, _ = sign_access_token(sub=sub, email=email)
+
+    assert len(compact_token) < len(full_token) - 50
+
+
+def test_full_token_requires_email(settings, user_id):
+    with pytest.raises(AuthInvalidTokenError):
+        sign_access_token(sub=user_id[0])
+
+
+def test_verify_tokens_across_profiles(settings, user_id):
+    sub, email = user_id
+    full_token, _ = sign_access_token(sub=sub, email=email)
+
+    with temporary_settings(
+        updates={"JWT_CLAIM_PROFILE": "compact", "JWT_COMPACT_ISSUER": "pys"}
+    ):
+        compact_token, _ = sign_access_token(sub=sub)
+        assert verify_token(full_token).email == email
+
+    with temporary_settings(updates={"JWT_COMPACT_ISSUER": "pys"}):
+        assert verify_token(compact_token).sub == str(sub)
+
+    # Compact issuers are only accepted while configured.
+    with pytest.raises(AuthInvalidTokenError):
+        verify_token(compact_token)
+
+
+def test_verify_revoked_token(settings, user_id):
+    sub, email = user_id
+
+    token, _ = sign_access_token(sub=sub, email=email)
+    claims = verify_token(token)
+    assert claims.jti is not None
+
+    revoked_tokens = get_revoked_tokens()
+    revoked_tokens.add(claims.jti, claims.exp)
+    try:
+        with pytest.raises(AuthInvalidTokenError):
+            verify_token(token)
+    finally:
+        revoked_tokens.replace([])
+
+
+def test_token_config_cached_per_settings(settings):
+    config = get_token_config()
+
+    assert get_token_config() is config
+    assert config.keyring.active.signing_key == b"test-key"
+    assert config.audience == ("ios", "android")
+
+    with temporary_settings(updates={"JWT_KEY": SecretStr("other-key")}):
+        assert get_token_config().keyring.active.signing_key == b"other-key"
+
+    assert get_token_config() is config
+
+
 def test_init_token_with_exp_before_iat(user_id):
     sub, email = user_id
     with pytest.raises(ValidationError):
@@ -83,3 +224,17 @@ def test_init_token_with_insecure_iss(user_id):
             aud=[],
             iss=HttpUrl("http://some-issuer"),
         )
+
+
+def test_revoked_tokens_replace_per_source():
+    revoked = RevokedTokens()
+    exp = 2**40
+
+    revoked.replace([("a", exp)], source="shard-1")
+    revoked.replace([("b", exp)], source="shard-2")
+    revoked.add("c", exp, source="shard-2")
+    assert "a" in revoked and "b" in revoked and "c" in revoked
+
+    revoked.replace([], source="shard-2")
+    assert "a" in revoked
+    assert "b" not in revoked and "c" not in revoked
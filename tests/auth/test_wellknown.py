@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+from pydantic_extra_types.pendulum_dt import Duration
+
+from pyservice.api.server import app
+from pyservice.context import temporary_settings
+
+
+@pytest.fixture
+def client():
+    with temporary_settings(
+        updates={
+            "JWT_KEY": SecretStr("test-key-with-at-least-32-bytes!"),
+            "JWT_ISSUER_ID": "https://pyservice-test/",
+            "JWT_AUDIENCE": ["ios", "android"],
+            "JWT_JWKS_MAX_AGE": Duration(minutes=2),
+        }
+    ):
+        yield TestClient(app)
+
+
+def test_jwks_is_cacheable(client: TestClient):
+    response = client.get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["cache-control"] == "public, max-age=120"
+    # Symmetric keys are never published.
+    assert response.json() == {"keys": []}
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+
+    assert client.get("/.well-known/jwks.json").headers["etag"] == etag
+
+
+def test_jwks_not_modified(client: TestClient):
+    etag = client.get("/.well-known/jwks.json").headers["etag"]
+
+    response = client.get("/.well-known/jwks.json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert response.headers["cache-control"] == "public, max-age=120"
+
+    response = client.get("/.well-known/jwks.json", headers={"If-None-Match": '"x"'})
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
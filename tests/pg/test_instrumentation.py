@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from pyservice.metrics import Histogram, Metric
+from pyservice.pg.context import get_database_url
+from pyservice.pg.instrumentation import StatementInstrumentation
+
+
+def test_fingerprint_ignores_literals_and_parameters():
+    instrumentation = StatementInstrumentation(slow_threshold=1.0, log_interval=60.0)
+
+    a = instrumentation.fingerprint(
+        "SELECT * FROM users WHERE id IN ($1, $2) AND name = 'a'"
+    )
+    b = instrumentation.fingerprint(
+        "SELECT *\n  FROM users WHERE id IN ($1, $2, $3) AND name = 'it''s'"
+    )
+    c = instrumentation.fingerprint("SELECT * FROM users WHERE email = $1")
+
+    assert a == b
+    assert a != c
+
+
+@pytest.mark.asyncio
+@pytest.mark.integration
+async def test_failing_explain_keeps_the_transaction():
+    engine = create_async_engine(get_database_url())
+    StatementInstrumentation(
+        slow_threshold=60.0, log_interval=60.0, explain_threshold=0.0
+    ).attach(engine)
+
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TEMP SEQUENCE explain_once MAXVALUE 1"))
+            # Explaining executes nextval again, past the maximum.
+            result = await conn.execute(text("SELECT nextval('explain_once')"))
+            assert result.scalar_one() == 1
+            assert (await conn.execute(text("SELECT 1"))).scalar_one() == 1
+    finally:
+        await engine.dispose()
+
+
+def test_metric_requires_samples():
+    with pytest.raises(TypeError):
+        Metric("test", "Test.")  # type: ignore[abstract]
+
+
+def test_histogram_render():
+    metric = Histogram("test_seconds", "Test.", labelnames=("route",), buckets=(1, 2))
+    metric.observe(0.5, "/a")
+    metric.observe(1.5, "/a")
+    metric.observe(3, "/a")
+
+    assert metric.count("/a") == 3
+    assert metric.render().splitlines()[2:] == [
+        'test_seconds_bucket{route="/a",le="1"} 1.0',
+        'test_seconds_bucket{route="/a",le="2"} 2.0',
+        'test_seconds_bucket{route="/a",le="+Inf"} 3.0',
+        'test_seconds_count{route="/a"} 3.0',
+        'test_seconds_sum{route="/a"} 5.0',
+    ]
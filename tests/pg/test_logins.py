@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from pyservice.logins import LoginUpdate
+from pyservice.pg.context import PRIMARY, get_database_url
+from pyservice.pg.logins import LastLoginWriter
+from pyservice.pg.models import Base, PGUser
+from pyservice.pg.store import Store
+from pyservice.user import UserCreate
+
+pytestmark = [pytest.mark.asyncio, pytest.mark.integration]
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = create_async_engine(get_database_url())
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    async with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            await conn.execute(table.delete())
+    await engine.dispose()
+
+
+def at(minute: int) -> datetime.datetime:
+    return datetime.datetime(2026, 1, 1, 12, minute, tzinfo=datetime.UTC)
+
+
+async def create_user(engine, identity_provider_id: str):
+    async with engine.begin() as conn:
+        session = AsyncSession(bind=conn)
+        return await Store(session).create_user(
+            UserCreate(
+                email=f"user{identity_provider_id}@test.io",
+                identity_provider="apple",
+                identity_provider_id=identity_provider_id,
+            )
+        )
+
+
+async def login_count(engine, user_id) -> int:
+    async with engine.connect() as conn:
+        stmt = select(PGUser.login_count).where(PGUser.id == user_id)
+        return (await conn.execute(stmt)).scalar_one()
+
+
+async def test_last_login_writer(engine):
+    user_id = await create_user(engine, "1")
+
+    writer = LastLoginWriter({PRIMARY: engine})
+    await writer({user_id: LoginUpdate(last_login_at=at(2), logins=2)})
+    # A late batch of another worker doesn't move the last login back.
+    await writer({user_id: LoginUpdate(last_login_at=at(1), logins=1)})
+
+    async with engine.connect() as conn:
+        row = (
+            await conn.execute(
+                select(PGUser.last_login_at, PGUser.login_count).where(
+                    PGUser.id == user_id
+                )
+            )
+        ).one()
+    assert row == (at(2).replace(tzinfo=None), 3)
+
+
+async def test_last_login_writer_keeps_unwritten_batches(engine, monkeypatch):
+    first_id, second_id = sorted([await create_user(engine, str(i)) for i in (1, 2)])
+    monkeypatch.setattr("pyservice.pg.logins._BATCH_SIZE", 1)
+
+    updates = 0
+
+    def fail_second_update(conn, cursor, statement, *args):
+        nonlocal updates
+        if statement.startswith("UPDATE"):
+            updates += 1
+            if updates == 2:
+                raise RuntimeError("database unavailable")
+
+    event.listen(engine.sync_engine, "before_cursor_execute", fail_second_update)
+    pending = {
+        user_id: LoginUpdate(last_login_at=at(1), logins=1)
+        for user_id in (first_id, second_id)
+    }
+    with pytest.raises(RuntimeError):
+        await LastLoginWriter({PRIMARY: engine})(pending)
+
+    # The committed batch is gone, a retry doesn't count the login twice.
+    assert list(pending) == [second_id]
+    assert await login_count(engine, first_id) == 1
+    assert await login_count(engine, second_id) == 0
@@ -0,0 +1,28 @@
+import io
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from pyservice.pg.migration import create_index_concurrently
+
+
+def test_create_index_concurrently_leaves_transaction():
+    buffer = io.StringIO()
+    migration_context = MigrationContext.configure(
+        dialect_name="postgresql",
+        opts={"as_sql": True, "output_buffer": buffer},
+    )
+
+    with Operations.context(migration_context):
+        create_index_concurrently("ix_users_email", "users", ["email"])
+
+    statements = [line for line in buffer.getvalue().splitlines() if line.strip()]
+    assert statements == [
+        "COMMIT;",
+        "SET lock_timeout = 3000;",
+        "SET statement_timeout = 0;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email ON users (email);",
+        "SET lock_timeout = 3000;",
+        "SET statement_timeout = 600000;",
+        "BEGIN;",
+    ]
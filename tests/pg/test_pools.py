@@ -0,0 +1,42 @@
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.testclient import TestClient
+
+from pyservice.api.dependencies import route_pool
+from pyservice.metrics import REGISTRY
+from pyservice.pg.context import POOL_ADMIN, POOL_AUTH, DatabaseContext
+
+
+def _pool_of(router: APIRouter) -> str | None:
+    @router.get("/pool")
+    def pool(request: Request):
+        return route_pool(DatabaseContext.get(), request)
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app).get(f"{router.prefix}/pool").json()
+
+
+def test_pools_are_sized_by_settings():
+    ctx = DatabaseContext.get()
+
+    assert ctx.pool(POOL_AUTH) is not ctx.engine
+    assert ctx.pool(POOL_AUTH).pool.size() == 10  # type: ignore[attr-defined]
+    assert ctx.pool(POOL_AUTH).pool.timeout() == 2  # type: ignore[attr-defined]
+    assert ctx.pool("unknown") is ctx.engine
+    assert ctx.pool(None) is ctx.engine
+
+
+def test_routes_select_pools_by_tag():
+    assert _pool_of(APIRouter(prefix="/admin", tags=["docs", "admin"])) == POOL_ADMIN
+    assert _pool_of(APIRouter(prefix="/other", tags=["docs"])) is None
+    assert route_pool(DatabaseContext.get(), Request({"type": "http"})) is None
+
+
+def test_pool_saturation_metrics():
+    rendered = REGISTRY.render()
+
+    assert 'pyservice_db_pool_connections{pool="auth",state="checked_out"} 0' in (
+        rendered
+    )
+    assert 'pyservice_db_pool_capacity{pool="auth"} 15' in rendered
+    assert 'pyservice_db_pool_capacity{pool="background"} 3' in rendered
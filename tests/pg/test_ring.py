@@ -0,0 +1,31 @@
+import uuid
+from collections import Counter
+
+from pyservice.pg.ring import HashRing
+
+
+def test_hash_ring_spreads_users():
+    ring = HashRing(["a", "b", "c"])
+    user_ids = [uuid.uuid4() for _ in range(3000)]
+
+    counts = Counter(ring.shard_for(user_id) for user_id in user_ids)
+    assert set(counts) == {"a", "b", "c"}
+    assert all(700 < count < 1300 for count in counts.values())
+
+    assert [ring.shard_for(user_id) for user_id in user_ids] == [
+        HashRing(["c", "b", "a"]).shard_for(user_id) for user_id in user_ids
+    ]
+
+
+def test_hash_ring_adding_a_shard_moves_few_users():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    user_ids = [uuid.uuid4() for _ in range(3000)]
+
+    moved = [
+        (before.shard_for(user_id), after.shard_for(user_id))
+        for user_id in user_ids
+        if before.shard_for(user_id) != after.shard_for(user_id)
+    ]
+    assert all(target == "d" for _, target in moved)
+    assert 500 < len(moved) < 1000
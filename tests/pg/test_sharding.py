@@ -0,0 +1,175 @@
+import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from pyservice.logins import LoginUpdate
+from pyservice.pg.context import DatabaseContext, get_database_url
+from pyservice.pg.logins import LastLoginWriter
+from pyservice.pg.models import Base, PGRefreshToken, PGUser, PGUserShard
+from pyservice.pg.ring import HashRing
+from pyservice.pg.sharding import (
+    ShardedStore,
+    move_users,
+    rebalance,
+    sharded_user_id,
+    sync_directory,
+)
+from pyservice.pg.utils import UserIdentity
+from pyservice.user import UserCreate
+
+pytestmark = [pytest.mark.asyncio, pytest.mark.integration]
+
+# Created by docker/postgres-init next to the primary database.
+SHARDS = ["pyservice_shard_1", "pyservice_shard_2"]
+
+
+@pytest_asyncio.fixture
+async def ctx():
+    database_url = make_url(get_database_url())
+    engine = create_async_engine(database_url)
+    shards = {
+        name: create_async_engine(database_url.set(database=name)) for name in SHARDS
+    }
+
+    for each in (engine, *shards.values()):
+        async with each.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    with DatabaseContext(engine=engine, shards=shards, ring=HashRing(shards)) as ctx:
+        yield ctx
+
+    for each in (engine, *shards.values()):
+        async with each.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                await conn.execute(table.delete())
+        await each.dispose()
+
+
+async def create_user(
+    ctx: DatabaseContext, identity_provider_id: str, email: str | None = None
+):
+    create = UserCreate(
+        email=email or f"user{identity_provider_id}@test.io",
+        identity_provider="apple",
+        identity_provider_id=identity_provider_id,
+    )
+    async with ctx.session() as directory, directory.begin():
+        async with ShardedStore(ctx, directory) as store:
+            user_id = await store.create_user(create, exists_ok=True)
+            await store.rotate_refresh_token(user_id)
+    return user_id
+
+
+async def user_shard(ctx: DatabaseContext, user_id) -> str:
+    async with ctx.session() as session, session.begin():
+        stmt = select(PGUserShard.shard).where(PGUserShard.user_id == user_id)
+        return (await session.execute(stmt)).scalar_one()
+
+
+async def count_rows(ctx: DatabaseContext, shard: str, model, column, user_id) -> int:
+    async with ctx.shard_session(shard) as session, session.begin():
+        stmt = select(model).where(column == user_id)
+        return len((await session.execute(stmt)).all())
+
+
+async def test_sharded_store_places_users(ctx: DatabaseContext):
+    user_id = await create_user(ctx, "1")
+    assert user_id == sharded_user_id(UserIdentity(provider="apple", id="1"))
+    assert await create_user(ctx, "1") == user_id
+
+    shard = await user_shard(ctx, user_id)
+    assert shard == ctx.ring.shard_for(user_id)  # type: ignore[union-attr]
+    assert await count_rows(ctx, shard, PGUser, PGUser.id, user_id) == 1
+
+    async with ctx.session() as directory, directory.begin():
+        async with ShardedStore(ctx, directory) as store:
+            assert await store.read_user_email(user_id) == "user1@test.io"
+
+
+async def test_emails_are_unique_across_shards(ctx: DatabaseContext):
+    assert ctx.ring is not None
+    # The first identity of each shard.
+    ids: dict[str, str] = {}
+    for i in range(8):
+        identity = UserIdentity(provider="apple", id=str(i))
+        ids.setdefault(ctx.ring.shard_for(sharded_user_id(identity)), str(i))
+    first, second = ids.values()
+
+    user_id = await create_user(ctx, first, email="shared@test.io")
+    with pytest.raises(IntegrityError):
+        await create_user(ctx, second, email="shared@test.io")
+
+    # Nothing was written to the shard of the rejected user.
+    user_ids = []
+    for shard in SHARDS:
+        async with ctx.shard_session(shard) as session, session.begin():
+            stmt = select(PGUser.id).where(PGUser.email == "shared@test.io")
+            user_ids += (await session.execute(stmt)).scalars().all()
+    assert user_ids == [user_id]
+
+
+async def test_sync_directory_completes_emails(ctx: DatabaseContext):
+    user_id = await create_user(ctx, "1")
+    async with ctx.session() as session, session.begin():
+        await session.execute(update(PGUserShard).values(email=None))
+
+    assert await sync_directory() == 1
+    assert await sync_directory() == 0
+
+    async with ctx.session() as session, session.begin():
+        stmt = select(PGUserShard.email).where(PGUserShard.user_id == user_id)
+        assert (await session.execute(stmt)).scalar_one() == "user1@test.io"
+
+
+async def test_move_users(ctx: DatabaseContext):
+    user_id = await create_user(ctx, "1")
+    source = await user_shard(ctx, user_id)
+    target = next(shard for shard in SHARDS if shard != source)
+
+    assert await move_users([user_id], source, target) == 1
+    assert await move_users([user_id], source, target) == 0
+
+    assert await user_shard(ctx, user_id) == target
+    assert await count_rows(ctx, source, PGUser, PGUser.id, user_id) == 0
+    assert await count_rows(ctx, target, PGUser, PGUser.id, user_id) == 1
+    assert (
+        await count_rows(ctx, target, PGRefreshToken, PGRefreshToken.user_id, user_id)
+        == 1
+    )
+
+    assert await rebalance(dry_run=True) == 1
+    assert await rebalance() == 1
+    assert await user_shard(ctx, user_id) == source
+
+
+async def test_last_login_writer_writes_to_user_shards(ctx: DatabaseContext):
+    user_ids = [await create_user(ctx, str(i)) for i in range(8)]
+    shards = {user_id: await user_shard(ctx, user_id) for user_id in user_ids}
+    assert set(shards.values()) == set(SHARDS)
+
+    statements: dict[str, int] = dict.fromkeys(SHARDS, 0)
+    for shard, engine in ctx.shards.items():
+        event.listen(
+            engine.sync_engine,
+            "before_cursor_execute",
+            lambda *_, shard=shard: statements.__setitem__(
+                shard, statements[shard] + 1
+            ),
+        )
+
+    at = datetime.datetime(2026, 1, 1, tzinfo=datetime.UTC)
+    writer = LastLoginWriter(ctx.shards, directory=ctx.engine)
+    await writer(
+        {user_id: LoginUpdate(last_login_at=at, logins=1) for user_id in user_ids}
+    )
+
+    assert statements == dict.fromkeys(SHARDS, 1)
+    for user_id, shard in shards.items():
+        async with ctx.shard_session(shard) as session, session.begin():
+            stmt = select(PGUser.login_count).where(PGUser.id == user_id)
+            assert (await session.execute(stmt)).scalar_one() == 1
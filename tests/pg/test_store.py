@@ -1,3 +1,6 @@
+import uuid
+
+import pendulum
 import pytest
 import pytest_asyncio
 from pendulum import Duration
@@ -8,7 +11,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 
 from pyservice.auth.token import RefreshTokenStatus
 from pyservice.context import Settings, temporary_settings
-from pyservice.exc import AuthTokenHashVerifyError
+from pyservice.exc import AuthInvalidTokenError, AuthTokenHashVerifyError
 from pyservice.pg.context import DatabaseContext, get_database_url
 from pyservice.pg.models import PGRefreshToken
 from pyservice.pg.store import Store
@@ -127,3 +130,128 @@ async def test_rotate_refresh_token_verification(
 
     with pytest.raises(AuthTokenHashVerifyError):
         _ = await store.rotate_refresh_token(user_in_db, token="invalid token")
+
+
+async def test_rotate_refresh_token_per_session(
+    store: Store, jwt_settings: Settings, user_in_db
+):
+    phone, tablet = uuid.uuid4(), uuid.uuid4()
+    phone_token = await store.rotate_refresh_token(user_in_db, session_id=phone)
+    tablet_token = await store.rotate_refresh_token(user_in_db, session_id=tablet)
+
+    # Rotating one session leaves the other active.
+    await store.rotate_refresh_token(user_in_db, token=phone_token, session_id=phone)
+    await store.rotate_refresh_token(user_in_db, token=tablet_token, session_id=tablet)
+
+    result = await store._session.execute(
+        select(PGRefreshToken.session_id).where(
+            (PGRefreshToken.user_id == user_in_db)
+            & (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
+        )
+    )
+    assert set(result.scalars()) == {phone, tablet}
+
+    with pytest.raises(AuthTokenHashVerifyError):
+        await store.rotate_refresh_token(
+            user_in_db, token=tablet_token, session_id=phone
+        )
+
+
+async def test_rotate_refresh_token_evicts_oldest_session(
+    store: Store, jwt_settings: Settings, user_in_db
+):
+    # The fixture runs in one transaction, all tokens share their created_at
+    # and any of the earlier sessions may be the one ended.
+    session_ids = [uuid.uuid4() for _ in range(3)]
+    with temporary_settings(updates={"JWT_MAX_SESSIONS": 2}):
+        tokens = {
+            session_id: await store.rotate_refresh_token(
+                user_in_db, session_id=session_id
+            )
+            for session_id in session_ids
+        }
+
+        result = await store._session.execute(
+            select(PGRefreshToken.session_id).where(
+                (PGRefreshToken.user_id == user_in_db)
+                & (PGRefreshToken.status == RefreshTokenStatus.ACTIVE)
+            )
+        )
+        active = set(result.scalars())
+        assert len(active) == 2
+        assert session_ids[-1] in active
+
+        (ended,) = set(session_ids) - active
+        with pytest.raises(AuthInvalidTokenError):
+            await store.rotate_refresh_token(
+                user_in_db, token=tokens[ended], session_id=ended
+            )
+
+
+async def test_revoke_token(store: Store, jwt_settings: Settings, user_in_db):
+    exp = pendulum.now("UTC").add(hours=1).int_timestamp
+
+    await store.revoke_token(user_in_db, jti="revoked", exp=exp)
+    await store.revoke_token(user_in_db, jti="revoked", exp=exp)
+    await store.revoke_token(user_in_db, jti="expired", exp=exp - 7200)
+
+    assert await store.read_revoked_tokens() == [("revoked", exp)]
+
+
+async def test_stream_users(store: Store, jwt_settings: Settings):
+    user_ids = sorted(
+        [
+            await store.create_user(
+                UserCreate(
+                    email=f"user{i}@test.io",
+                    identity_provider="apple" if i % 2 else "google",
+                    identity_provider_id=str(i),
+                )
+            )
+            for i in range(5)
+        ]
+    )
+    await store.rotate_refresh_token(user_ids[0])
+
+    first_page = [user async for user in store.stream_users(limit=3, yield_per=2)]
+    second_page = [
+        user async for user in store.stream_users(limit=3, after=first_page[-1].id)
+    ]
+    assert [user.id for user in first_page + second_page] == user_ids
+    assert first_page[0].active_sessions is None
+
+    apple = [
+        user
+        async for user in store.stream_users(
+            limit=10, identity_provider="apple", with_sessions=True
+        )
+    ]
+    assert {user.identity_provider_id for user in apple} == {"1", "3"}
+
+    sessions = {}
+    async for user in store.stream_users(limit=10, with_sessions=True):
+        # Counted for every user when asked for.
+        assert user.active_sessions is not None
+        sessions[user.id] = user.active_sessions
+    assert sessions[user_ids[0]] == 1
+    assert sum(sessions.values()) == 1
+
+
+async def test_expire_refresh_tokens(store: Store, jwt_settings: Settings, user_in_db):
+    await store.rotate_refresh_token(user_in_db)
+
+    issued_before = pendulum.now("UTC").add(minutes=1).naive()
+    assert await store.expire_refresh_tokens(issued_before, limit=10) == 1
+    assert await store.expire_refresh_tokens(issued_before, limit=10) == 0
+
+
+async def test_delete_expired_revocations(
+    store: Store, jwt_settings: Settings, user_in_db
+):
+    exp = pendulum.now("UTC").add(hours=1).int_timestamp
+
+    await store.revoke_token(user_in_db, jti="revoked", exp=exp)
+    await store.revoke_token(user_in_db, jti="expired", exp=exp - 7200)
+
+    assert await store.delete_expired_revocations(limit=10) == 1
+    assert await store.read_revoked_tokens() == [("revoked", exp)]
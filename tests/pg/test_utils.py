@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from pyservice.pg.utils import after_commit
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_after_commit_skips_rolled_back_transactions():
+    # Transactions without statements never connect.
+    engine = create_async_engine("postgresql+asyncpg://pyservice@127.0.0.1:1/test")
+    calls = []
+
+    async with AsyncSession(engine) as session:
+        with pytest.raises(RuntimeError):
+            async with session.begin():
+                after_commit(session, lambda: calls.append("rolled back"))
+                raise RuntimeError
+
+        async with session.begin():
+            after_commit(session, lambda: calls.append("committed"))
+        async with session.begin():
+            pass
+
+    assert calls == ["committed"]
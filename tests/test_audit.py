@@ -0,0 +1,54 @@
+import asyncio
+import uuid
+
+import pytest
+
+from pyservice.audit import AuditEvent, AuditEventKind, AuditLog
+
+pytestmark = pytest.mark.asyncio
+
+
+class Sink:
+    def __init__(self):
+        self.batches: list[list[AuditEvent]] = []
+
+    async def __call__(self, events):
+        self.batches.append(list(events))
+
+
+def event(provider: str) -> AuditEvent:
+    return AuditEvent(AuditEventKind.LOGIN, uuid.uuid4(), identity_provider=provider)
+
+
+@pytest.mark.parametrize(
+    ("overflow", "kept"), [("drop_newest", ["0", "1"]), ("drop_oldest", ["1", "2"])]
+)
+async def test_audit_log_overflow(overflow, kept: list[str]):
+    log = AuditLog(max_size=2, batch_size=10, flush_interval=1.0, overflow=overflow)
+    for i in range(3):
+        log.emit(event(str(i)))
+
+    sink = Sink()
+    await log.flush(sink)
+
+    assert [e.identity_provider for e in sink.batches[0]] == kept
+
+
+async def test_audit_log_flushes_full_batches_and_on_cancel():
+    log = AuditLog(
+        max_size=100, batch_size=2, flush_interval=60.0, overflow="drop_oldest"
+    )
+    sink = Sink()
+    task = asyncio.create_task(log.run(sink))
+
+    log.emit(event("0"))
+    log.emit(event("1"))
+    await asyncio.sleep(0.01)
+    assert [len(batch) for batch in sink.batches] == [2]
+
+    log.emit(event("2"))
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert [len(batch) for batch in sink.batches] == [2, 1]
+    assert len(log) == 0
@@ -0,0 +1,94 @@
+import itertools
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from pyservice.api.middleware import TrafficCaptureMiddleware
+from pyservice.perf.capture import TrafficCapture, read_captures
+from pyservice.perf.replay import Replay, summarize
+from pyservice.perf.stub_oidc import StubOIDC
+
+
+def token_app() -> FastAPI:
+    """Issues tokens like the auth routes, refresh tokens are single use."""
+    counter = itertools.count()
+    refresh_tokens: set[str] = set()
+
+    def issue() -> JSONResponse:
+        n = next(counter)
+        refresh_tokens.add(f"refresh-{n}")
+        return JSONResponse(
+            {"access_token": f"access-{n}", "refresh_token": f"refresh-{n}"}
+        )
+
+    async def login(request: Request):
+        return issue()
+
+    async def refresh(request: Request):
+        token = request.headers["authorization"].removeprefix("Bearer ")
+        if token not in refresh_tokens:
+            return JSONResponse({"detail": "Not authenticated"}, status_code=401)
+        refresh_tokens.remove(token)
+        return issue()
+
+    # FastAPI routes put the matched route in the scope, like the service.
+    app = FastAPI()
+    app.add_api_route("/auth/apple", login, methods=["POST"])
+    app.add_api_route("/auth/refresh", refresh, methods=["POST"])
+    return app
+
+
+@pytest.mark.asyncio
+async def test_capture_and_replay(tmp_path: Path):
+    stub = StubOIDC()
+    capture = TrafficCapture(tmp_path, key=b"capture-key")
+    app = TrafficCaptureMiddleware(token_app(), capture=capture)
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        id_token = stub.id_token("apple", "user-1", "client")
+        login = await client.post(
+            "/auth/apple", headers={"Authorization": f"Bearer {id_token}"}
+        )
+        refresh_token = login.json()["refresh_token"]
+        refresh = None
+        for _ in range(2):
+            refresh = await client.post(
+                "/auth/refresh", headers={"Authorization": f"Bearer {refresh_token}"}
+            )
+        assert refresh is not None and refresh.status_code == 401
+    capture.close()
+
+    requests = read_captures([capture.path])
+    assert [(request.route, request.status) for request in requests] == [
+        ("/auth/apple", 200),
+        ("/auth/refresh", 200),
+        ("/auth/refresh", 401),
+    ]
+    login_request, refresh_request, reused_request = requests
+    assert login_request.user is not None
+    assert refresh_request.token == reused_request.token == login_request.issued[1]
+    assert refresh_token not in capture.path.read_bytes().decode("latin-1")
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=token_app()), base_url="http://test"
+    ) as client:
+        replay = Replay(
+            requests,
+            client=client,
+            stub=stub,
+            audiences={"apple": "client"},
+            speed=100.0,
+            internal_key=None,
+        )
+        results = await replay.run()
+
+    assert [result.status for result in results] == [200, 200, 401]
+    summary = summarize(results)
+    assert summary["*"]["requests"] == 3
+    assert summary["*"]["status_mismatches"] == 0
+    assert summary["/auth/refresh"]["errors"] == 0
@@ -0,0 +1,36 @@
+import pytest
+from pydantic import ValidationError
+
+from pyservice.context import Settings, SettingsContext, temporary_settings
+
+
+def test_unchecked_context_model():
+    settings = SettingsContext.get().settings
+    ctx = SettingsContext.unchecked(settings=settings)
+
+    assert ctx == SettingsContext(settings=settings)
+
+    with ctx:
+        assert SettingsContext.get() is ctx
+        with pytest.raises(RuntimeError):
+            ctx.__enter__()
+
+    assert SettingsContext.get() is not ctx
+
+
+def test_temporary_settings_does_not_leak():
+    root = SettingsContext.get()
+
+    with temporary_settings(updates={"LOG_LEVEL": "ERROR"}) as ctx:
+        assert SettingsContext.get() is ctx
+        assert ctx.settings.LOG_LEVEL == "ERROR"
+
+    assert SettingsContext.get() is root
+    assert ctx.settings is not root.settings
+
+
+def test_settings_require_a_session(monkeypatch):
+    monkeypatch.setenv("PYSERVICE_JWT_MAX_SESSIONS", "0")
+
+    with pytest.raises(ValidationError):
+        Settings()
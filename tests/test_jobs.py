@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+import pytest
+
+from pyservice.jobs import Cron, Interval, Job, Scheduler
+
+
+def at(*args: int) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=datetime.UTC)
+
+
+@pytest.mark.parametrize(
+    ("expression", "now", "expected"),
+    [
+        ("*/15 * * * *", at(2026, 1, 1, 10, 7, 30), at(2026, 1, 1, 10, 15)),
+        ("*/15 * * * *", at(2026, 1, 1, 10, 45), at(2026, 1, 1, 11, 0)),
+        ("30 2 * * *", at(2026, 1, 1, 3, 0), at(2026, 1, 2, 2, 30)),
+        ("0 0 1 * *", at(2026, 12, 15), at(2027, 1, 1)),
+        # 2026-01-04 is a Sunday.
+        ("0 9 * * 0", at(2026, 1, 1), at(2026, 1, 4, 9, 0)),
+        ("0 9 * * 1-5", at(2026, 1, 3), at(2026, 1, 5, 9, 0)),
+        # Day of month or day of week, whichever comes first.
+        ("0 0 13 * 5", at(2026, 1, 1), at(2026, 1, 2)),
+        ("0 0 29 2 *", at(2026, 1, 1), at(2028, 2, 29)),
+    ],
+)
+def test_cron_next_run(expression: str, now, expected):
+    assert Cron.parse(expression).next_run(now) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "0 0 0 * *"])
+def test_cron_invalid(expression: str):
+    with pytest.raises(ValueError):
+        Cron.parse(expression)
+
+
+def job(run, **kwargs) -> Job:
+    options = {
+        "name": "test",
+        "schedule": Interval(datetime.timedelta(seconds=1)),
+        "timeout": datetime.timedelta(seconds=1),
+        **kwargs,
+    }
+    return Job(run=run, **options)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_run_once():
+    runs = []
+
+    async def run():
+        runs.append(1)
+
+    async def fail():
+        raise RuntimeError("failed")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    is_leader = False
+    scheduler = Scheduler(is_leader=lambda: is_leader)
+
+    assert await scheduler.run_once(job(run))
+    assert not await scheduler.run_once(job(run, singleton=True))
+    is_leader = True
+    assert await scheduler.run_once(job(run, singleton=True))
+    assert runs == [1, 1]
+
+    assert not await scheduler.run_once(job(fail))
+    assert not await scheduler.run_once(
+        job(hang, timeout=datetime.timedelta(milliseconds=10))
+    )
@@ -0,0 +1,47 @@
+import time
+
+import httpx
+import pytest
+
+from pyservice.perf.load import LoadGenerator, parse_mix, summarize
+from pyservice.perf.stub_oidc import StubOIDC
+from tests.test_capture import token_app
+
+
+def test_parse_mix():
+    assert parse_mix("refresh=4, first_login") == {"refresh": 4.0, "first_login": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("logout=1")
+    with pytest.raises(ValueError):
+        parse_mix("refresh=0")
+
+
+@pytest.mark.asyncio
+async def test_load_generator():
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=token_app()), base_url="http://test"
+    ) as client:
+        generator = LoadGenerator(
+            client=client,
+            stub=StubOIDC(),
+            audiences={"apple": "client"},
+            mix=parse_mix("first_login=1,returning_login=1,refresh=2"),
+        )
+        await generator.prepare(users=5, sessions=5)
+
+        start = time.perf_counter()
+        samples = await generator.run(200, 0.25)
+
+    assert 45 <= len(samples) <= 55
+    assert {sample.scenario for sample in samples} == {
+        "first_login",
+        "returning_login",
+        "refresh",
+    }
+    assert all(sample.status == 200 for sample in samples)
+    assert all(sample.corrected >= sample.latency for sample in samples)
+
+    summary = summarize(samples, rate=200, start=start, slo=1.0)
+    assert summary["scenarios"]["*"]["requests"] == len(samples)
+    assert summary["scenarios"]["*"]["errors"] == 0
+    assert summary["sustained"] == (summary["scenarios"]["*"]["throughput_rps"] >= 190)
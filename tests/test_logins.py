@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import uuid
+
+import pytest
+
+from pyservice.logins import LoginTracker, LoginUpdate
+
+pytestmark = pytest.mark.asyncio
+
+
+class Sink:
+    def __init__(self, fail: bool = False, fail_after: int | None = None):
+        self.fail = fail
+        self.fail_after = fail_after
+        "Fail after committing this many batches of one user each, if set."
+        self.batches: list[dict[uuid.UUID, LoginUpdate]] = []
+
+    async def __call__(self, updates):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        if self.fail_after is None:
+            self.batches.append(dict(updates))
+            return
+        for user_id in sorted(updates):
+            if len(self.batches) == self.fail_after:
+                raise RuntimeError("database unavailable")
+            self.batches.append({user_id: updates.pop(user_id)})
+
+
+def at(minute: int) -> datetime.datetime:
+    return datetime.datetime(2026, 1, 1, 12, minute, tzinfo=datetime.UTC)
+
+
+async def test_login_tracker_coalesces_per_user():
+    tracker = LoginTracker(max_users=10, flush_interval=60.0)
+    user_id, other_id = uuid.uuid4(), uuid.uuid4()
+    tracker.record(user_id, at=at(2))
+    tracker.record(user_id, at=at(1))
+    tracker.record(user_id, login=False, at=at(3))
+    tracker.record(other_id, at=at(0))
+    assert len(tracker) == 2
+
+    sink = Sink()
+    await tracker.flush(sink)
+
+    assert sink.batches == [
+        {
+            user_id: LoginUpdate(last_login_at=at(3), logins=2),
+            other_id: LoginUpdate(last_login_at=at(0), logins=1),
+        }
+    ]
+    assert len(tracker) == 0
+
+
+async def test_login_tracker_keeps_failed_flushes():
+    tracker = LoginTracker(max_users=2, flush_interval=60.0)
+    user_id = uuid.uuid4()
+    tracker.record(user_id, at=at(1))
+    await tracker.flush(Sink(fail=True))
+
+    tracker.record(user_id, at=at(2))
+    tracker.record(uuid.uuid4(), at=at(2))
+    tracker.record(uuid.uuid4(), at=at(2))
+    assert len(tracker) == 2
+
+    sink = Sink()
+    await tracker.flush(sink)
+    assert sink.batches[0][user_id] == LoginUpdate(last_login_at=at(2), logins=2)
+
+
+async def test_login_tracker_keeps_unwritten_batches():
+    tracker = LoginTracker(max_users=10, flush_interval=60.0)
+    first_id, second_id = sorted([uuid.uuid4(), uuid.uuid4()])
+    tracker.record(first_id, at=at(1))
+    tracker.record(second_id, at=at(1))
+
+    sink = Sink(fail_after=1)
+    await tracker.flush(sink)
+    assert sink.batches == [{first_id: LoginUpdate(last_login_at=at(1), logins=1)}]
+    assert len(tracker) == 1
+
+    # Only the second batch is written again, the first login counts once.
+    sink = Sink()
+    await tracker.flush(sink)
+    assert sink.batches == [{second_id: LoginUpdate(last_login_at=at(1), logins=1)}]
+
+
+async def test_login_tracker_flushes_when_full_and_on_cancel():
+    tracker = LoginTracker(max_users=2, flush_interval=60.0)
+    sink = Sink()
+    task = asyncio.create_task(tracker.run(sink))
+
+    tracker.record(uuid.uuid4())
+    tracker.record(uuid.uuid4())
+    await asyncio.sleep(0.01)
+    assert [len(batch) for batch in sink.batches] == [2]
+
+    tracker.record(uuid.uuid4())
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert [len(batch) for batch in sink.batches] == [2, 1]
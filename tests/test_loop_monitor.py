@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+import pytest
+
+from pyservice.loop_monitor import LoopMonitor
+
+
+def block(seconds: float):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_logs_blocking_stack(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(
+        "pyservice.loop_monitor.logger.warning", lambda msg, *args: warnings.append(msg)
+    )
+
+    monitor = LoopMonitor(interval=0.01, stall_threshold=0.05)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+
+    block(0.2)
+    await asyncio.sleep(0.05)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert len(warnings) == 1
+    assert "in block" in warnings[0]
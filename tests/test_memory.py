@@ -0,0 +1,52 @@
+import pytest
+
+from pyservice.memory import (
+    CacheSize,
+    MemoryDiagnostics,
+    cache_sizes,
+    functools_cache_size,
+    register_cache,
+)
+
+
+def allocate() -> list[bytes]:
+    return [bytes(1000) for _ in range(1000)]
+
+
+def test_memory_diagnostics_diff():
+    diagnostics = MemoryDiagnostics(max_snapshots=2)
+    with pytest.raises(RuntimeError):
+        diagnostics.take_snapshot("before")
+
+    diagnostics.start()
+    try:
+        diagnostics.take_snapshot("before")
+        kept = allocate()
+        diagnostics.take_snapshot("after")
+
+        grown = diagnostics.diff("before", "after", limit=1)
+        assert "test_memory.py" in grown[0].location
+        assert grown[0].size_diff >= len(kept) * 1000
+        assert diagnostics.top("after", limit=1)[0].location == grown[0].location
+
+        diagnostics.take_snapshot("latest")
+        assert [info.name for info in diagnostics.snapshots()] == ["after", "latest"]
+        with pytest.raises(KeyError):
+            diagnostics.top("before")
+        with pytest.raises(ValueError):
+            diagnostics.take_snapshot("../escape")
+
+        assert diagnostics.status().traced_bytes > 0
+    finally:
+        diagnostics.stop()
+    assert not diagnostics.tracing
+    assert diagnostics.snapshots() == []
+
+
+def test_cache_sizes():
+    register_cache("test", lambda: CacheSize(entries=3, max_entries=10))
+    assert cache_sizes()["test"] == CacheSize(entries=3, max_entries=10)
+
+    from pyservice.auth.oidc import JWKSProvider
+
+    assert functools_cache_size(JWKSProvider.get_client).max_entries is None
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from collections import Counter
+
+import pytest
+
+from pyservice.profiling import (
+    ProfileStore,
+    SamplingProfiler,
+    sign_profile_request,
+    verify_profile_request,
+)
+
+
+def spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def handler():
+    spin(0.05)
+    await asyncio.sleep(0.05)
+
+
+@pytest.mark.asyncio
+async def test_sampling_profiler():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    await handler()
+    samples = profiler.stop()
+
+    running = sum(count for stack, count in samples.items() if "spin" in stack)
+    awaiting = sum(
+        count
+        for stack, count in samples.items()
+        if "handler" in stack and "[await" in stack
+    )
+    assert running > 0
+    assert awaiting > 0
+
+
+def test_profile_store_ring_buffer(tmp_path):
+    store = ProfileStore(tmp_path, max_profiles=2)
+    for i in range(3):
+        store.save("GET", f"/route/{i}", 0.01, Counter({"a;b": i + 1}))
+
+    profiles = store.list()
+    assert [profile.name.split("-")[2] for profile in profiles] == [
+        "route_2",
+        "route_1",
+    ]
+    path = store.path(profiles[0].name)
+    assert path is not None and path.read_text() == "a;b 3\n"
+    assert store.path("../" + profiles[0].name) is None
+
+
+def test_profile_request_signature():
+    key = b"profile-key"
+    valid = sign_profile_request(key, int(time.time()) + 60)
+
+    assert verify_profile_request(key, valid)
+    assert not verify_profile_request(b"other-key", valid)
+    assert not verify_profile_request(key, sign_profile_request(key, 1))
+    assert not verify_profile_request(key, "garbage")
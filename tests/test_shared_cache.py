@@ -0,0 +1,154 @@
+import json
+import multiprocessing
+import time
+from pathlib import Path
+
+import jwt.algorithms
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from pyservice.auth.oidc import SharedJWKClient
+from pyservice.shared_cache import SharedCache
+
+
+def open_cache(directory: Path | None) -> SharedCache:
+    return SharedCache("test", directory, slots=16, slot_size=256)
+
+
+def test_shared_cache():
+    cache = open_cache(None)
+    assert cache.get("a") is None
+
+    first = cache.set("a", b"1", ttl=60)
+    assert first is not None
+    assert cache.get("a") == first
+
+    second = cache.set("a", b"2", ttl=60)
+    assert second is not None and second.version > first.version
+    assert cache.get("a") == second
+
+    cache.delete("a")
+    assert cache.get("a") is None
+
+    assert cache.set("large", b"x" * 256, ttl=60) is None
+    assert cache.set("expired", b"1", ttl=-1) is not None
+    assert cache.get("expired") is None
+
+    cache.set("b", b"1", ttl=60)
+    assert cache.size().entries == 1
+    assert cache.size().max_entries == 16
+
+
+def test_shared_cache_evicts_first_to_expire():
+    cache = SharedCache("test", None, slots=8, slot_size=256)
+    for i in range(8):
+        cache.set(str(i), b"1", ttl=60 + i)
+    cache.set("new", b"1", ttl=60)
+
+    assert cache.get("new") is not None
+    assert cache.get("0") is None
+    assert all(cache.get(str(i)) is not None for i in range(1, 8))
+
+
+def write(directory: Path, key: str, value: bytes):
+    open_cache(directory).set(key, value, ttl=60)
+
+
+def fill(directory: Path, fetches: Path):
+    def fetch() -> bytes:
+        with fetches.open("a") as file:
+            file.write("fetch\n")
+        time.sleep(0.2)
+        return b"fetched"
+
+    assert open_cache(directory).fill("key", fetch, ttl=60).value == b"fetched"
+
+
+def test_shared_cache_across_processes(tmp_path: Path):
+    cache = open_cache(tmp_path)
+    process = multiprocessing.get_context("spawn").Process(
+        target=write, args=(tmp_path, "a", b"from another process")
+    )
+    process.start()
+    process.join()
+
+    entry = cache.get("a")
+    assert entry is not None and entry.value == b"from another process"
+    assert (tmp_path.stat().st_mode & 0o777) == 0o700
+
+
+def test_shared_cache_requires_private_directory(tmp_path: Path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o755)
+    shared.chmod(0o755)
+    with pytest.raises(PermissionError):
+        open_cache(shared)
+
+    (tmp_path / "link").symlink_to(tmp_path / "private", target_is_directory=True)
+    (tmp_path / "private").mkdir(mode=0o700)
+    with pytest.raises(PermissionError):
+        open_cache(tmp_path / "link")
+
+
+def test_shared_cache_does_not_follow_symlinks(tmp_path: Path):
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o700)
+    victim = tmp_path / "victim"
+    victim.write_bytes(b"keep me")
+    victim.chmod(0o600)
+    (directory / "test-16x256.cache").symlink_to(victim)
+
+    with pytest.raises(OSError):
+        open_cache(directory)
+    assert victim.read_bytes() == b"keep me"
+
+
+def test_shared_cache_fills_once(tmp_path: Path):
+    fetches = tmp_path / "fetches"
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=fill, args=(tmp_path / "cache", fetches))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert fetches.read_text() == "fetch\n"
+
+
+class CountingJWKClient(SharedJWKClient):
+    def __init__(self, cache: SharedCache, keys: list[dict]):
+        super().__init__("https://keys.test/", cache, lifespan=60)
+        self.keys = keys
+        self.fetches = 0
+
+    def fetch_data(self):
+        self.fetches += 1
+        return {"keys": self.keys}
+
+
+def public_jwk(kid: str) -> dict:
+    key = ec.generate_private_key(ec.SECP256R1()).public_key()
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(key))
+    return {**jwk, "kid": kid, "use": "sig", "alg": "ES256"}
+
+
+def test_shared_jwk_client():
+    cache = SharedCache("keys", None, slots=4, slot_size=4096)
+    keys = [public_jwk("1")]
+    first = CountingJWKClient(cache, keys)
+    second = CountingJWKClient(cache, keys)
+
+    assert first.get_signing_key("1").key_id == "1"
+    assert second.get_signing_key("1").key_id == "1"
+    assert (first.fetches, second.fetches) == (1, 0)
+
+    # A rotated key is fetched by the first client missing it, the second
+    # picks up the refreshed set.
+    keys.append(public_jwk("2"))
+    assert first.get_signing_key("2").key_id == "2"
+    assert second.get_signing_key("2").key_id == "2"
+    assert (first.fetches, second.fetches) == (2, 0)
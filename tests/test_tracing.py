@@ -0,0 +1,111 @@
+import json
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pyservice.api.middleware import TracingMiddleware
+from pyservice.tracing import (
+    OTLPFileExporter,
+    RingBufferExporter,
+    record_span,
+    span,
+    start_trace,
+)
+
+
+def test_span_outside_trace():
+    with span("outside") as outside:
+        assert outside is None
+    assert record_span("outside", 0, 1) is None
+
+
+def test_trace():
+    exporter = RingBufferExporter(max_traces=2)
+    root = start_trace(exporter, "GET /", sample_rate=1.0)
+    assert root is not None
+
+    with root as root_span:
+        with span("parent", key="value") as parent:
+            assert parent is not None
+            with span("child") as child:
+                assert child is not None
+            record_span("statement", 1, 2)
+        with pytest.raises(ValueError), span("failing"):
+            raise ValueError()
+
+    (trace,) = exporter.traces()
+    assert [s.name for s in trace] == [
+        "GET /",
+        "child",
+        "statement",
+        "parent",
+        "failing",
+    ]
+    assert {s.trace_id for s in trace} == {root_span.trace_id}
+    spans = {s.name: s for s in trace}
+    assert spans["parent"].parent_id == root_span.span_id
+    assert spans["child"].parent_id == spans["parent"].span_id
+    assert spans["statement"].parent_id == spans["parent"].span_id
+    assert spans["parent"].attributes == {"key": "value"}
+    assert spans["failing"].error == "ValueError"
+
+    with span("after") as after:
+        assert after is None
+
+
+def test_trace_sampling():
+    exporter = RingBufferExporter(max_traces=2)
+    assert start_trace(exporter, "GET /", sample_rate=0.0) is None
+
+    trace_id, parent_id = "a" * 32, "b" * 16
+    root = start_trace(
+        exporter, "GET /", sample_rate=0.0, traceparent=f"00-{trace_id}-{parent_id}-01"
+    )
+    assert root is not None
+    assert (root.span.trace_id, root.span.parent_id) == (trace_id, parent_id)
+
+    unsampled = f"00-{trace_id}-{parent_id}-00"
+    assert (
+        start_trace(exporter, "GET /", sample_rate=1.0, traceparent=unsampled) is None
+    )
+
+
+@pytest.mark.parametrize("parent_based", [False, True])
+def test_tracing_middleware_traceparent(parent_based: bool):
+    exporter = RingBufferExporter(max_traces=2)
+    app = FastAPI()
+    app.add_api_route("/", lambda: None)
+    app.add_middleware(
+        TracingMiddleware,
+        exporter=exporter,
+        sample_rate=0.0,
+        parent_based=parent_based,
+    )
+
+    traceparent = f"00-{'a' * 32}-{'b' * 16}-01"
+    response = TestClient(app).get("/", headers={"traceparent": traceparent})
+
+    assert response.status_code == 200
+    assert len(exporter.traces()) == int(parent_based)
+
+
+def test_otlp_file_exporter(tmp_path: Path):
+    path = tmp_path / "traces.jsonl"
+    root = start_trace(OTLPFileExporter(path), "GET /", sample_rate=1.0)
+    assert root is not None
+    with root:
+        with span("child", count=1, ok=True):
+            pass
+
+    (line,) = path.read_text().splitlines()
+    (resource_spans,) = json.loads(line)["resourceSpans"]
+    (scope_spans,) = resource_spans["scopeSpans"]
+    root_span, child = scope_spans["spans"]
+    assert "parentSpanId" not in root_span
+    assert child["parentSpanId"] == root_span["spanId"]
+    assert child["attributes"] == [
+        {"key": "count", "value": {"intValue": "1"}},
+        {"key": "ok", "value": {"boolValue": True}},
+    ]